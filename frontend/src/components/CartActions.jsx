@@ -5,6 +5,9 @@
  * - Petites fonctions utilitaires qui effectuent les appels réseau pour
  *   récupérer (`fetchCart`) et mettre à jour (`updateCart`) le panier d'un
  *   utilisateur via l'API REST backend (`api/cart/`).
+ * - `patchCart` envoie des opérations (add / set / remove / clear) plutôt que
+ *   le panier complet : les opérations émises en rafale (clics répétés) sont
+ *   regroupées pendant `PATCH_DELAY_MS` et envoyées en une seule requête PATCH.
  * - Gère l'ajout des en-têtes d'authentification (token standard ou token Google)
  *   nécessaires pour accéder aux endpoints protégés.
  */
@@ -50,4 +53,47 @@ export const updateCart =  async (cartItems) => {
     // Mise à jour du panier via l'API
     await api.put('api/cart/', { items: cartItems }, { headers });  // Requête PUT avec les nouveaux articles
     
-}
\ No newline at end of file
+}
+
+// =============================================================================
+// OPÉRATIONS REGROUPÉES (PATCH)
+// =============================================================================
+const PATCH_DELAY_MS = 300;  // Fenêtre de regroupement des opérations
+let pendingOps = [];  // Opérations en attente d'envoi
+let pendingWaiters = [];  // Promesses des appelants, résolues à l'envoi
+let flushTimer = null;
+
+// Envoi des opérations en attente en une seule requête PATCH
+const flushPatch = async () => {
+    const ops = pendingOps;
+    const waiters = pendingWaiters;
+    pendingOps = [];
+    pendingWaiters = [];
+    flushTimer = null;
+
+    const accessToken = localStorage.getItem(ACCESS_TOKEN);  // Token JWT standard
+    const googleAccessToken = localStorage.getItem(GOOGLE_ACCESS_TOKEN);  // Token Google OAuth
+    const headers = {};
+    if (accessToken) {
+        headers.Authorization = `Bearer ${accessToken}`;
+    } else if (googleAccessToken) {
+        headers['X-Google-Access-Token'] = googleAccessToken;
+    }
+    try {
+        if (!headers.Authorization && !headers['X-Google-Access-Token']) {
+            throw new Error('No access token found');  // Erreur si aucun token disponible
+        }
+        const response = await api.patch('api/cart/', { ops }, { headers });  // Une requête pour toute la rafale
+        waiters.forEach(({ resolve }) => resolve(response.data.items));
+    } catch (e) {
+        waiters.forEach(({ reject }) => reject(e));
+    }
+};
+
+// Ajout d'opérations au lot en cours ; résolue avec les articles renvoyés par le serveur
+export const patchCart = (ops) => {
+    pendingOps.push(...ops);
+    if (flushTimer) clearTimeout(flushTimer);
+    flushTimer = setTimeout(flushPatch, PATCH_DELAY_MS);
+    return new Promise((resolve, reject) => pendingWaiters.push({ resolve, reject }));
+};
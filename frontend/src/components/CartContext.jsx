@@ -4,20 +4,22 @@
  * Description (FR):
  * - Fournit un contexte React (CartContext) pour partager l'état du panier
  *   dans l'application (ajout, suppression, mise à jour de quantité, vidage).
- * - Synchronise le panier avec l'API backend via `fetchCart` et `updateCart`.
+ * - Synchronise le panier avec l'API backend via `fetchCart` et `patchCart` :
+ *   chaque action envoie une opération (add / set / remove / clear) appliquée
+ *   côté serveur, et non le panier complet.
  * - Normalise les URLs d'images pour s'assurer que `item.image` est une URL
  *   absolue (préfixe `VITE_API_URL` si nécessaire), afin que les images soient
  *   affichées correctement dans le panier et lors du checkout.
  *
  * Interactions principales :
  * - Appels réseau : `frontend/src/components/CartActions.jsx` utilise `api.js`
- *   pour GET/PUT sur `api/cart/` (endpoints définis dans `api/views.py`).
+ *   pour GET/PATCH sur `api/cart/` (endpoints définis dans `api/views.py`).
  * - Les composants consommateurs (Cart.jsx, Checkout.jsx, Navbar.jsx) lisent
  *   `state.cart` et appellent les fonctions exposées par le contexte.
  */
 
 import React, { createContext, useContext, useEffect, useReducer } from 'react';
-import { fetchCart, updateCart } from './CartActions';  // Fonctions pour les appels API panier
+import { fetchCart, patchCart } from './CartActions';  // Fonctions pour les appels API panier
 
 // Création du contexte pour le panier
 const CartContext = createContext();
@@ -122,7 +124,10 @@ export const CartProvider = ({ children }) => {
         }
         dispatch({ type: "SET_CART", payload: newCart });
         try {
-            await updateCart(newCart);  // Synchronisation avec l'API
+            await patchCart([{  // Synchronisation avec l'API
+                op: 'add', product_id: item.id, quantity: quantityToAdd,
+                name: itemNormalized.name, price: itemNormalized.price, image: itemNormalized.image,
+            }]);
         } catch (e) {
             console.error('Failed to sync cart after add:', e);
         }
@@ -133,7 +138,7 @@ export const CartProvider = ({ children }) => {
         const newCart = state.cart.filter(item => item.id !== id);
         dispatch({ type: "SET_CART", payload: newCart });
         try {
-            await updateCart(newCart);  // Synchronisation avec l'API
+            await patchCart([{ op: 'remove', product_id: id }]);  // Synchronisation avec l'API
         } catch (e) {
             console.error('Failed to sync cart after remove:', e);
         }
@@ -153,7 +158,8 @@ export const CartProvider = ({ children }) => {
         }
         dispatch({ type: "SET_CART", payload: newCart });
         try {
-            await updateCart(newCart);  // Synchronisation avec l'API
+            const quantity = newCart[itemIndex]?.id === id ? newCart[itemIndex].quantity : 0;
+            await patchCart([{ op: 'set', product_id: id, quantity }]);  // Synchronisation avec l'API
         } catch (e) {
             console.error('Failed to sync cart after decrease quantity:', e);
         }
@@ -167,7 +173,7 @@ export const CartProvider = ({ children }) => {
         newCart[itemIndex] = { ...newCart[itemIndex], quantity: (newCart[itemIndex].quantity || 0) + 1 };
         dispatch({ type: "SET_CART", payload: newCart });
         try {
-            await updateCart(newCart);  // Synchronisation avec l'API
+            await patchCart([{ op: 'add', product_id: id, quantity: 1 }]);  // Synchronisation avec l'API
         } catch (e) {
             console.error('Failed to sync cart after increase quantity:', e);
         }
@@ -177,7 +183,7 @@ export const CartProvider = ({ children }) => {
     const clearCart = async () => {
         dispatch({ type: "SET_CART", payload: [] });
         try {
-            await updateCart([]);  // Synchronisation avec l'API
+            await patchCart([{ op: 'clear' }]);  // Synchronisation avec l'API
         } catch (e) {
             console.error('Failed to sync cart after clear:', e);
         }
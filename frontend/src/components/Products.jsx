@@ -137,7 +137,7 @@ const Products = () => {
                                 />
                             </div>
                             <h3>{product.name}</h3>  {/* Nom du produit */}
-                            <p>{truncate(product.description, 20)}</p>  {/* Description tronquée */}
+                            <p>{truncate(product.summary, 20)}</p>  {/* Début de la description, tronqué */}
                             <p><strong>Prix:</strong>{product.price} XOF</p>  {/* Prix */}
                             <p><strong>Avis:</strong>{product.review_count || 0} Avis</p>  {/* Nombre d'avis */}
                             <p><strong>Notation:</strong>{product.average_rating || "Pas encore de note"}</p>  {/* Note moyenne */}
@@ -20,7 +20,8 @@ Personnalisations possibles :
 from django.contrib import admin
 
 # Import des modèles de l'application api
-from .models import Product, Cart, Order, Review
+from .models import Product, Cart, Order, OrderItem, Review
+from .checkout import cancel_order
 
 
 # =============================================================================
@@ -40,10 +41,31 @@ admin.site.register(Cart)
 # Permissions : Surveiller l'activité des paniers
 
 # Commandes - Historique des commandes passées
-admin.site.register(Order)
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    """
+    Statut et paiement en lecture seule : ils pilotent le stock réservé
+    (`api/checkout.py`) ; l'annulation passe par l'action dédiée, qui rend le stock
+    """
+    list_display = ('id', 'user', 'status', 'payment_completed', 'refund_required', 'total_price', 'created_at')
+    list_filter = ('status', 'payment_completed', 'refund_required')
+    readonly_fields = (
+        'status', 'payment_completed', 'refund_required', 'payement_id', 'reserved_until', 'total_price',
+    )
+    actions = ['cancel_orders']
+
+    @admin.action(description='Annuler les commandes impayées (stock rendu)')
+    def cancel_orders(self, request, queryset):
+        cancelled = sum(cancel_order(order) for order in queryset)
+        self.message_user(request, f'{cancelled} commande(s) annulée(s)')
 # Utilisation : Gestion des commandes, suivi du statut
 # Accès : /admin/api/order/
-# Permissions : Mettre à jour le statut des commandes
+# Permissions : Annuler les commandes impayées
+
+# Lignes de commande - Table normalisée des produits commandés
+admin.site.register(OrderItem)
+# Utilisation : Consulter les ventes par produit
+# Accès : /admin/api/orderitem/
 
 # Avis - Commentaires et notations des produits
 admin.site.register(Review)
@@ -46,21 +46,14 @@ class ApiConfig(AppConfig):
     name = 'api'
     
     # =========================================================================
-    # MÉTHODE READY() (PERSONNALISATION POSSIBLE)
+    # MÉTHODE READY()
     # =========================================================================
-    # Décommentez pour exécuter du code au chargement de l'application
-    # def ready(self):
-    #     """
-    #     Méthode appelée quand Django a chargé l'application
-    #     Utilisations courantes :
-    #     - Importer et enregistrer les signaux (signals)
-    #     - Initialiser des services externes
-    #     - Charger des données de configuration
-    #     - Vérifier les dépendances
-    #     """
-    #     # Exemple : import des signaux
-    #     from . import signals
-    #     
-    #     # Exemple : initialisation du système de recommandations
-    #     from .recs_tfidf import initialize_recommendation_system
-    #     initialize_recommendation_system()
\ No newline at end of file
+    def ready(self):
+        """
+        Méthode appelée quand Django a chargé l'application
+
+        Importe `api/signals.py` pour enregistrer les récepteurs :
+        - création du panier des nouveaux utilisateurs
+        - maintenance incrémentale de l'index TF-IDF (Product créé/modifié/supprimé)
+        """
+        from . import signals  # noqa: F401 (enregistre les récepteurs)
@@ -0,0 +1,276 @@
+"""
+Fichier: api/cart.py
+
+Description (FR):
+- Modifications du panier par opérations (« deltas ») au lieu du remplacement
+    complet du JSON `Cart.items` :
+    - {"op": "add", "product_id": 1, "quantity": 2} : ajoute (ou augmente) ;
+    - {"op": "set", "product_id": 1, "quantity": 5} : fixe la quantité (0 = retire) ;
+    - {"op": "remove", "product_id": 1} : retire l'article ;
+    - {"op": "clear"} : vide le panier.
+- Les opérations d'une requête sont regroupées (coalescence) : plusieurs clics
+    sur un même produit ne produisent qu'une écriture, et aucune écriture si le
+    panier final est identique.
+- Concurrence optimiste : `Cart.version` est incrémenté à chaque écriture par
+    un UPDATE conditionnel (`WHERE version = lue`), sans verrou de ligne :
+    - si le client fournit la version qu'il a lue (en-tête `If-Match` ou champ
+        `version`), une écriture concurrente provoque `CartConflict` ;
+    - sinon, les opérations (commutatives) sont réappliquées sur le panier relu.
+- Panier « hydraté » (`GET /api/cart/?expand=products`) : les produits de tous
+    les articles sont lus en une requête `id__in` ; chaque ligne porte le prix
+    courant, son total et un statut (disponible, stock insuffisant, rupture,
+    produit supprimé). Les montants sont calculés en `Decimal` côté serveur et
+    sérialisés en chaînes, comme les `DecimalField` de DRF.
+
+Comment ce fichier se connecte :
+- Utilisé par `CartView.retrieve` / `CartView.patch` / `CartView.put` (`api/views.py`).
+"""
+
+from decimal import Decimal
+
+from django.db.models import F
+
+from .models import Cart, Product
+
+OPS = ('add', 'set', 'remove', 'clear')
+MAX_OPS = 100  # Opérations par requête
+MAX_QUANTITY = 1000  # Quantité maximale d'un article
+DISPLAY_FIELDS = ('name', 'price', 'image')  # Champs d'affichage conservés par le frontend
+MAX_RETRIES = 5  # Réapplications en cas d'écriture concurrente (sans version imposée)
+CENTS = Decimal('0.01')
+
+# Statuts d'une ligne du panier hydraté
+LINE_OK = 'ok'
+LINE_INSUFFICIENT_STOCK = 'insufficient_stock'  # Stock inférieur à la quantité demandée
+LINE_OUT_OF_STOCK = 'out_of_stock'
+LINE_DELETED = 'deleted'  # Produit supprimé du catalogue
+
+
+class CartOpError(ValueError):
+    """Opération de panier invalide"""
+
+
+class CartConflict(Exception):
+    """Le panier a été modifié depuis la version lue par le client"""
+
+    def __init__(self, cart):
+        super().__init__('Cart was modified concurrently')
+        self.cart = cart
+
+
+def item_product_id(item):
+    """ID produit d'un article (`product_id`, ou `id` pour les articles du frontend)"""
+    if not isinstance(item, dict):
+        return None
+    return item.get('product_id', item.get('id'))
+
+
+def _quantity(op, minimum):
+    quantity = op.get('quantity', 1 if op['op'] == 'add' else None)
+    if isinstance(quantity, bool) or not isinstance(quantity, int) or not minimum <= quantity <= MAX_QUANTITY:
+        raise CartOpError(f"quantity must be an integer between {minimum} and {MAX_QUANTITY}")
+    return quantity
+
+
+def validate_ops(ops):
+    """
+    Valide et normalise une liste d'opérations
+
+    Raises:
+        CartOpError: Liste, opération, produit ou quantité invalide
+    """
+    if not isinstance(ops, list) or not ops:
+        raise CartOpError('ops must be a non-empty list')
+    if len(ops) > MAX_OPS:
+        raise CartOpError(f'at most {MAX_OPS} ops per request')
+    normalized = []
+    for op in ops:
+        if not isinstance(op, dict) or op.get('op') not in OPS:
+            raise CartOpError(f"each op must be an object with 'op' in {', '.join(OPS)}")
+        if op['op'] == 'clear':
+            normalized.append({'op': 'clear'})
+            continue
+        product_id = op.get('product_id')
+        if isinstance(product_id, bool) or not isinstance(product_id, int) or product_id <= 0:
+            raise CartOpError('product_id must be a positive integer')
+        entry = {'op': op['op'], 'product_id': product_id}
+        if op['op'] in ('add', 'set'):
+            entry['quantity'] = _quantity(op, 1 if op['op'] == 'add' else 0)
+        if op['op'] == 'add':
+            entry['display'] = {key: op[key] for key in DISPLAY_FIELDS if key in op}
+        normalized.append(entry)
+    return normalized
+
+
+def apply_ops(items, ops):
+    """
+    Applique des opérations validées à une liste d'articles (sans la modifier)
+
+    L'ordre des articles est conservé ; un nouvel article est ajouté à la fin.
+
+    Returns:
+        list: Nouvelle liste d'articles
+    """
+    order = []  # IDs produits, dans l'ordre du panier
+    lines = {}  # product_id -> article
+    for item in items or []:
+        product_id = item_product_id(item)
+        if product_id is None or product_id in lines:
+            continue
+        order.append(product_id)
+        lines[product_id] = dict(item)
+
+    for op in ops:
+        if op['op'] == 'clear':
+            order, lines = [], {}
+            continue
+        product_id = op['product_id']
+        line = lines.get(product_id)
+        if op['op'] == 'remove' or (op['op'] == 'set' and op['quantity'] == 0):
+            if line is not None:
+                del lines[product_id]
+                order.remove(product_id)
+        elif line is not None:
+            quantity = line.get('quantity') or 0
+            line['quantity'] = min(MAX_QUANTITY, quantity + op['quantity'] if op['op'] == 'add' else op['quantity'])
+        else:
+            lines[product_id] = {
+                'product_id': product_id, 'id': product_id,
+                **op.get('display', {}), 'quantity': op['quantity'],
+            }
+            order.append(product_id)
+    return [lines[product_id] for product_id in order]
+
+
+def patch_cart(user, ops, expected_version=None):
+    """
+    Applique des opérations au panier d'un utilisateur (écriture conditionnelle)
+
+    Args:
+        user: Propriétaire du panier
+        ops (list): Opérations validées (`validate_ops`)
+        expected_version (int | None): Version lue par le client, si imposée
+
+    Returns:
+        Cart: Le panier après écriture (ou inchangé si les opérations n'ont aucun effet)
+
+    Raises:
+        CartConflict: La version imposée n'est plus la version courante
+    """
+    cart, _ = Cart.objects.get_or_create(user=user)
+    for _ in range(MAX_RETRIES):
+        if expected_version is not None and cart.version != expected_version:
+            raise CartConflict(cart)
+        items = apply_ops(cart.items, ops)
+        if items == cart.items:
+            return cart  # Coalescence : rien à écrire
+        updated = Cart.objects.filter(pk=cart.pk, version=cart.version).update(
+            items=items, version=F('version') + 1,
+        )
+        if updated:
+            cart.items = items
+            cart.version += 1
+            return cart
+        cart.refresh_from_db()  # Écriture concurrente : relit et réapplique
+    raise CartConflict(cart)
+
+
+def replace_cart(user, items, expected_version=None):
+    """
+    Remplace tout le contenu du panier (PUT, comportement historique)
+
+    Sans version imposée, le remplacement est inconditionnel ; avec une version,
+    il échoue par `CartConflict` si le panier a changé depuis.
+    """
+    cart, _ = Cart.objects.get_or_create(user=user)
+    if items == cart.items and expected_version in (None, cart.version):
+        return cart
+    carts = Cart.objects.filter(pk=cart.pk)
+    if expected_version is not None:
+        carts = carts.filter(version=expected_version)
+    if not carts.update(items=items, version=F('version') + 1):
+        cart.refresh_from_db()
+        raise CartConflict(cart)
+    cart.refresh_from_db()
+    return cart
+
+
+# =============================================================================
+# PANIER HYDRATÉ
+# =============================================================================
+def _money(amount):
+    return str(amount.quantize(CENTS))
+
+
+def _line_quantity(item):
+    quantity = item.get('quantity')
+    if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 0:
+        return 0
+    return quantity
+
+
+def hydrate_items(items, request=None):
+    """
+    Résout les produits des articles d'un panier (une seule requête)
+
+    Les lignes en rupture ou dont le produit a été supprimé n'entrent pas dans
+    le total ; une ligne en stock insuffisant y entre pour la quantité demandée.
+
+    Args:
+        items (list): Articles du panier (`Cart.items`)
+        request: Requête, pour les URLs absolues des images
+
+    Returns:
+        dict: {'lines': [...], 'total': str, 'item_count': int, 'has_issues': bool}
+    """
+    items = [item for item in items or [] if item_product_id(item) is not None]
+    ids = {item_product_id(item) for item in items}
+    products = Product.objects.only('id', 'name', 'price', 'quantity', 'image').in_bulk(
+        [product_id for product_id in ids if isinstance(product_id, int)]
+    )
+
+    lines = []
+    total = Decimal('0')
+    item_count = 0
+    for item in items:
+        product_id = item_product_id(item)
+        quantity = _line_quantity(item)
+        product = products.get(product_id)
+        if product is None:
+            lines.append({
+                'product_id': product_id, 'quantity': quantity, 'status': LINE_DELETED,
+                'product': None, 'unit_price': None, 'line_total': None, 'price_changed': False,
+            })
+            continue
+
+        if product.quantity == 0:
+            status = LINE_OUT_OF_STOCK
+        elif product.quantity < quantity:
+            status = LINE_INSUFFICIENT_STOCK
+        else:
+            status = LINE_OK
+        line_total = product.price * quantity
+        if status != LINE_OUT_OF_STOCK:
+            total += line_total
+            item_count += quantity
+
+        image = product.image.url if product.image else None
+        if image and request is not None:
+            image = request.build_absolute_uri(image)
+        try:
+            price_changed = 'price' in item and Decimal(str(item['price'])) != product.price
+        except ArithmeticError:
+            price_changed = True
+        lines.append({
+            'product_id': product_id, 'quantity': quantity, 'status': status,
+            'product': {'id': product.pk, 'name': product.name, 'image': image, 'stock': product.quantity},
+            'unit_price': _money(product.price), 'line_total': _money(line_total),
+            'price_changed': price_changed,  # Prix mémorisé par le client différent du prix courant
+        })
+
+    return {
+        'lines': lines,
+        'total': _money(total),
+        'item_count': item_count,
+        'has_issues': any(line['status'] != LINE_OK for line in lines),
+    }
@@ -0,0 +1,347 @@
+"""
+Fichier: api/catalog.py
+
+Description (FR):
+- Instantané en mémoire du catalogue, stocké par colonnes (tableaux NumPy), pour
+    les chemins de lecture chauds : les filtres « prix à +/-30 % », « mieux
+    notés » ou « produits contenant ce mot » deviennent des opérations
+    vectorisées au lieu de requêtes ou de boucles sur des instances ORM.
+- Colonnes (une ligne par produit, triées par ID) :
+    - `ids`, `price_cents` (prix en centimes, entiers : comparaisons exactes),
+        `stock`, `rating_count`, `rating_sum`, `created_at` (datetime64[us]) ;
+    - `alive` : False pour un produit supprimé depuis le dernier chargement ;
+    - `postings` : mot du nom -> lignes (int32 triées) des produits qui le contiennent.
+- Versionnement : chaque modification d'un produit ou de ses avis incrémente
+    le compteur `CatalogVersion` et ajoute une ligne au journal `CatalogChange`
+    avec la nouvelle version, dans la transaction de l'écriture. Le verrou de
+    la ligne du compteur ordonne les versions comme les commits : la version
+    lue couvre toutes les modifications validées de version inférieure.
+- Rafraîchissement :
+    - au plus une requête de version toutes les `CATALOG_SNAPSHOT_MAX_AGE`
+        secondes (immédiatement dans le processus qui vient d'écrire) ;
+    - incrémental : seuls les produits modifiés depuis la version sont relus,
+        appliqués sur une copie des tableaux, puis l'instantané est remplacé
+        d'un bloc (les lecteurs en cours gardent une vue cohérente) ;
+    - complet au premier appel, après une écriture en masse (`product_id` NULL),
+        un élagage du journal au-delà de la version, ou au plus tard toutes
+        les `CATALOG_SNAPSHOT_FULL_REFRESH` secondes (rattrape une écriture
+        non journalisée, ex : `QuerySet.update`).
+
+Comment ce fichier se connecte :
+- `api/signals.py` appelle `record_change()` sur les modifications de Product
+    et de Review ; `repair_rating_aggregates` enregistre un changement global.
+- `api/recs_heuristic.py` calcule les recommandations heuristiques sur l'instantané.
+"""
+
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CatalogChange, CatalogVersion, Product
+from .suggest import tokenize
+
+CHANGES_KEPT = 10000  # Lignes conservées dans le journal lors d'un élagage
+PRUNE_EVERY = 1000  # Élagage du journal toutes les N modifications
+CHUNK_SIZE = 5000  # Produits lus par lot lors d'un chargement complet
+COLUMNS = ('id', 'price', 'quantity', 'rating_count', 'rating_sum', 'created_at', 'name')
+EMPTY_ROWS = np.empty(0, dtype=np.int32)
+
+
+def _cents(price):
+    """Prix Decimal -> centimes entiers"""
+    return int(round(price * 100))
+
+
+def _timestamp(value):
+    """datetime (aware ou naïf) -> datetime64[us] UTC naïf"""
+    if value is None:
+        return np.datetime64('NaT', 'us')
+    if value.tzinfo is not None:
+        value = value.replace(tzinfo=None) - value.utcoffset()
+    return np.datetime64(value, 'us')
+
+
+class CatalogSnapshot:
+    """
+    Colonnes du catalogue à une version donnée (immuable une fois publié)
+
+    Attributs :
+        version (int): Version du catalogue (`CatalogVersion`) prise en compte
+        loaded_at (float): Instant (monotonic) du dernier chargement complet
+        names (list): Nom de chaque ligne (pour reconstruire les mots d'un produit modifié)
+    """
+
+    def __init__(self, rows, version, loaded_at=None):
+        """
+        Args:
+            rows: Itérable de tuples `COLUMNS`, triés par ID
+            version (int): Version du journal lue avant les produits
+        """
+        ids, prices, stock, counts, sums, created, names = [], [], [], [], [], [], []
+        for product_id, price, quantity, rating_count, rating_sum, created_at, name in rows:
+            ids.append(product_id)
+            prices.append(_cents(price))
+            stock.append(quantity)
+            counts.append(rating_count)
+            sums.append(rating_sum)
+            created.append(_timestamp(created_at))
+            names.append(name)
+        self.ids = np.array(ids, dtype=np.int64)
+        self.price_cents = np.array(prices, dtype=np.int64)
+        self.stock = np.array(stock, dtype=np.int64)
+        self.rating_count = np.array(counts, dtype=np.int64)
+        self.rating_sum = np.array(sums, dtype=np.int64)
+        self.created_at = np.array(created, dtype='datetime64[us]')
+        self.alive = np.ones(len(ids), dtype=bool)
+        self.names = names
+        self.postings = _build_postings(names)
+        self.version = version
+        self.loaded_at = time.monotonic() if loaded_at is None else loaded_at
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    # -------------------------------------------------------------------------
+    # Lectures vectorisées
+    # -------------------------------------------------------------------------
+    def row_of(self, product_id):
+        """Ligne d'un produit présent, ou None"""
+        if product_id is None:
+            return None
+        row = int(np.searchsorted(self.ids, product_id))
+        if row < len(self.ids) and self.ids[row] == product_id and self.alive[row]:
+            return row
+        return None
+
+    def price_between(self, low_cents, high_cents):
+        """Masque des produits dont le prix (en centimes) est dans [low, high]"""
+        return self.alive & (self.price_cents >= low_cents) & (self.price_cents <= high_cents)
+
+    def rows_with_tokens(self, words):
+        """Lignes (triées, sans doublon) des produits dont le nom contient l'un des mots"""
+        lists = [self.postings[word] for word in words if word in self.postings]
+        if not lists:
+            return EMPTY_ROWS
+        rows = np.unique(np.concatenate(lists))
+        return rows[self.alive[rows]]
+
+    def average_ratings(self):
+        """Note moyenne de chaque ligne (NaN sans avis)"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.rating_count > 0, self.rating_sum / self.rating_count, np.nan)
+
+    def top_rated(self, limit, exclude=None):
+        """
+        IDs des produits les mieux notés (moyenne décroissante, sans avis en
+        dernier, puis ID croissant)
+
+        Args:
+            limit (int): Nombre d'IDs à renvoyer
+            exclude: Masque booléen des lignes à écarter
+        """
+        eligible = self.alive if exclude is None else self.alive & ~exclude
+        rows = np.flatnonzero(eligible)
+        averages = self.average_ratings()[rows]
+        rated = ~np.isnan(averages)
+        # lexsort : la dernière clé est la clé principale
+        order = np.lexsort((self.ids[rows], -np.where(rated, averages, 0), ~rated))
+        return self.ids[rows[order[:limit]]].tolist()
+
+    # -------------------------------------------------------------------------
+    # Mise à jour incrémentale
+    # -------------------------------------------------------------------------
+    def apply(self, rows, removed_ids, version):
+        """
+        Nouvel instantané avec des produits modifiés ou supprimés
+
+        Args:
+            rows: Tuples `COLUMNS` des produits modifiés ou créés
+            removed_ids: IDs des produits supprimés
+            version (int): Nouvelle version
+
+        Returns:
+            CatalogSnapshot | None: None si une reconstruction complète est
+            nécessaire (produit inséré au milieu des IDs existants)
+        """
+        rows = sorted(rows)
+        last_id = int(self.ids[-1]) if len(self.ids) else 0
+        existing = [row for row in rows if row[0] <= last_id]
+        appended = [row for row in rows if row[0] > last_id]
+
+        snapshot = object.__new__(CatalogSnapshot)
+        snapshot.version = version
+        snapshot.loaded_at = self.loaded_at
+        snapshot.postings = dict(self.postings)
+        snapshot.names = list(self.names)
+        for column in ('ids', 'price_cents', 'stock', 'rating_count', 'rating_sum', 'created_at', 'alive'):
+            setattr(snapshot, column, getattr(self, column).copy())
+
+        renamed = {}  # ligne -> (ancien nom, nouveau nom)
+        for product_id, price, quantity, rating_count, rating_sum, created_at, name in existing:
+            row = int(np.searchsorted(self.ids, product_id))
+            if row == len(self.ids) or self.ids[row] != product_id:
+                return None
+            snapshot.price_cents[row] = _cents(price)
+            snapshot.stock[row] = quantity
+            snapshot.rating_count[row] = rating_count
+            snapshot.rating_sum[row] = rating_sum
+            snapshot.created_at[row] = _timestamp(created_at)
+            if not snapshot.alive[row] or snapshot.names[row] != name:
+                renamed[row] = (snapshot.names[row] if snapshot.alive[row] else None, name)
+            snapshot.alive[row] = True
+            snapshot.names[row] = name
+        for product_id in removed_ids:
+            row = int(np.searchsorted(self.ids, product_id))
+            if row < len(self.ids) and self.ids[row] == product_id and snapshot.alive[row]:
+                snapshot.alive[row] = False
+                renamed[row] = (snapshot.names[row], None)
+
+        if appended:
+            tail = CatalogSnapshot(appended, version)
+            offset = len(snapshot.ids)
+            for column in ('ids', 'price_cents', 'stock', 'rating_count', 'rating_sum', 'created_at', 'alive'):
+                setattr(snapshot, column, np.concatenate([getattr(snapshot, column), getattr(tail, column)]))
+            snapshot.names.extend(tail.names)
+            for i, name in enumerate(tail.names):
+                renamed[offset + i] = (None, name)
+
+        _update_postings(snapshot.postings, renamed)
+        return snapshot
+
+
+def _build_postings(names):
+    """mot -> lignes (int32 triées) des noms qui le contiennent"""
+    postings = {}
+    for row, name in enumerate(names):
+        for word in set(tokenize(name)):
+            postings.setdefault(word, []).append(row)
+    return {word: np.array(rows, dtype=np.int32) for word, rows in postings.items()}
+
+
+def _update_postings(postings, renamed):
+    """Répercute des changements de noms (None = absent) sur les listes de mots"""
+    removals, additions = {}, {}
+    for row, (before, after) in renamed.items():
+        old_words = set(tokenize(before)) if before is not None else set()
+        new_words = set(tokenize(after)) if after is not None else set()
+        for word in old_words - new_words:
+            removals.setdefault(word, []).append(row)
+        for word in new_words - old_words:
+            additions.setdefault(word, []).append(row)
+    for word in removals.keys() | additions.keys():
+        rows = postings.get(word, EMPTY_ROWS)
+        if word in removals:
+            rows = np.setdiff1d(rows, removals[word], assume_unique=True)
+        if word in additions:
+            rows = np.union1d(rows, np.array(additions[word], dtype=np.int32))
+        if len(rows):
+            postings[word] = rows.astype(np.int32, copy=False)
+        else:
+            postings.pop(word, None)
+
+
+# =============================================================================
+# JOURNAL DES MODIFICATIONS
+# =============================================================================
+def record_change(product_id=None):
+    """
+    Enregistre la modification d'un produit (None = tout le catalogue)
+
+    Appelée dans la transaction de l'écriture : la version n'avance que si
+    l'écriture est validée, et la ligne du compteur reste verrouillée jusqu'au
+    commit (les écritures concurrentes obtiennent les versions suivantes dans
+    l'ordre de leurs commits). L'instantané du processus courant est marqué
+    périmé après le commit.
+    """
+    with transaction.atomic():
+        counter = CatalogVersion.objects.filter(pk=1)
+        if not counter.update(version=F('version') + 1, updated_at=timezone.now()):
+            CatalogVersion.objects.get_or_create(pk=1)  # Table vidée (tests, base recréée)
+            counter.update(version=F('version') + 1, updated_at=timezone.now())
+        version = counter.values_list('version', flat=True).get()
+        change = CatalogChange.objects.create(product_id=product_id, version=version)
+        if version % PRUNE_EVERY == 0:
+            CatalogChange.objects.filter(version__lte=version - CHANGES_KEPT).delete()
+    transaction.on_commit(mark_stale)
+    return change
+
+
+# =============================================================================
+# INSTANTANÉ DU PROCESSUS
+# =============================================================================
+_snapshot = None
+_checked_at = 0.0  # Dernière lecture de la version (monotonic)
+_stale = False
+_lock = threading.Lock()
+
+
+def mark_stale():
+    """Force la vérification de la version au prochain `get_snapshot()`"""
+    global _stale
+    _stale = True
+
+
+def current_state():
+    """(version, date) de la dernière modification validée ((0, None) si aucune)"""
+    return CatalogVersion.objects.filter(pk=1).values_list('version', 'updated_at').first() or (0, None)
+
+
+def _current_version():
+    """Dernière version validée du catalogue"""
+    return current_state()[0]
+
+
+def _load():
+    """Chargement complet : version lue avant les produits (jamais en avance)"""
+    version = _current_version()
+    rows = Product.objects.order_by('id').values_list(*COLUMNS).iterator(chunk_size=CHUNK_SIZE)
+    return CatalogSnapshot(rows, version)
+
+
+def _refresh(snapshot):
+    """Applique les changements postérieurs à l'instantané (ou recharge tout)"""
+    full_refresh = getattr(settings, 'CATALOG_SNAPSHOT_FULL_REFRESH', 300)
+    if time.monotonic() - snapshot.loaded_at > full_refresh:
+        return _load()
+    version = _current_version()
+    if version == snapshot.version:
+        return snapshot
+    changes = list(
+        CatalogChange.objects.filter(version__gt=snapshot.version, version__lte=version)
+        .values_list('product_id', flat=True)
+    )
+    # Versions sans trou : une ligne manquante signifie un journal élagué au-delà
+    # de l'instantané (ou une base recréée)
+    if len(changes) != version - snapshot.version or None in changes:
+        return _load()  # Journal incomplet, ou écriture en masse
+    changed = set(changes)
+    rows = list(Product.objects.filter(pk__in=changed).order_by('id').values_list(*COLUMNS))
+    removed = changed - {row[0] for row in rows}
+    return snapshot.apply(rows, removed, version) or _load()
+
+
+def get_snapshot():
+    """
+    Instantané du catalogue du processus courant
+
+    Construit au premier appel, puis rafraîchi quand la version du catalogue a
+    avancé (vérifiée au plus toutes les `CATALOG_SNAPSHOT_MAX_AGE` secondes).
+    """
+    global _snapshot, _checked_at, _stale
+    snapshot = _snapshot
+    max_age = getattr(settings, 'CATALOG_SNAPSHOT_MAX_AGE', 1.0)
+    if snapshot is not None and not _stale and time.monotonic() - _checked_at < max_age:
+        return snapshot
+    with _lock:
+        if _snapshot is None:
+            _snapshot = _load()
+        elif _stale or time.monotonic() - _checked_at >= max_age:
+            _stale = False
+            _snapshot = _refresh(_snapshot)
+        _checked_at = time.monotonic()
+        return _snapshot
@@ -0,0 +1,291 @@
+"""
+Fichier: api/checkout.py
+
+Description (FR):
+- Passage de commande transactionnel, sans survente :
+    - les prix viennent de la base (`Decimal`), jamais du client : les lignes
+        envoyées ne fournissent que `product_id` (ou `id`) et `quantity` ;
+    - le stock est réservé par un UPDATE conditionnel par produit
+        (`SET quantity = quantity - n WHERE quantity >= n`) : la base arbitre
+        les acheteurs simultanés, sans lecture préalable ni verrou applicatif ;
+    - les produits sont réservés par ID croissant : deux paniers qui se
+        recouvrent prennent les verrous de ligne dans le même ordre (pas
+        d'interblocage) ;
+    - tout se fait dans une transaction : si un produit manque, les réservations
+        déjà faites sont annulées avec elle.
+- Réservation à durée limitée : une commande impayée garde son stock jusqu'à
+    `Order.reserved_until` (`CHECKOUT_RESERVATION_MINUTES`). Passé ce délai,
+    `release_expired()` l'annule et rend le stock ; elle est appelée par la
+    commande `release_expired_reservations` (cron) et, pour les produits
+    concernés, par un passage de commande qui manque de stock.
+- Chaque transition (réservée → payée, réservée → annulée) est « réclamée » par
+    un UPDATE conditionnel sur la commande : un webhook rejoué, ou concurrent
+    de l'expiration, ne rend jamais le stock deux fois.
+- Les variations de stock sont journalisées (`catalog.record_change`) : les
+    UPDATE en masse ne déclenchent pas les signaux de Product.
+- Les lignes de la commande sont écrites deux fois, dans la même transaction :
+    en JSON (`Order.products`, affichage) et dans la table `OrderItem` (agrégats
+    SQL par produit) ; `order_items()` convertit aussi le JSON des commandes
+    antérieures (`manage.py backfill_order_items`).
+
+Comment ce fichier se connecte :
+- `place_order()` est appelée par `OrderSerializer.create` (`api/serialzers.py`).
+- `confirm_payment()` / `cancel_order()` par les vues de paiement et de
+    suppression de commande (`api/views.py`).
+- Benchmark de concurrence : `python manage.py bench_checkout`.
+"""
+
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import catalog
+from .cart import MAX_QUANTITY, item_product_id
+from .models import Order, OrderItem, Product
+
+MAX_LINES = 100  # Produits distincts par commande
+CENTS = Decimal('0.01')
+RELEASE_BATCH = 100  # Commandes expirées libérées par appel
+
+
+class CheckoutError(ValueError):
+    """Commande invalide (lignes, produits ou quantités)"""
+
+
+class OutOfStock(CheckoutError):
+    """Stock insuffisant pour au moins un produit"""
+
+    def __init__(self, product_ids):
+        super().__init__('Insufficient stock for products: ' + ', '.join(map(str, product_ids)))
+        self.product_ids = product_ids
+
+
+def _reservation_delay():
+    return timedelta(minutes=getattr(settings, 'CHECKOUT_RESERVATION_MINUTES', 15))
+
+
+def normalize_lines(lines):
+    """
+    Regroupe les lignes par produit, triées par ID (ordre de réservation)
+
+    Returns:
+        list: [(product_id, quantity), ...]
+
+    Raises:
+        CheckoutError: Lignes absentes ou invalides
+    """
+    if not isinstance(lines, list) or not lines:
+        raise CheckoutError('products must be a non-empty list')
+    quantities = {}
+    for line in lines:
+        product_id = item_product_id(line)
+        quantity = line.get('quantity', 1) if isinstance(line, dict) else None
+        if isinstance(product_id, bool) or not isinstance(product_id, int) or product_id <= 0:
+            raise CheckoutError('each product needs a positive integer product_id')
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity <= 0:
+            raise CheckoutError('quantity must be a positive integer')
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    if len(quantities) > MAX_LINES:
+        raise CheckoutError(f'at most {MAX_LINES} distinct products per order')
+    if any(quantity > MAX_QUANTITY for quantity in quantities.values()):
+        raise CheckoutError(f'at most {MAX_QUANTITY} units per product')
+    return sorted(quantities.items())
+
+
+def _reserve(lines):
+    """
+    Réserve le stock de chaque ligne (dans la transaction courante)
+
+    S'arrête au premier produit manquant : la transaction sera annulée, inutile
+    de verrouiller les lignes suivantes.
+
+    Returns:
+        list: ID du produit en stock insuffisant (vide si tout est réservé)
+    """
+    for product_id, quantity in lines:
+        reserved = Product.objects.filter(pk=product_id, quantity__gte=quantity).update(
+            quantity=F('quantity') - quantity,
+        )
+        if not reserved:
+            return [product_id]
+    return []
+
+
+def _restock(lines):
+    """Rend le stock de lignes réservées (dans la transaction courante)"""
+    for product_id, quantity in sorted(lines):
+        Product.objects.filter(pk=product_id).update(quantity=F('quantity') + quantity)
+        catalog.record_change(product_id)
+
+
+def _order_lines(order):
+    """Lignes (product_id, quantity) d'une commande enregistrée"""
+    return [(item.product_id, item.quantity) for item in order_items(order.pk, order.products)]
+
+
+def order_items(order_id, products):
+    """
+    Lignes `OrderItem` d'une commande à partir de son JSON `products`
+
+    Les lignes d'un même produit sont fusionnées (prix de la première) ; les
+    lignes sans ID produit entier ou sans quantité positive sont ignorées, un
+    prix illisible vaut 0.
+
+    Returns:
+        list: Instances `OrderItem` non enregistrées
+    """
+    items = {}
+    for line in products or []:
+        product_id = item_product_id(line)
+        quantity = line.get('quantity') if isinstance(line, dict) else None
+        if isinstance(product_id, bool) or not isinstance(product_id, int) or product_id <= 0:
+            continue
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity <= 0:
+            continue
+        if product_id in items:
+            items[product_id].quantity += quantity
+            continue
+        try:
+            unit_price = Decimal(str(line.get('price', 0))).quantize(CENTS)
+        except (InvalidOperation, ValueError):
+            unit_price = Decimal('0.00')
+        items[product_id] = OrderItem(order_id=order_id, product_id=product_id, quantity=quantity, unit_price=unit_price)
+    return list(items.values())
+
+
+def place_order(user, lines, request=None, **shipping):
+    """
+    Crée une commande au prix de la base, avec réservation du stock
+
+    Args:
+        user: Acheteur
+        lines (list): Lignes du client ({"product_id" | "id", "quantity"}) ;
+            les autres champs (prix, nom...) sont ignorés
+        request: Requête, pour les URLs absolues des images
+        **shipping: address, city, country
+
+    Returns:
+        Order: Commande PENDING, stock réservé jusqu'à `reserved_until`
+
+    Raises:
+        CheckoutError: Lignes invalides ou produit inexistant
+        OutOfStock: Stock insuffisant (aucune réservation conservée)
+    """
+    lines = normalize_lines(lines)
+    for attempt in range(2):
+        try:
+            return _place_order(user, lines, request, shipping)
+        except OutOfStock as exc:
+            # Des réservations expirées peuvent encore retenir ce stock
+            if attempt or not release_expired(product_ids=exc.product_ids):
+                raise
+
+
+@transaction.atomic
+def _place_order(user, lines, request, shipping):
+    product_ids = [product_id for product_id, _ in lines]
+    missing = _reserve(lines)
+    if missing:
+        known = set(Product.objects.filter(pk__in=missing).values_list('pk', flat=True))
+        if known != set(missing):
+            raise CheckoutError('Unknown products: ' + ', '.join(str(pk) for pk in missing if pk not in known))
+        raise OutOfStock(missing)  # L'exception annule la transaction et les réservations
+
+    # Lignes déjà verrouillées par les UPDATE : prix et noms stables jusqu'au commit
+    products = Product.objects.only('id', 'name', 'price', 'image').in_bulk(product_ids)
+    items = []
+    total = Decimal('0')
+    for product_id, quantity in lines:
+        product = products[product_id]
+        image = product.image.url if product.image else None
+        if image and request is not None:
+            image = request.build_absolute_uri(image)
+        total += product.price * quantity
+        items.append({
+            'product_id': product_id, 'id': product_id, 'name': product.name, 'image': image,
+            'quantity': quantity, 'price': str(product.price),
+        })
+        catalog.record_change(product_id)
+
+    order = Order.objects.create(
+        user=user, products=items, total_price=total,
+        reserved_until=timezone.now() + _reservation_delay(), **shipping,
+    )
+    OrderItem.objects.bulk_create(order_items(order.pk, items))
+    return order
+
+
+def confirm_payment(order, payment_id):
+    """
+    Marque une commande comme payée (idempotent)
+
+    Le stock réservé devient définitivement vendu. Un paiement arrivé après
+    l'expiration de la réservation tente de réserver à nouveau ; s'il n'y a
+    plus de stock, le paiement est enregistré mais la commande reste annulée
+    et marquée à rembourser (`refund_required`).
+
+    Returns:
+        bool: True si la commande est payée et COMPLETED
+    """
+    completed = {'status': Order.COMPLETED, 'reserved_until': None}
+    payment = {'payment_completed': True, 'payement_id': payment_id}
+    orders = Order.objects.filter(pk=order.pk, payment_completed=False)
+    with transaction.atomic():
+        if not orders.filter(status=Order.PENDING).update(**completed, **payment) and \
+                orders.filter(status=Order.CANCELLED).update(**payment):
+            lines = sorted(_order_lines(order))
+            try:
+                with transaction.atomic():
+                    missing = _reserve(lines)
+                    if missing:
+                        raise OutOfStock(missing)
+            except OutOfStock:
+                Order.objects.filter(pk=order.pk).update(refund_required=True)
+            else:
+                for product_id, _ in lines:
+                    catalog.record_change(product_id)
+                Order.objects.filter(pk=order.pk).update(**completed)
+    order.refresh_from_db()
+    return order.status == Order.COMPLETED
+
+
+def cancel_order(order):
+    """
+    Annule une commande impayée et rend son stock (idempotent)
+
+    Returns:
+        bool: True si cet appel a annulé la commande
+    """
+    with transaction.atomic():
+        claimed = Order.objects.filter(pk=order.pk, payment_completed=False, status=Order.PENDING).update(
+            status=Order.CANCELLED, reserved_until=None,
+        )
+        if claimed:
+            _restock(_order_lines(order))
+    order.refresh_from_db()
+    return bool(claimed)
+
+
+def release_expired(now=None, product_ids=None, limit=RELEASE_BATCH):
+    """
+    Annule les commandes impayées dont la réservation a expiré
+
+    Args:
+        now: Date de référence (maintenant par défaut)
+        product_ids (list): Ne libère que les commandes contenant ces produits
+        limit (int): Nombre maximal de commandes examinées
+
+    Returns:
+        int: Nombre de commandes annulées
+    """
+    expired = Order.objects.filter(
+        status=Order.PENDING, payment_completed=False, reserved_until__lt=now or timezone.now(),
+    ).order_by('reserved_until')
+    if product_ids is not None:
+        # Filtre en SQL (index des lignes par produit) avant la limite
+        expired = expired.filter(pk__in=OrderItem.objects.filter(product_id__in=product_ids).values('order_id'))
+    return sum(cancel_order(order) for order in expired[:limit])
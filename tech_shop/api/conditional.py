@@ -0,0 +1,110 @@
+"""
+Fichier: api/conditional.py
+
+Description (FR):
+- Requêtes conditionnelles (ETag / Last-Modified) pour les endpoints publics du
+    catalogue et des recommandations : un client qui renvoie `If-None-Match`
+    (ou `If-Modified-Since`) reçoit `304 Not Modified` tant que le catalogue
+    n'a pas changé, avant toute requête sur les produits ou les avis.
+- Version du catalogue : compteur `CatalogVersion`, incrémenté dans la
+    transaction de chaque écriture de Product ou de Review (voir
+    `api/catalog.py`) et attribué dans l'ordre des commits, lu par une seule
+    requête sur la clé primaire.
+- Les recommandations TF-IDF dépendent aussi de l'index publié : son empreinte
+    (`recs_tfidf.index_state()`, quelques `stat`) entre dans leur ETag, qui change
+    donc à chaque reconstruction ou mise à jour incrémentale de l'index.
+- Les recommandations « achetés ensemble » dépendent de la table de co-achats
+    publiée (`recs_copurchase.table_state()`, nom de sa version).
+- L'ETag (fort) est un hachage de ces versions, du chemin complet (paramètres
+    compris) et de l'en-tête `Accept` : deux représentations différentes n'ont
+    jamais le même ETag. `Cache-Control: no-cache` force le navigateur à
+    revalider à chaque navigation (réponse 304 sans corps).
+
+Comment ce fichier se connecte :
+- Les décorateurs `catalog_conditional` et `recommendations_conditional` sont
+    appliqués aux méthodes `get` des vues concernées dans `api/views.py`.
+"""
+
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+from .catalog import current_state
+from .recs_copurchase import table_state
+from .recs_tfidf import index_state
+
+
+def catalog_state(request):
+    """(version, date) de la dernière modification du catalogue, lue une fois par requête"""
+    state = getattr(request, '_catalog_state', None)
+    if state is None:
+        state = current_state()
+        request._catalog_state = state
+    return state
+
+
+def _index_state(request):
+    """Empreinte de l'index TF-IDF publié, lue une fois par requête"""
+    state = getattr(request, '_index_state', None)
+    if state is None:
+        state = index_state()
+        request._index_state = state
+    return state
+
+
+def _etag(request, *versions):
+    """ETag fort d'une représentation : versions + chemin complet + `Accept`"""
+    key = repr((versions, request.get_full_path(), request.META.get('HTTP_ACCEPT', '')))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _catalog_etag(request, *args, **kwargs):
+    return _etag(request, catalog_state(request)[0])
+
+
+def _catalog_last_modified(request, *args, **kwargs):
+    return catalog_state(request)[1]
+
+
+def _recommendations_etag(request, *args, **kwargs):
+    return _etag(request, catalog_state(request)[0], _index_state(request)[0])
+
+
+def _recommendations_last_modified(request, *args, **kwargs):
+    changed_at = catalog_state(request)[1]
+    updated_ns = _index_state(request)[1]
+    index_at = datetime.fromtimestamp(updated_ns / 1e9, tz=timezone.utc) if updated_ns else None
+    dates = [date for date in (changed_at, index_at) if date is not None]
+    return max(dates) if dates else None
+
+
+def _copurchase_etag(request, *args, **kwargs):
+    return _etag(request, catalog_state(request)[0], table_state())
+
+
+def _conditional(etag_func, last_modified_func):
+    """Décorateur de méthode `get` : 304 anticipé, ETag / Last-Modified, revalidation"""
+    def decorator(view_func):
+        conditional = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view_func)
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            response = conditional(request, *args, **kwargs)
+            patch_cache_control(response, no_cache=True)
+            return response
+        return wrapper
+    return method_decorator(decorator)
+
+
+# Produits, détail produit, avis : dépendent uniquement du catalogue
+catalog_conditional = _conditional(_catalog_etag, _catalog_last_modified)
+
+# Recommandations : catalogue + index TF-IDF publié
+recommendations_conditional = _conditional(_recommendations_etag, _recommendations_last_modified)
+
+# Co-achats : catalogue + table publiée (ETag seul)
+copurchase_conditional = _conditional(_copurchase_etag, None)
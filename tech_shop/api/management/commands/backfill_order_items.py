@@ -0,0 +1,70 @@
+"""
+Fichier: api/management/commands/backfill_order_items.py
+
+Description (FR):
+- Commande Django qui remplit la table `OrderItem` à partir du JSON
+  `Order.products` des commandes existantes
+- Utilisable via `python manage.py backfill_order_items [--batch-size 2000]`
+
+Quand l'utiliser :
+- Une fois après la migration qui crée `OrderItem` (les nouvelles commandes
+  écrivent leurs lignes au passage de commande, voir `api/checkout.py`)
+- Après un import de commandes qui contourne le passage de commande
+
+Fonctionnement :
+- Parcours des commandes par lots sur la clé primaire (`WHERE id > dernier`),
+  sans OFFSET ni chargement complet : la mémoire reste bornée par la taille
+  du lot, quel que soit le nombre de commandes
+- Chaque lot est inséré par `bulk_create(ignore_conflicts=True)` : la
+  contrainte d'unicité (commande, produit) rend la commande rejouable, les
+  lignes déjà présentes sont ignorées
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.checkout import order_items
+from api.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    """Backfill des lignes de commande normalisées"""
+
+    help = 'Backfill OrderItem rows from the Order.products JSON of existing orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Number of orders read and inserted per batch'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the order lines that would be inserted'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        last_id = 0
+        orders = lines = 0
+        while True:
+            batch = list(
+                Order.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', 'products')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            items = [item for order_id, products in batch for item in order_items(order_id, products)]
+            if not dry_run:
+                with transaction.atomic():
+                    OrderItem.objects.bulk_create(items, batch_size=batch_size, ignore_conflicts=True)
+            orders += len(batch)
+            lines += len(items)
+            self.stdout.write(f'{orders} orders read, {lines} lines {"found" if dry_run else "written"}')
+
+        verb = 'would be written' if dry_run else 'written (existing lines skipped)'
+        self.stdout.write(self.style.SUCCESS(f'{orders} orders read, {lines} order lines {verb}'))
@@ -0,0 +1,159 @@
+"""
+Fichier: api/management/commands/bench_checkout.py
+
+Description (FR):
+- Commande Django de benchmark du passage de commande sous forte concurrence
+  (vente flash) : de nombreux acheteurs simultanés se disputent le stock d'un
+  même produit
+- Compare :
+    - `checkout.place_order` (UPDATE conditionnel `quantity >= n`, transaction) ;
+    - le schéma naïf lecture → vérification → écriture (`naive`), pour référence.
+  Affiche le débit, les latences, les unités vendues et la survente éventuelle
+  (unités vendues au-delà du stock initial).
+- Utilisable via `python manage.py bench_checkout --buyers 1000 --workers 32`
+
+Fonctionnement :
+- Un acheteur et un produit de test sont créés, puis supprimés avec leurs
+  commandes à la fin.
+- À lancer sur la base de production cible (PostgreSQL) : SQLite sérialise les
+  écritures, les erreurs « database is locked » y sont comptées à part.
+"""
+
+import queue
+import random
+import statistics
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+
+from api.checkout import OutOfStock, place_order
+from api.models import Order, Product
+
+MODES = ('checkout', 'naive')
+
+
+class Command(BaseCommand):
+    """Benchmark de concurrence du passage de commande"""
+
+    help = 'Benchmark concurrent checkouts: throughput and oversell'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stock', type=int, default=100, help='Initial stock of the contested product')
+        parser.add_argument('--buyers', type=int, default=1000, help='Number of checkout attempts')
+        parser.add_argument('--workers', type=int, default=32, help='Concurrent buyer threads')
+        parser.add_argument('--max-quantity', type=int, default=3, help='Units per order, drawn in 1..max')
+        parser.add_argument(
+            '--modes',
+            default=','.join(MODES),
+            help=f'Comma-separated modes to run among: {", ".join(MODES)}'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the order quantities')
+
+    def handle(self, *args, **options):
+        modes = [mode.strip() for mode in options['modes'].split(',') if mode.strip()]
+        if not modes or set(modes) - set(MODES):
+            raise CommandError(f'--modes must be a subset of: {", ".join(MODES)}')
+        rng = random.Random(options['seed'])
+        quantities = [rng.randint(1, options['max_quantity']) for _ in range(options['buyers'])]
+
+        user = User.objects.create(username=f'bench-checkout-{time.time_ns()}')
+        try:
+            for mode in modes:
+                # Produit créé sans signaux : ni index TF-IDF ni autocomplétion touchés
+                product = Product.objects.bulk_create([Product(
+                    name='Bench checkout product', description='Benchmark', price='19.99',
+                    quantity=options['stock'],
+                )])[0]
+                if product.pk is None:
+                    raise CommandError('The database backend does not return ids from bulk_create')
+                try:
+                    self._run(mode, user, product, quantities, options)
+                finally:
+                    Order.objects.filter(user=user).delete()
+                    Product.objects.filter(pk=product.pk).delete()
+        finally:
+            user.delete()
+        self.stdout.write(self.style.SUCCESS('Benchmark finished, test data removed'))
+
+    def _run(self, mode, user, product, quantities, options):
+        buy = _checkout if mode == 'checkout' else _naive
+        tasks = queue.Queue()
+        for quantity in quantities:
+            tasks.put(quantity)
+        results = {'sold': 0, 'orders': 0, 'refused': 0, 'errors': 0}
+        timings = []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        quantity = tasks.get_nowait()
+                    except queue.Empty:
+                        return
+                    started = time.perf_counter()
+                    try:
+                        outcome = 'orders' if buy(user, product.pk, quantity) else 'refused'
+                    except DatabaseError:
+                        outcome = 'errors'
+                    elapsed = 1000 * (time.perf_counter() - started)
+                    with lock:
+                        results[outcome] += 1
+                        results['sold'] += quantity if outcome == 'orders' else 0
+                        timings.append(elapsed)
+            finally:
+                connection.close()  # Une connexion par thread
+
+        threads = [threading.Thread(target=worker) for _ in range(options['workers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        stock = options['stock']
+        remaining = Product.objects.values_list('quantity', flat=True).get(pk=product.pk)
+        oversold = max(0, results['sold'] - stock)
+        self.stdout.write(
+            f'{mode:>8} | {len(quantities) / elapsed:8.0f} attempts/s | '
+            f'median {statistics.median(timings):6.2f} ms, p95 {_p95(timings):6.2f} ms | '
+            f'{results["orders"]} orders, {results["refused"]} refused, {results["errors"]} errors | '
+            f'sold {results["sold"]}/{stock}, remaining {remaining}, oversold {oversold}'
+        )
+        if oversold or remaining != stock - min(results['sold'], stock):
+            self.stdout.write(self.style.WARNING(f'{mode}: stock accounting is inconsistent'))
+
+
+def _checkout(user, product_id, quantity):
+    """Passage de commande réel (UPDATE conditionnel)"""
+    try:
+        place_order(user, [{'product_id': product_id, 'quantity': quantity}],
+                    address='1 rue', city='Niamey', country='Niger')
+    except OutOfStock:
+        return False
+    return True
+
+
+def _naive(user, product_id, quantity):
+    """Lecture, vérification puis écriture du stock : deux acheteurs peuvent lire le même stock"""
+    with transaction.atomic():
+        product = Product.objects.get(pk=product_id)
+        if product.quantity < quantity:
+            return False
+        time.sleep(0.001)  # Traitement applicatif entre la lecture et l'écriture
+        Product.objects.filter(pk=product_id).update(quantity=max(0, product.quantity - quantity))
+        Order.objects.create(
+            user=user, address='1 rue', city='Niamey', country='Niger',
+            products=[{'product_id': product_id, 'quantity': quantity, 'price': str(product.price)}],
+        )
+    return True
+
+
+def _p95(timings):
+    """95e centile d'une liste de durées"""
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
@@ -0,0 +1,163 @@
+"""
+Fichier: api/management/commands/bench_product_search.py
+
+Description (FR):
+- Commande Django de benchmark de la recherche de produits
+- Compare, à plusieurs tailles de catalogue (10k / 100k / 1M par défaut) :
+    - le chemin ORM historique (`icontains` sur nom et description + `count()`)
+    - la recherche classée TF-IDF (`TfidfIndex.search`, index inversé)
+  Les deux chemins incluent le chargement de la page de produits renvoyée.
+- Utilisable via `python manage.py bench_product_search --sizes 10000,100000`
+
+Fonctionnement :
+- Des produits synthétiques sont insérés dans une transaction annulée à la fin :
+  la base n'est pas modifiée.
+- L'index TF-IDF du benchmark est construit en mémoire (mêmes étapes que
+  `build_index`) : l'index publié dans `recs_index/` n'est pas touché.
+"""
+
+import statistics
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from api.models import Product
+from api.recs_tfidf import TfidfIndex, product_text
+from api.recs_tfidf_build import count_shard, assemble_tfidf
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'ze', 'bo', 'da', 'fe', 'gu', 'ha', 'jo', 'pi']
+
+
+class Command(BaseCommand):
+    """Benchmark de la recherche ORM face à la recherche TF-IDF classée"""
+
+    help = 'Benchmark ORM icontains search against TF-IDF ranked search'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='10000,100000,1000000',
+            help='Comma-separated catalogue sizes to benchmark'
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=30,
+            help='Number of queries per engine and size'
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=8,
+            help='Results loaded per query'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Random seed of the synthetic catalogue'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted({int(size) for size in options['sizes'].split(',') if size.strip()})
+        except ValueError:
+            raise CommandError('--sizes must be a comma-separated list of integers')
+        rng = np.random.default_rng(options['seed'])
+        vocabulary = _vocabulary()
+        # Fréquences des mots en loi de Zipf, comme dans un vrai catalogue
+        weights = 1.0 / np.arange(1, len(vocabulary) + 1)
+        weights /= weights.sum()
+        # Requêtes d'un ou deux mots, de fréquences variées
+        queries = [
+            ' '.join(vocabulary[i] for i in rng.choice(200, size=rng.integers(1, 3), replace=False))
+            for _ in range(options['queries'])
+        ]
+        page_size = options['page_size']
+
+        with transaction.atomic():
+            first_id = None
+            docs, ids = [], []
+            for size in sizes:
+                # Complète le catalogue synthétique jusqu'à `size` produits
+                self.stdout.write(f'Inserting products up to {size}...')
+                while len(ids) < size:
+                    batch = _synthetic_products(rng, vocabulary, weights, min(5000, size - len(ids)))
+                    created = Product.objects.bulk_create(batch)
+                    if created[0].pk is None:
+                        raise CommandError('The database backend does not return ids from bulk_create')
+                    first_id = first_id or created[0].pk
+                    for product in created:
+                        ids.append(product.pk)
+                        docs.append(product_text(product.name, product.description))
+                last_id = ids[-1]
+
+                started = time.perf_counter()
+                shards = [count_shard(docs[i:i + 5000]) for i in range(0, len(docs), 5000)]
+                vectorizer, matrix = assemble_tfidf(shards)
+                index = TfidfIndex(vectorizer, matrix, ids, signature=None)
+                build_seconds = time.perf_counter() - started
+
+                orm = self._time_orm(queries, first_id, last_id, page_size)
+                tfidf = self._time_tfidf(queries, index, page_size)
+                self.stdout.write(
+                    f'{size:>9} products | ORM median {orm[0]:8.2f} ms, p95 {orm[1]:8.2f} ms | '
+                    f'TF-IDF median {tfidf[0]:7.2f} ms, p95 {tfidf[1]:7.2f} ms | '
+                    f'speed-up x{orm[0] / max(tfidf[0], 1e-6):.1f} | index built in {build_seconds:.1f}s'
+                )
+            transaction.set_rollback(True)  # Aucun produit synthétique n'est conservé
+
+        self.stdout.write(self.style.SUCCESS('Benchmark finished, synthetic products rolled back'))
+
+    def _time_orm(self, queries, first_id, last_id, page_size):
+        """Latences (médiane, p95) en ms du chemin `icontains`"""
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            matches = Product.objects.filter(id__gte=first_id, id__lte=last_id).filter(
+                Q(name__icontains=query) | Q(description__icontains=query)
+            ).order_by('-id')
+            matches.count()
+            list(matches[:page_size])
+            timings.append(1000 * (time.perf_counter() - started))
+        return _summary(timings)
+
+    def _time_tfidf(self, queries, index, page_size):
+        """Latences (médiane, p95) en ms de la recherche classée TF-IDF"""
+        timings = []
+        index.search(queries[0], limit=page_size)  # Construit l'index inversé hors mesure
+        for query in queries:
+            started = time.perf_counter()
+            _, hits = index.search(query, limit=page_size)
+            list(Product.objects.filter(id__in=[index.id_at(row) for row, _ in hits]))
+            timings.append(1000 * (time.perf_counter() - started))
+        return _summary(timings)
+
+
+def _vocabulary():
+    """Mots synthétiques prononçables de trois syllabes (4096 mots), déterministes"""
+    return [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+
+
+def _synthetic_products(rng, vocabulary, weights, count):
+    """Produits synthétiques : nom de 3 mots, description de 30 mots"""
+    words = rng.choice(len(vocabulary), size=(count, 33), p=weights)
+    prices = rng.uniform(5, 2000, size=count).round(2)
+    quantities = rng.integers(0, 100, size=count)
+    return [
+        Product(
+            name=' '.join(vocabulary[i] for i in row[:3]),
+            description=' '.join(vocabulary[i] for i in row[3:]),
+            price=float(price),
+            quantity=int(quantity),
+        )
+        for row, price, quantity in zip(words, prices, quantities)
+    ]
+
+
+def _summary(timings):
+    """Médiane et 95e centile d'une liste de durées"""
+    return statistics.median(timings), float(np.percentile(timings, 95))
@@ -0,0 +1,76 @@
+"""
+Fichier: api/management/commands/build_copurchase_recs.py
+
+Description (FR):
+- Commande Django qui construit la table des recommandations « achetés
+  ensemble » à partir des commandes payées (voir `api/recs_copurchase.py`)
+- Utilisable via `python manage.py build_copurchase_recs [--measure lift]`
+- La table est écrite dans `recs_index/copurchase/v<ns>/` puis publiée
+  atomiquement ; les workers la rechargent à la requête suivante
+
+Fonctionnement :
+- Commandes lues par lots (`--chunk-orders`) depuis `OrderItem` : la mémoire
+  dépend du nombre de paires de produits distinctes, pas du nombre de
+  commandes. Les commandes antérieures à `OrderItem` doivent avoir été
+  reprises par `manage.py backfill_order_items`.
+
+Usage :
+- Production : via cron job (par exemple chaque nuit)
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.recs_copurchase import MEASURES, build_table
+
+
+class Command(BaseCommand):
+    """Construction de la table des co-achats"""
+
+    help = 'Build the "bought together" recommendations table from completed orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--measure',
+            choices=MEASURES,
+            default=None,
+            help='Association measure (default: settings.RECS_COPURCHASE_MEASURE)'
+        )
+        parser.add_argument(
+            '--topk',
+            type=int,
+            default=None,
+            help='Neighbours kept per product (default: settings.RECS_COPURCHASE_TOPK)'
+        )
+        parser.add_argument(
+            '--min-support',
+            type=int,
+            default=None,
+            help='Minimum number of shared orders for a pair (default: settings.RECS_COPURCHASE_MIN_SUPPORT)'
+        )
+        parser.add_argument(
+            '--max-basket',
+            type=int,
+            default=50,
+            help='Orders with more distinct products are ignored'
+        )
+        parser.add_argument(
+            '--chunk-orders',
+            type=int,
+            default=20000,
+            help='Orders read per batch'
+        )
+
+    def handle(self, *args, **options):
+        if options['topk'] is not None and options['topk'] < 1:
+            raise CommandError('--topk must be a positive integer')
+        stats = build_table(
+            measure=options['measure'],
+            topk=options['topk'],
+            min_support=options['min_support'],
+            max_basket=options['max_basket'],
+            chunk_orders=options['chunk_orders'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Co-purchase table built in {stats['seconds']}s: {stats['orders']} orders, "
+            f"{stats['pairs']} pairs, {stats['products']} products with neighbours ({stats['measure']})"
+        ))
@@ -0,0 +1,69 @@
+"""
+Fichier: api/management/commands/build_personal_recs.py
+
+Description (FR):
+- Commande Django qui précalcule les recommandations personnalisées de tous
+  les utilisateurs (voir `api/recs_personal.py`)
+- Utilisable via `python manage.py build_personal_recs [--workers 4]`
+- La table est écrite dans `recs_index/personal/v<ns>/` puis publiée
+  atomiquement ; `/api/me/recommendations/` la lit à la requête suivante
+
+Fonctionnement :
+- Les profils reposent sur l'index TF-IDF publié (`build_recs_index`) et sur
+  `OrderItem` (`backfill_order_items` pour les commandes antérieures). Sans
+  index, seule la liste des produits populaires est publiée.
+
+Usage :
+- Production : via cron job (par exemple chaque nuit, après `build_recs_index`)
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.recs_personal import build_table
+
+
+class Command(BaseCommand):
+    """Construction des recommandations personnalisées"""
+
+    help = 'Precompute per-user recommendations from orders and reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--topn',
+            type=int,
+            default=None,
+            help='Products kept per user (default: settings.RECS_PERSONAL_TOPN)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Scoring processes, 1 disables the pool (default: settings.RECS_PERSONAL_WORKERS)'
+        )
+        parser.add_argument(
+            '--chunk-users',
+            type=int,
+            default=500,
+            help='Users scored per batch'
+        )
+        parser.add_argument(
+            '--half-life-days',
+            type=float,
+            default=None,
+            help='Half-life of purchases and reviews (default: settings.RECS_PERSONAL_HALF_LIFE_DAYS)'
+        )
+
+    def handle(self, *args, **options):
+        for name in ('topn', 'workers', 'chunk_users'):
+            if options[name] is not None and options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be a positive integer")
+        stats = build_table(
+            topn=options['topn'],
+            workers=options['workers'],
+            chunk_users=options['chunk_users'],
+            half_life_days=options['half_life_days'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Personal recommendations built in {stats['seconds']}s: {stats['users']} users, "
+            f"{stats['popular']} popular products"
+        ))
@@ -5,6 +5,20 @@ Description (FR):
 - Commande Django personnalisée pour construire l'index TF-IDF des recommandations
 - S'appuie sur le module `recs_tfidf.py` pour générer les similarités entre produits
 - Utilisable via `python manage.py build_tfidf_index`
+- Chaque build est écrit dans un nouveau répertoire `recs_index/v<ns>/` puis
+  publié atomiquement via `recs_index/CURRENT` ; un seul builder à la fois
+- Option `--topk N` : précalcule la table des N plus proches voisins de chaque
+  produit (lecture O(k) au moment de servir les recommandations)
+- Options `--storage npy` et `--quantize int8` : stockage en tableaux bruts
+  projetables en mémoire (mmap), partagés entre les workers gunicorn
+- Options `--workers N` et `--shard-size N` : lecture en flux des produits et
+  tokenisation par lots dans un pool de processus ; la progression, le débit
+  (produits/s) et le pic de mémoire sont affichés
+- Option `--maintain` : compacte ou ré-apprend l'index si son delta l'exige
+  (maintenance par cron quand `RECS_TFIDF_AUTO_BUILD = False`)
+- Option `--engine ann` : construit l'index approximatif (LSH) utilisé quand
+  `settings.RECS_TFIDF_ENGINE = 'ann'` ; `--recall-report` mesure son rappel@k
+  et sa latence face au moteur exact
 
 Connexions :
 - Utilise `api.recs_tfidf.build_index()` pour la logique de construction
@@ -16,6 +30,9 @@ Usage :
 - Production : Via cron job ou après mise à jour du catalogue
 """
 
+import sys
+import time
+
 from django.core.management.base import BaseCommand
 from api import recs_tfidf  # Import du module de recommandations TF-IDF
 
@@ -37,6 +54,11 @@ class Command(BaseCommand):
         Args:
             parser: Le parseur d'arguments argparse
         """
+        parser.add_argument(
+            '--maintain',
+            action='store_true',
+            help='Only compact or refit the index if its delta requires it, then exit'
+        )
         parser.add_argument(
             '--force', 
             action='store_true', 
@@ -44,6 +66,67 @@ class Command(BaseCommand):
             # --force : Régénère l'index même s'il existe déjà
             # Sans --force : Ne rebuild que si l'index n'existe pas ou est obsolète
         )
+        parser.add_argument(
+            '--storage',
+            choices=recs_tfidf.STORAGE_FORMATS,
+            default=None,
+            help='On-disk format of the matrix (default: settings.RECS_TFIDF_STORAGE)'
+        )
+        parser.add_argument(
+            '--quantize',
+            choices=recs_tfidf.QUANTIZATIONS,
+            default=None,
+            help='Quantize matrix weights (npy storage only)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Tokenizer processes (default: settings.RECS_TFIDF_BUILD_WORKERS)'
+        )
+        parser.add_argument(
+            '--shard-size',
+            type=int,
+            default=None,
+            help='Products per tokenizer shard (default: settings.RECS_TFIDF_SHARD_SIZE)'
+        )
+        parser.add_argument(
+            '--topk',
+            type=int,
+            default=0,
+            help='Precompute the top-K neighbour table (0 disables it)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1024,
+            help='Number of products per block when computing neighbours'
+        )
+        parser.add_argument(
+            '--engine',
+            choices=recs_tfidf.ENGINES,
+            default='exact',
+            help="Also build the approximate (LSH) index with 'ann'"
+        )
+        parser.add_argument(
+            '--ann-tables',
+            type=int,
+            default=16,
+            help='Number of LSH hash tables'
+        )
+        parser.add_argument(
+            '--ann-bits',
+            type=int,
+            default=None,
+            help='Bits per LSH code (default: derived from the catalogue size)'
+        )
+        parser.add_argument(
+            '--recall-report',
+            type=int,
+            default=0,
+            metavar='SAMPLE',
+            help='Compare ANN against exact search on SAMPLE random products'
+        )
 
     def handle(self, *args, **options):
         """
@@ -51,10 +134,20 @@ class Command(BaseCommand):
         
         Args:
             *args: Arguments positionnels
-            **options: Arguments optionnels (--force)
+            **options: Arguments optionnels (--force, --storage, --quantize, --workers,
+                --shard-size, --topk, --chunk-size, --engine, --ann-tables, --ann-bits, --recall-report)
         """
+        if options.get('maintain'):
+            # Maintenance de l'index (cron) : compaction ou ré-apprentissage si nécessaire
+            action = recs_tfidf.maintain_index()
+            self.stdout.write(self.style.SUCCESS(f'Index maintenance: {action or "nothing to do"}'))
+            return
+
         # Récupération de l'option --force (False par défaut)
         force = options.get('force', False)
+        topk = options.get('topk') or 0
+        chunk_size = options.get('chunk_size') or 1024
+        started = time.perf_counter()
         
         # Message de début d'exécution
         self.stdout.write('Building TF-IDF index...')
@@ -64,14 +157,100 @@ class Command(BaseCommand):
         # =====================================================================
         # Appel de la fonction principale de construction d'index
         # Cette fonction :
-        # 1. Récupère tous les produits depuis la base de données
-        # 2. Extrait les caractéristiques (nom, description, catégorie)
-        # 3. Calcule les vecteurs TF-IDF
-        # 4. Calcule les similarités cosinus entre produits
-        # 5. Sauvegarde l'index dans un fichier via joblib
-        recs_tfidf.build_index(force=force)
-        
+        # 1. Lit les produits en flux (id, nom, description) par lots
+        # 2. Tokenise les lots en parallèle (pool de processus)
+        # 3. Calcule les poids IDF et assemble la matrice TF-IDF
+        # 4. Sauvegarde l'index sur le disque (joblib ou npy)
+        def report(done):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'  {done} products tokenized ({done / max(elapsed, 1e-9):.0f} rows/s)')
+
+        stats = recs_tfidf.build_index(
+            force=force,
+            storage=options.get('storage'),
+            quantize=options.get('quantize'),
+            workers=options.get('workers'),
+            shard_size=options.get('shard_size'),
+            progress=report,
+        )
+        if stats is None:
+            self.stdout.write('Index already exists (use --force to rebuild)')
+        else:
+            self.stdout.write(
+                f"Index ready: {stats['products']} products in {stats['seconds']:.2f}s "
+                f"({stats['products'] / max(stats['seconds'], 1e-9):.0f} rows/s, "
+                f"{stats['shards']} shards, {stats['workers']} workers)"
+            )
+
+        # =====================================================================
+        # TABLE DES K PLUS PROCHES VOISINS (OPTIONNELLE)
+        # =====================================================================
+        if topk > 0:
+            self.stdout.write(f'Computing top-{topk} neighbours (chunks of {chunk_size})...')
+            step = time.perf_counter()
+            stats = recs_tfidf.build_neighbours(topk, chunk_size=chunk_size)
+            if stats is None:
+                self.stdout.write(self.style.WARNING('Index is empty, no neighbour table written'))
+            else:
+                self.stdout.write(
+                    f"Neighbour table: {stats['products']} products x {stats['topk']} "
+                    f"in {time.perf_counter() - step:.2f}s, "
+                    f"{stats['nbytes'] / 1024 / 1024:.2f} MiB on disk"
+                )
+
+        # =====================================================================
+        # INDEX APPROXIMATIF (LSH) ET RAPPORT DE RAPPEL
+        # =====================================================================
+        if options.get('engine') == 'ann':
+            self.stdout.write('Building ANN (LSH) index...')
+            step = time.perf_counter()
+            stats = recs_tfidf.build_ann(tables=options['ann_tables'], bits=options.get('ann_bits'))
+            if stats is None:
+                self.stdout.write(self.style.WARNING('Index is empty, no ANN index written'))
+            else:
+                self.stdout.write(
+                    f"ANN index: {stats['products']} products, {stats['tables']} tables x "
+                    f"{stats['bits']} bits in {time.perf_counter() - step:.2f}s, "
+                    f"{stats['nbytes'] / 1024 / 1024:.2f} MiB on disk"
+                )
+
+        sample = options.get('recall_report') or 0
+        if sample > 0:
+            report = recs_tfidf.evaluate_ann_recall(k=max(topk, 6), sample=sample)
+            if report is None:
+                self.stdout.write(self.style.WARNING('No ANN index available, run with --engine ann'))
+            else:
+                self.stdout.write(
+                    f"ANN recall@{max(topk, 6)}: {report['recall']:.3f} on {report['sampled']} products "
+                    f"(exact {report['exact_ms']:.2f} ms/query, ann {report['ann_ms']:.2f} ms/query)"
+                )
+
+        peak = _peak_rss_mib()
+        if peak is not None:
+            workers_peak = _peak_rss_mib(children=True)
+            suffix = f' (largest worker: {workers_peak:.1f} MiB)' if workers_peak else ''
+            self.stdout.write(f'Peak memory (RSS): {peak:.1f} MiB{suffix}')
+        self.stdout.write(f'Total build time: {time.perf_counter() - started:.2f}s')
+
         # Message de succès avec style vert
         self.stdout.write(
             self.style.SUCCESS('TF-IDF index built successfully!')
-        )
\ No newline at end of file
+        )
+
+
+def _peak_rss_mib(children=False):
+    """
+    Pic de mémoire résidente en MiB (None si indisponible, ex: Windows)
+
+    Args:
+        children (bool): Si True, pic du plus gros processus enfant terminé
+            (workers du pool de tokenisation) au lieu du processus courant
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss est en octets sur macOS et en kilo-octets sur Linux
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
@@ -0,0 +1,41 @@
+"""
+Fichier: api/management/commands/release_expired_reservations.py
+
+Description (FR):
+- Commande Django qui annule les commandes impayées dont la réservation de
+  stock a expiré (`Order.reserved_until`) et rend leur stock
+- Utilisable via `python manage.py release_expired_reservations` (cron, par
+  exemple chaque minute)
+
+Fonctionnement :
+- Les commandes expirées sont traitées par lots (`checkout.release_expired`) ;
+  chaque annulation est réclamée par un UPDATE conditionnel : la commande peut
+  tourner en parallèle d'un webhook de paiement sans rendre le stock deux fois
+"""
+
+from django.core.management.base import BaseCommand
+
+from api.checkout import RELEASE_BATCH, release_expired
+
+
+class Command(BaseCommand):
+    """Libération des réservations de stock expirées"""
+
+    help = 'Cancel unpaid orders whose stock reservation expired and restock their products'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=RELEASE_BATCH,
+            help='Number of expired orders released per batch'
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            released = release_expired(limit=options['batch_size'])
+            total += released
+            if released < options['batch_size']:
+                break
+        self.stdout.write(self.style.SUCCESS(f'{total} expired reservation(s) released'))
@@ -0,0 +1,81 @@
+"""
+Fichier: api/management/commands/repair_rating_aggregates.py
+
+Description (FR):
+- Commande Django qui recalcule `Product.rating_count` / `rating_sum` à partir
+  des avis (`Review`) et corrige les produits dont les agrégats ont dérivé
+- Utilisable via `python manage.py repair_rating_aggregates [--dry-run]`
+
+Quand l'utiliser :
+- Après un import de données ou des écritures qui contournent les signaux
+  (`QuerySet.update()`, `bulk_create()`, SQL direct)
+- Périodiquement (cron) comme filet de sécurité
+- Inutile après `loaddata` : les avis chargés (`raw`) font recalculer les
+  agrégats de leur produit (`signals.recompute_rating_aggregates`)
+
+Fonctionnement :
+- Une requête agrégée (GROUP BY produit) sur les avis, puis un parcours des
+  produits par lots ; seuls les produits incohérents sont réécrits (`bulk_update`)
+- `bulk_update` contourne les signaux : un changement global est journalisé
+  pour que l'instantané du catalogue (`api/catalog.py`) soit rechargé
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from api.catalog import record_change
+from api.models import Product, Review
+
+
+class Command(BaseCommand):
+    """Backfill / réparation des agrégats d'avis stockés sur Product"""
+
+    help = 'Recompute Product.rating_count and rating_sum from reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Number of products checked and updated per batch'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the products whose aggregates are wrong'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        # Agrégats attendus, calculés par la base en une seule requête
+        expected = {
+            row['product']: (row['count'], row['total'])
+            for row in Review.objects.order_by().values('product').annotate(count=Count('id'), total=Sum('rating'))
+        }
+
+        checked = fixed = 0
+        stale = []
+        rows = Product.objects.values_list('id', 'rating_count', 'rating_sum').order_by('pk')
+        for product_id, rating_count, rating_sum in rows.iterator(chunk_size=batch_size):
+            checked += 1
+            count, total = expected.get(product_id, (0, 0))
+            if (rating_count, rating_sum) != (count, total):
+                stale.append(Product(pk=product_id, rating_count=count, rating_sum=total))
+            if len(stale) >= batch_size:
+                fixed += self._flush(stale, dry_run)
+                stale = []
+        fixed += self._flush(stale, dry_run)
+
+        verb = 'would be repaired' if dry_run else 'repaired'
+        self.stdout.write(self.style.SUCCESS(f'{checked} products checked, {fixed} {verb}'))
+
+    def _flush(self, products, dry_run):
+        """Écrit un lot de produits corrigés (rien en mode --dry-run)"""
+        if products and not dry_run:
+            with transaction.atomic():
+                Product.objects.bulk_update(products, ['rating_count', 'rating_sum'])
+                record_change()
+        return len(products)
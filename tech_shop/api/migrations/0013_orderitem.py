@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-17 05:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_order_reservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='api.order')),
+                ('product', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='order_items', to='api.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'order'], name='orderitem_product_order_idx')],
+                'constraints': [models.UniqueConstraint(fields=('order', 'product'), name='orderitem_order_product_uniq')],
+            },
+        ),
+    ]
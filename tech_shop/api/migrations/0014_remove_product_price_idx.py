@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-17 05:43
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_orderitem'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_price_idx',
+        ),
+    ]
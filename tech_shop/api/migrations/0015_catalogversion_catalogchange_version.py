@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-17 06:05
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def backfill_catalog_versions(apps, schema_editor):
+    """Versions du journal existant = ses IDs ; compteur initialisé au dernier"""
+    CatalogChange = apps.get_model('api', 'CatalogChange')
+    CatalogVersion = apps.get_model('api', 'CatalogVersion')
+    CatalogChange.objects.update(version=F('id'))
+    latest = CatalogChange.objects.aggregate(version=Max('id'))['version'] or 0
+    CatalogVersion.objects.create(pk=1, version=latest)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_remove_product_price_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='catalogchange',
+            name='version',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.RunPython(backfill_catalog_versions, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='catalogchange',
+            name='version',
+            field=models.BigIntegerField(unique=True),
+        ),
+    ]
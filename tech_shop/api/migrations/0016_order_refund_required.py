@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-17 06:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_catalogversion_catalogchange_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='refund_required',
+            field=models.BooleanField(default=False),
+        ),
+    ]
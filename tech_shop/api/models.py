@@ -3,10 +3,14 @@ Fichier: api/models.py
 
 Description (FR):
 - Définit les modèles de données principaux utilisés par l'application :
-    - Product : représente un produit vendable (nom, description, prix, image, quantité).
+    - Product : représente un produit vendable (nom, description, prix, image, quantité),
+        avec les agrégats de ses avis (`rating_count`, `rating_sum`).
     - Cart : panier d'un utilisateur stocké sous forme de JSON (liste d'items).
     - Order : commande passée par l'utilisateur (produits, adresse, statut, total, paiements).
     - Review : avis laissés par des utilisateurs sur des produits.
+    - CatalogChange / CatalogVersion : journal des modifications du catalogue et
+        compteur de version, qui versionnent l'instantané en mémoire de
+        `api/catalog.py`.
 
 Comment ces fichiers se connectent :
 - Les serializers (`api/serialzers.py`) transforment ces modèles en JSON pour l'API.
@@ -19,6 +23,8 @@ préfixer ce chemin par l'URL du backend pour afficher l'image (logique impléme
 frontend dans `CartContext` et `Recommendations`).
 """
 
+from decimal import Decimal
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
@@ -34,6 +40,11 @@ class Product(models.Model):
     quantity = models.PositiveIntegerField()  # Stock disponible
     created_at = models.DateTimeField(auto_now_add=True)  # Date de création
     image = models.ImageField(upload_to='products_images/', blank=True, null=True)  # Image du produit
+
+    # Agrégats des avis, dénormalisés : tenus à jour par les signaux de Review
+    # (mises à jour atomiques F()) et réparables via `manage.py repair_rating_aggregates`
+    rating_count = models.PositiveIntegerField(default=0)  # Nombre d'avis
+    rating_sum = models.PositiveIntegerField(default=0)  # Somme des notes
     
     def __str__(self):
         """Représentation textuelle du produit"""
@@ -44,10 +55,9 @@ class Product(models.Model):
         ordering = ['id']  # Tri par défaut par ID
         
     def average_rating(self):
-        """Calcule la note moyenne des avis pour ce produit"""
-        review = self.reviews.all()  # Récupère tous les avis liés
-        if review.exists():
-            return review.aggregate(models.Avg('rating'))['rating__avg']  # Moyenne des notes
+        """Note moyenne des avis, lue dans les agrégats stockés (aucune requête)"""
+        if self.rating_count:
+            return self.rating_sum / self.rating_count  # Moyenne des notes
         return 0  # Retourne 0 si aucun avis
         
 
@@ -60,6 +70,8 @@ class Cart(models.Model):
     # Stockage des articles du panier sous forme JSON
     # Format: [{"product_id": 1, "quantity": 2}, ...]
     items = models.JSONField(default=list)  # Liste des IDs produits et quantités
+    # Incrémentée à chaque écriture : concurrence optimiste (voir `api/cart.py`)
+    version = models.PositiveIntegerField(default=0)
     
     def __str__(self):
         """Représentation textuelle du panier"""
@@ -103,7 +115,19 @@ class Order(models.Model):
     # Détails de paiement
     payment_completed = models.BooleanField(default=False)  # Paiement effectué
     payement_id = models.CharField(max_length=255, null=True, blank=True)  # ID de paiement Stripe
+    # Fin de la réservation du stock d'une commande impayée (voir `api/checkout.py`)
+    reserved_until = models.DateTimeField(null=True, blank=True)
+    # Paiement reçu après l'expiration de la réservation, stock épuisé : à rembourser
+    refund_required = models.BooleanField(default=False)
    
+    class Meta:
+        """Métadonnées du modèle - index des listes de commandes"""
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='order_created_idx'),  # Liste admin
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),  # Liste utilisateur
+            models.Index(fields=['status'], name='order_status_idx'),  # Filtres par statut
+            models.Index(fields=['status', 'reserved_until'], name='order_reservation_idx'),  # Expirations
+        ]
     
     def __str__(self):
         """Représentation textuelle de la commande"""
@@ -111,7 +135,7 @@ class Order(models.Model):
     
     def calculate_total(self):
         """Calcule le prix total de la commande basé sur les produits"""
-        return sum(float(item['price']) * item['quantity'] for item in self.products)
+        return sum((Decimal(str(item['price'])) * item['quantity'] for item in self.products), Decimal('0'))
     
     def save(self, *args, **kwargs):
         """Surcharge de la sauvegarde pour calculer automatiquement le total"""
@@ -120,6 +144,38 @@ class Order(models.Model):
         super().save(*args, **kwargs)  # Appel de la méthode save parente
 
 
+class OrderItem(models.Model):
+    """
+    Ligne de commande normalisée (une par produit et par commande)
+
+    Écrite par le passage de commande en même temps que `Order.products` (JSON,
+    conservé pour l'affichage), et remplie pour les commandes antérieures par
+    `manage.py backfill_order_items`. Permet les agrégats par produit (unités
+    vendues, chiffre d'affaires, produits achetés ensemble) en SQL indexé.
+    """
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+    # Sans contrainte de clé étrangère : les lignes d'un produit supprimé gardent son ID
+    product = models.ForeignKey(
+        Product, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name='order_items',
+    )
+    quantity = models.PositiveIntegerField()  # Unités commandées
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)  # Prix unitaire à la commande
+
+    class Meta:
+        """Métadonnées du modèle - une ligne par produit et par commande"""
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='orderitem_order_product_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'order'], name='orderitem_product_order_idx'),  # Ventes d'un produit
+        ]
+
+    def __str__(self):
+        """Représentation textuelle de la ligne"""
+        return f"{self.quantity} x product {self.product_id} in order {self.order_id}"
+
+
 class Review(models.Model):
     """Modèle représentant un avis utilisateur sur un produit"""
     
@@ -146,4 +202,49 @@ class Review(models.Model):
     
     class Meta:
         """Métadonnées du modèle - empêche les doublons"""
-        unique_together = ('product', 'user')  # Un utilisateur ne peut aviser qu'une fois un produit
\ No newline at end of file
+        unique_together = ('product', 'user')  # Un utilisateur ne peut aviser qu'une fois un produit
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='review_created_idx'),  # Pagination par curseur
+            models.Index(fields=['product', '-created_at'], name='review_product_created_idx'),  # Avis d'un produit
+        ]
+
+
+class CatalogVersion(models.Model):
+    """
+    Compteur de version du catalogue (une seule ligne, `pk=1`)
+
+    Incrémenté par `F('version') + 1` dans la transaction de chaque écriture
+    (`catalog.record_change`) : le verrou de la ligne est tenu jusqu'au commit,
+    les versions sont donc attribuées dans l'ordre des commits. Une version lue
+    garantit que toutes les modifications de version inférieure sont validées,
+    ce que ne garantit pas le plus grand ID du journal (un ID plus petit peut
+    être validé après un plus grand).
+    """
+
+    version = models.BigIntegerField(default=0)  # Dernière version validée
+    updated_at = models.DateTimeField(null=True, blank=True)  # Date de la dernière modification
+
+    def __str__(self):
+        """Représentation textuelle de la version"""
+        return f"Catalog version {self.version}"
+
+
+class CatalogChange(models.Model):
+    """
+    Journal des modifications du catalogue (produits et agrégats d'avis)
+
+    Chaque ligne porte la version (`CatalogVersion`) attribuée à sa
+    modification, unique et sans trou : chaque processus compare la version de
+    son instantané en mémoire (`api/catalog.py`) et ne recharge que les
+    produits modifiés depuis.
+    """
+
+    # Produit modifié ; NULL = tout le catalogue (écritures en masse, réparation)
+    product_id = models.BigIntegerField(null=True, blank=True)
+    version = models.BigIntegerField(unique=True)  # Version du catalogue après la modification
+    created_at = models.DateTimeField(auto_now_add=True)  # Date de la modification
+
+    def __str__(self):
+        """Représentation textuelle de la modification"""
+        return f"Change {self.version} of product {self.product_id or '*'}"
+
@@ -0,0 +1,233 @@
+"""
+Fichier: api/pagination.py
+
+Description (FR):
+- Classes de pagination DRF des listes de produits, commandes et avis.
+- `OptInCursorPagination` : pagination par numéro de page (`?page=`, comportement
+    historique, utilisé par le frontend) ou, si la requête contient le paramètre
+    `cursor` (même vide : `?cursor=` demande la première page), pagination par
+    curseur (« keyset ») :
+    - l'ordre est fixé par l'attribut `cursor_ordering` de la vue, par exemple
+        ('-created_at', '-id') ou ('-id',) ;
+    - chaque page est une requête `WHERE (created_at, id) < (:date, :id)
+        ORDER BY ... LIMIT` servie par un index composite, sans `COUNT(*)` ni
+        `OFFSET` : le coût est le même à la première et à la millième page, et
+        une insertion entre deux pages ne répète ni ne saute aucun élément ;
+    - la réponse contient `next` / `previous` (liens opaques) et `results`, pas de `count`.
+- `EstimatedCountPagination` : variante dont le nombre total d'éléments peut être
+    lu dans les statistiques du planificateur (`pg_class.reltuples` sous
+    PostgreSQL) au lieu d'un `COUNT(*)` exact, si `count=estimated` est passé
+    ou si le réglage `ADMIN_ORDERS_COUNT_MODE` vaut 'estimated'. La réponse
+    indique alors `count_estimated: true`.
+
+Comment ce fichier se connecte :
+- Utilisé par `ProductView`, `AdminOrderView`, `UserOrderListView` et
+    `ReviewViewSet` (`api/views.py`) ; les index composites correspondants sont
+    déclarés dans `api/models.py`.
+"""
+
+import json
+import operator
+from functools import reduce
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+CURSOR_QUERY_PARAM = 'cursor'
+COUNT_QUERY_PARAM = 'count'
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Pagination par curseur dont l'ordre est fourni par la vue
+
+    La position de `CursorPagination` ne porte que sur le premier champ de
+    l'ordre : les ex aequo sont sautés par un `OFFSET`, qui se décale si une
+    ligne est insérée entre deux pages (élément répété ou sauté). Ici la
+    position est la valeur de tous les champs de l'ordre, rendue unique par le
+    dernier (`id`) : la page suivante est une comparaison lexicographique
+    `(created_at, id) < (:date, :id)`, sans `OFFSET`.
+    """
+
+    cursor_query_param = CURSOR_QUERY_PARAM
+
+    def __init__(self, ordering):
+        self.ordering = ordering
+
+    def _get_position_from_instance(self, instance, ordering):
+        """Position d'une ligne : valeurs de tous les champs de l'ordre (JSON)"""
+        values = []
+        for field in ordering:
+            name = field.lstrip('-')
+            values.append(str(instance[name] if isinstance(instance, dict) else getattr(instance, name)))
+        return json.dumps(values)
+
+    def _beyond(self, position, reverse):
+        """Condition des lignes situées après `position` dans l'ordre (avant si `reverse`)"""
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        conditions, equal = [], Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') != reverse else 'gt'
+            conditions.append(equal & Q(**{f'{name}__{lookup}': value}))
+            equal &= Q(**{name: value})
+        return reduce(operator.or_, conditions)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Même déroulé que `CursorPagination`, avec le filtre sur la position complète"""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = 0, False, None
+        else:
+            offset, reverse, current_position = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*(f[1:] if f.startswith('-') else f'-{f}' for f in self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            try:
+                queryset = queryset.filter(self._beyond(current_position, reverse))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        # Un élément de plus pour savoir s'il existe une page suivante ; l'offset
+        # ne vient que d'un curseur forgé (les positions uniques n'en produisent pas)
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None or offset > 0
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+
+class OptInCursorPagination(PageNumberPagination):
+    """
+    Pagination par numéro de page, ou par curseur si `?cursor=` est présent
+
+    La vue déclare l'ordre du curseur dans `cursor_ordering` (index composite
+    sur ces champs ; le dernier doit être unique, en pratique `id`).
+    """
+
+    default_cursor_ordering = ('-id',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if CURSOR_QUERY_PARAM in request.query_params:
+            ordering = getattr(view, 'cursor_ordering', self.default_cursor_ordering)
+            self.cursor_paginator = KeysetPagination(ordering)
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_html_context(self):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_html_context()
+        return super().get_html_context()
+
+
+# =============================================================================
+# NOMBRE TOTAL ESTIMÉ
+# =============================================================================
+def estimated_count(queryset):
+    """
+    Nombre de lignes de la table d'un queryset non filtré, lu dans les
+    statistiques du planificateur (None si indisponible : autre moteur que
+    PostgreSQL, ou table jamais analysée)
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [queryset.model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator Django dont le total vient des statistiques (repli : COUNT exact)"""
+
+    @cached_property
+    def count(self):
+        estimate = None
+        if not self.object_list.query.where:
+            estimate = estimated_count(self.object_list)
+        self.count_estimated = estimate is not None
+        return estimate if estimate is not None else super().count
+
+
+class EstimatedCountPagination(OptInCursorPagination):
+    """
+    Pagination de la liste admin des commandes, avec total estimé optionnel
+
+    Un total estimé peut s'écarter légèrement du total réel (les statistiques
+    sont rafraîchies par ANALYZE / autovacuum) : les dernières pages peuvent
+    alors manquer en mode numéroté, le mode curseur les parcourt toutes.
+    """
+
+    def _count_mode(self, request):
+        mode = request.query_params.get(COUNT_QUERY_PARAM)
+        if mode in ('exact', 'estimated'):
+            return mode
+        return getattr(settings, 'ADMIN_ORDERS_COUNT_MODE', 'exact')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self._count_mode(request) == 'estimated':
+            self.django_paginator_class = EstimatedCountPaginator
+        else:
+            self.django_paginator_class = Paginator
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.cursor_paginator is None and isinstance(response.data, dict):
+            response.data['count_estimated'] = getattr(self.page.paginator, 'count_estimated', False)
+        return response
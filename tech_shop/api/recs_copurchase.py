@@ -0,0 +1,323 @@
+"""
+Fichier: api/recs_copurchase.py
+
+Description (FR):
+- Recommandations « achetés ensemble » à partir de l'historique des commandes
+    payées (COMPLETED), en complément des signaux textuels (`recs_tfidf`) et
+    heuristiques (`recs_heuristic`).
+- Construction hors ligne (`build_table`, commande `build_copurchase_recs`) :
+    - les commandes sont lues en flux, par plages de clés primaires, depuis la
+        table normalisée `OrderItem` (requête indexée par commande) ;
+    - chaque lot devient une matrice creuse commandes x produits X (scipy) et
+        la co-occurrence produit x produit est accumulée par C += Xᵀ·X : la
+        mémoire dépend du nombre de paires distinctes, pas du nombre de commandes ;
+    - les paniers de plus de `max_basket` produits (commandes en gros) sont
+        ignorés : leur coût est quadratique et leur signal faible ;
+    - normalisation par cosinus (c_ij / √(n_i·n_j)) ou par lift
+        (c_ij · N / (n_i·n_j)), après un seuil de support minimal (`min_support`
+        commandes communes) qui écarte les coïncidences ;
+    - seuls les `topk` meilleurs voisins de chaque produit sont conservés.
+- Stockage : `recs_index/copurchase/v<ns>/` (tableaux `.npy` : IDs produits
+    triés, IDs des voisins, scores) publié par remplacement atomique du
+    pointeur `CURRENT`, comme l'index TF-IDF ; les tableaux sont projetés en
+    mémoire (`mmap_mode='r'`) et partagés entre workers. Les fonctions de
+    stockage versionné (`published_dir`, `publish_version`) servent aussi aux
+    recommandations personnalisées (`recs_personal`).
+- Lecture (`query_copurchase`) : recherche dichotomique de l'ID puis lecture
+    d'une ligne de la table, O(log n + k).
+
+Comment ces fichiers se connectent :
+- La vue `CopurchaseRecommendations` (`api/views.py`) appelle `query_copurchase`.
+- `table_state()` entre dans l'ETag et la clé de cache de cette vue.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from scipy.sparse import csr_matrix
+
+from .models import Order, OrderItem, Product
+from .recs_tfidf import STORE_DIR as TFIDF_STORE_DIR
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# STOCKAGE
+# =============================================================================
+STORE_DIR = TFIDF_STORE_DIR / 'copurchase'
+CURRENT_NAME = 'CURRENT'  # Nom du répertoire de la version servie
+VERSIONS_KEPT = 2  # Versions conservées sur disque (dont la version courante)
+
+IDS_FILE = 'product_ids.npy'  # IDs produits ayant des voisins (int64, triés)
+NEIGHBOURS_FILE = 'neighbours.npy'  # IDs des voisins (int64, (n, topk), -1 = vide)
+SCORES_FILE = 'scores.npy'  # Scores (float32, (n, topk), décroissants)
+META_FILE = 'meta.json'  # Paramètres et statistiques du build
+
+MEASURES = ('cosine', 'lift')
+
+
+def atomic_write(path, dump):
+    """Écrit un fichier via un fichier temporaire puis `os.replace`"""
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as fh:
+        dump(fh)
+    os.replace(tmp_path, path)
+
+
+def published_dir(store_dir):
+    """Répertoire de la version publiée d'un stockage versionné, ou None"""
+    try:
+        name = (store_dir / CURRENT_NAME).read_text(encoding='utf-8').strip()
+    except FileNotFoundError:
+        return None
+    root = store_dir / name
+    return root if name and root.is_dir() else None
+
+
+def publish_version(store_dir, building, kept=VERSIONS_KEPT):
+    """Renomme une version complète, la publie et supprime les plus anciennes"""
+    root = store_dir / f'v{time.time_ns()}'
+    os.replace(building, root)
+    atomic_write(store_dir / CURRENT_NAME, lambda fh: fh.write(root.name.encode('utf-8')))
+    for path in store_dir.glob('.building-*'):
+        shutil.rmtree(path, ignore_errors=True)
+    versions = sorted(path for path in store_dir.iterdir() if path.is_dir() and path.name.startswith('v'))
+    for path in versions[:max(len(versions) - kept, 0)]:
+        if path != root:
+            shutil.rmtree(path, ignore_errors=True)
+    return root
+
+
+# =============================================================================
+# CONSTRUCTION
+# =============================================================================
+def _stream_baskets(catalog_ids, chunk_orders):
+    """
+    Lots de commandes payées sous forme de matrices creuses commandes x produits
+
+    Les commandes sont découpées par plages de clés primaires (`WHERE id > dernier`)
+    puis leurs lignes lues par plage d'`order_id` : deux requêtes indexées par lot.
+    Les produits supprimés du catalogue sont ignorés.
+
+    Yields:
+        csr_matrix: Matrice binaire (commandes du lot, produits du catalogue)
+    """
+    if not len(catalog_ids):
+        return
+    completed = Order.objects.filter(status=Order.COMPLETED)
+    last_id = 0
+    while True:
+        order_ids = list(completed.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:chunk_orders])
+        if not order_ids:
+            return
+        first_id, last_id = order_ids[0], order_ids[-1]
+        lines = np.array(
+            OrderItem.objects.filter(
+                order_id__gte=first_id, order_id__lte=last_id, order__status=Order.COMPLETED,
+            ).values_list('order_id', 'product_id'),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        if not len(lines):
+            continue
+        cols = np.searchsorted(catalog_ids, lines[:, 1])
+        known = (cols < len(catalog_ids)) & (catalog_ids[np.minimum(cols, len(catalog_ids) - 1)] == lines[:, 1])
+        _, rows = np.unique(lines[known, 0], return_inverse=True)
+        cols = cols[known]
+        baskets = csr_matrix(
+            (np.ones(len(cols), dtype=np.int32), (rows, cols)),
+            shape=(int(rows.max()) + 1 if len(rows) else 0, len(catalog_ids)),
+        )
+        baskets.data[:] = 1  # Un produit compte une fois par commande
+        yield baskets
+
+
+def cooccurrence(baskets_stream, n_products, max_basket):
+    """
+    Accumule la co-occurrence des produits sur un flux de lots de paniers
+
+    Args:
+        baskets_stream: Itérable de matrices binaires (commandes, produits)
+        n_products (int): Nombre de colonnes
+        max_basket (int): Taille maximale d'un panier pris en compte
+
+    Returns:
+        tuple: (C : co-occurrences CSR int32 sans diagonale, n : nombre de
+            commandes par produit, N : nombre de commandes retenues)
+    """
+    counts = csr_matrix((n_products, n_products), dtype=np.int32)
+    item_counts = np.zeros(n_products, dtype=np.int64)
+    baskets_used = 0
+    for baskets in baskets_stream:
+        sizes = np.diff(baskets.indptr)
+        baskets = baskets[(sizes > 0) & (sizes <= max_basket)]
+        if not baskets.shape[0]:
+            continue
+        baskets_used += baskets.shape[0]
+        item_counts += np.asarray(baskets.sum(axis=0)).ravel()
+        counts = counts + (baskets.T @ baskets).astype(np.int32)
+    counts = counts.tocsr()
+    counts.setdiag(0)
+    counts.eliminate_zeros()
+    return counts, item_counts, baskets_used
+
+
+def normalize(counts, item_counts, baskets, measure, min_support):
+    """
+    Scores d'association à partir des co-occurrences
+
+    Returns:
+        csr_matrix: Scores float32 (paires sous le support minimal retirées)
+    """
+    scores = counts.astype(np.float32)
+    scores.data[counts.data < min_support] = 0
+    scores.eliminate_zeros()
+    rows = np.repeat(np.arange(scores.shape[0]), np.diff(scores.indptr))
+    n_i = item_counts[rows].astype(np.float64)
+    n_j = item_counts[scores.indices].astype(np.float64)
+    if measure == 'lift':
+        scores.data = (scores.data * baskets / (n_i * n_j)).astype(np.float32)
+    else:
+        scores.data = (scores.data / np.sqrt(n_i * n_j)).astype(np.float32)
+    return scores
+
+
+def top_neighbours(scores, catalog_ids, topk):
+    """
+    `topk` meilleurs voisins de chaque produit qui en a
+
+    Returns:
+        tuple: (IDs produits int64 triés, IDs voisins int64 (n, topk) avec -1
+            pour les cases vides, scores float32 (n, topk) décroissants)
+    """
+    rows = np.flatnonzero(np.diff(scores.indptr))
+    neighbours = np.full((len(rows), topk), -1, dtype=np.int64)
+    neighbour_scores = np.zeros((len(rows), topk), dtype=np.float32)
+    for position, row in enumerate(rows):
+        lo, hi = scores.indptr[row], scores.indptr[row + 1]
+        cols, values = scores.indices[lo:hi], scores.data[lo:hi]
+        if len(cols) > topk:
+            best = np.argpartition(-values, topk - 1)[:topk]
+            cols, values = cols[best], values[best]
+        order = np.lexsort((catalog_ids[cols], -values))  # Ex aequo : plus petit ID d'abord
+        neighbours[position, :len(order)] = catalog_ids[cols[order]]
+        neighbour_scores[position, :len(order)] = values[order]
+    return catalog_ids[rows], neighbours, neighbour_scores
+
+
+def build_table(measure=None, topk=None, min_support=None, max_basket=50, chunk_orders=20000):
+    """
+    Construit et publie la table des voisins « achetés ensemble »
+
+    Args:
+        measure (str): 'cosine' ou 'lift' (`RECS_COPURCHASE_MEASURE` par défaut)
+        topk (int): Voisins conservés par produit (`RECS_COPURCHASE_TOPK`)
+        min_support (int): Commandes communes minimales d'une paire
+            (`RECS_COPURCHASE_MIN_SUPPORT`)
+        max_basket (int): Taille maximale d'un panier pris en compte
+        chunk_orders (int): Commandes lues par lot
+
+    Returns:
+        dict: Statistiques du build (publié même s'il est vide)
+    """
+    measure = measure or getattr(settings, 'RECS_COPURCHASE_MEASURE', 'cosine')
+    topk = topk or getattr(settings, 'RECS_COPURCHASE_TOPK', 20)
+    if min_support is None:
+        min_support = getattr(settings, 'RECS_COPURCHASE_MIN_SUPPORT', 2)
+    if measure not in MEASURES:
+        raise ValueError(f"measure must be one of: {', '.join(MEASURES)}")
+
+    started = time.monotonic()
+    catalog_ids = np.array(Product.objects.order_by('pk').values_list('pk', flat=True), dtype=np.int64)
+    counts, item_counts, baskets = cooccurrence(
+        _stream_baskets(catalog_ids, chunk_orders), len(catalog_ids), max_basket,
+    )
+    scores = normalize(counts, item_counts, baskets, measure, min_support)
+    ids, neighbours, neighbour_scores = top_neighbours(scores, catalog_ids, topk)
+
+    STORE_DIR.mkdir(parents=True, exist_ok=True)
+    # Écriture dans un répertoire temporaire : une version n'est visible qu'une fois complète
+    building = Path(tempfile.mkdtemp(prefix='.building-', dir=STORE_DIR))
+    stats = {
+        'measure': measure, 'topk': topk, 'min_support': min_support, 'max_basket': max_basket,
+        'orders': baskets, 'pairs': int(scores.nnz), 'products': len(ids),
+        'built_at': time.time(), 'seconds': round(time.monotonic() - started, 3),
+    }
+    atomic_write(building / IDS_FILE, lambda fh: np.save(fh, ids))
+    atomic_write(building / NEIGHBOURS_FILE, lambda fh: np.save(fh, neighbours))
+    atomic_write(building / SCORES_FILE, lambda fh: np.save(fh, neighbour_scores))
+    atomic_write(building / META_FILE, lambda fh: fh.write(json.dumps(stats).encode('utf-8')))
+    root = publish_version(STORE_DIR, building)
+    logger.info('Table co-achats publiée dans %s : %s', root, stats)
+    return stats
+
+
+# =============================================================================
+# LECTURE
+# =============================================================================
+class CopurchaseTable:
+    """Table des voisins d'une version publiée (tableaux projetés en mémoire)"""
+
+    def __init__(self, root):
+        self.name = root.name
+        self.ids = np.load(root / IDS_FILE, mmap_mode='r')
+        self.neighbours = np.load(root / NEIGHBOURS_FILE, mmap_mode='r')
+        self.scores = np.load(root / SCORES_FILE, mmap_mode='r')
+
+    def similar(self, product_id, k):
+        """Jusqu'à k voisins [(product_id, score)], par score décroissant"""
+        position = int(np.searchsorted(self.ids, product_id))
+        if position >= len(self.ids) or self.ids[position] != product_id:
+            return []
+        row = self.neighbours[position, :k]
+        count = int(np.count_nonzero(row >= 0))
+        return [
+            (int(pid), float(score))
+            for pid, score in zip(row[:count], self.scores[position, :count])
+        ]
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def get_table():
+    """Table de la version publiée (rechargée si `CURRENT` change), ou None"""
+    global _table
+    root = published_dir(STORE_DIR)
+    if root is None:
+        return None
+    current = _table
+    if current is not None and current.name == root.name:
+        return current
+    with _table_lock:
+        if _table is None or _table.name != root.name:
+            _table = CopurchaseTable(root)
+        return _table
+
+
+def table_state():
+    """Nom de la version publiée ('' si aucune), sans charger la table"""
+    root = published_dir(STORE_DIR)
+    return root.name if root is not None else ''
+
+
+def query_copurchase(product_id, k=6):
+    """
+    Produits le plus souvent achetés avec un produit
+
+    Returns:
+        list: [(product_id, score), ...] ; vide si la table n'est pas construite
+            ou si le produit n'a jamais été acheté avec un autre
+    """
+    table = get_table()
+    if table is None:
+        return []
+    return table.similar(product_id, k)
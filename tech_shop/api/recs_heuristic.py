@@ -0,0 +1,86 @@
+"""
+Fichier: api/recs_heuristic.py
+
+Description (FR):
+- Moteur de recommandations heuristiques (sans index TF-IDF), utilisé par
+    `ProductRecommendations` et comme repli des vues TF-IDF.
+- Score d'un candidat (identique à l'ancienne implémentation en Python) :
+    - +2 s'il partage un mot de plus de 2 lettres avec le nom du produit ;
+    - +1 si son prix est dans une fourchette de +/-30 % ;
+    - à défaut de 6 candidats, complément par les produits les mieux notés.
+  Les meilleurs sont départagés par ID décroissant (produits récents d'abord).
+- Calcul vectorisé sur l'instantané en mémoire du catalogue (`api/catalog.py`) :
+    - mots communs : union des listes de lignes des mots du nom ;
+    - prix : masque sur la colonne des prix en centimes ;
+    - sélection des meilleurs par `argpartition` sur une clé (poids, ID) ;
+    - meilleures notes : tri `lexsort` sur les agrégats d'avis.
+  Une seule requête en base : le chargement des produits choisis.
+"""
+
+import numpy as np
+
+from .catalog import get_snapshot
+from .models import Product
+from .suggest import tokenize
+
+PRICE_RANGE = (7, 13)  # Fourchette de prix autour du produit, en dixièmes (+/-30 %)
+TOKEN_WEIGHT = 2
+PRICE_WEIGHT = 1
+
+
+def _best_ids(snapshot, weights, limit):
+    """IDs des `limit` lignes de poids non nul les plus fortes, départagées par ID décroissant"""
+    candidates = np.flatnonzero(weights)
+    if not len(candidates):
+        return []
+    # Clé unique (poids, ID) : un seul tri partiel au lieu d'un tri complet
+    keys = weights[candidates] * (int(snapshot.ids[-1]) + 1) + snapshot.ids[candidates]
+    if len(keys) > limit:
+        top = np.argpartition(-keys, limit - 1)[:limit]
+        candidates, keys = candidates[top], keys[top]
+    return snapshot.ids[candidates[np.argsort(-keys)]].tolist()
+
+
+def heuristic_recommendations(base, limit=6):
+    """
+    Recommandations heuristiques pour un produit
+
+    Args:
+        base (Product): Produit de référence
+        limit (int): Nombre de produits à renvoyer
+
+    Returns:
+        list: Produits recommandés (instances `Product`), du meilleur au moins bon
+    """
+    snapshot = get_snapshot()
+    weights = np.zeros(len(snapshot.ids), dtype=np.int64)  # Poids de chaque ligne
+
+    # 1) Correspondance par mots du nom
+    words = {word for word in tokenize(base.name) if len(word) > 2}
+    weights[snapshot.rows_with_tokens(words)] += TOKEN_WEIGHT
+
+    # 2) Proximité de prix (bornes entières : comparaison exacte en centimes)
+    if base.price is not None:
+        cents = int(round(base.price * 100))
+        low = -(-cents * PRICE_RANGE[0] // 10)  # Arrondi supérieur
+        high = cents * PRICE_RANGE[1] // 10
+        weights[snapshot.price_between(low, high)] += PRICE_WEIGHT
+
+    # Le produit de référence (et un éventuel produit supprimé) n'est jamais proposé
+    weights[~snapshot.alive] = 0
+    base_row = snapshot.row_of(base.pk)
+    if base_row is not None:
+        weights[base_row] = 0
+
+    chosen = _best_ids(snapshot, weights, limit)
+
+    # 3) Fallback : produits les mieux notés
+    if len(chosen) < limit:
+        exclude = weights > 0
+        if base_row is not None:
+            exclude[base_row] = True
+        chosen.extend(snapshot.top_rated(limit - len(chosen), exclude=exclude))
+
+    position = {product_id: i for i, product_id in enumerate(chosen)}
+    products = Product.objects.filter(pk__in=chosen)
+    return sorted(products, key=lambda p: position[p.pk])
@@ -0,0 +1,204 @@
+"""
+Fichier: api/recs_hybrid.py
+
+Description (FR):
+- Recommandations hybrides : les candidats de plusieurs sources sont réunis,
+    dédoublonnés puis classés par un mélange pondéré de leurs signaux :
+    - 'tfidf' : voisins textuels (`recs_tfidf.query_similar`, cosinus) ;
+    - 'copurchase' : produits achetés ensemble (`recs_copurchase`) ;
+    - 'price' : même gamme de prix (+/-30 %), proximité du prix ;
+    - 'rating' : produits les mieux notés, moyenne bayésienne des avis.
+  Chaque candidat reçoit les quatre signaux (nuls s'il n'a pas été proposé
+  par une source textuelle ou de co-achat) ; le score est le produit de la
+  matrice candidats x signaux par le vecteur des poids `RECS_HYBRID_WEIGHTS`.
+  Une source de poids nul n'est pas interrogée.
+- Budget de latence (`RECS_HYBRID_BUDGET_MS`) : les sources indexées sur
+    disque (TF-IDF, co-achats) sont interrogées en parallèle dans un petit pool
+    de threads ; celles qui n'ont pas répondu à l'échéance, ou qui échouent, sont
+    ignorées et signalées (`degraded`). Une requête en retard est annulée si
+    elle n'a pas démarré ; une source qui a déjà `MAX_IN_FLIGHT_PER_SOURCE`
+    requêtes en cours est sautée ('busy') plutôt que mise en file : une source
+    lente ne fait pas grossir la file du pool. Les signaux de prix et de notes viennent
+    de l'instantané en mémoire du catalogue (`api/catalog.py`) : toujours
+    disponibles, ils garantissent une réponse même si les deux index manquent.
+
+Comment ce fichier se connecte :
+- La vue `HybridRecommendations` (`api/views.py`) appelle `hybrid_recommendations`.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+from django.conf import settings
+
+from .catalog import get_snapshot
+from .recs_copurchase import query_copurchase
+from .recs_tfidf import query_similar
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ('tfidf', 'copurchase', 'price', 'rating')
+DEFAULT_WEIGHTS = {'tfidf': 0.45, 'copurchase': 0.35, 'price': 0.1, 'rating': 0.1}
+CANDIDATES_PER_SOURCE = 50  # Candidats demandés à chaque source
+PRICE_BAND = 0.3  # Gamme de prix : +/-30 % autour du produit
+RATING_PRIOR = 5  # Poids (en nombre d'avis) de la note moyenne globale
+MAX_IN_FLIGHT_PER_SOURCE = 2  # Requêtes en cours ou en file par source indexée
+
+# Sources interrogées en arrière-plan (index sur disque) ; les autres sont calculées
+# sur l'instantané du catalogue dans le thread de la requête
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='recs-hybrid')
+_INDEXED_SOURCES = {'tfidf': query_similar, 'copurchase': query_copurchase}
+_in_flight = {source: threading.BoundedSemaphore(MAX_IN_FLIGHT_PER_SOURCE) for source in _INDEXED_SOURCES}
+
+
+def weights():
+    """Poids des signaux (`RECS_HYBRID_WEIGHTS`, complétés par les valeurs par défaut)"""
+    configured = getattr(settings, 'RECS_HYBRID_WEIGHTS', {})
+    return {source: float(configured.get(source, DEFAULT_WEIGHTS[source])) for source in SOURCES}
+
+
+def _price_proximity(snapshot, rows, base_cents):
+    """1 au même prix, 0 à +/-30 % et au-delà"""
+    if base_cents <= 0:
+        return np.zeros(len(rows))
+    gap = np.abs(snapshot.price_cents[rows] - base_cents) / (PRICE_BAND * base_cents)
+    return np.clip(1 - gap, 0, 1)
+
+
+def _bayesian_ratings(snapshot, rows):
+    """Note moyenne ramenée vers la moyenne globale (peu d'avis = note prudente), sur [0, 1]"""
+    alive = snapshot.alive
+    total_count = snapshot.rating_count[alive].sum()
+    prior = snapshot.rating_sum[alive].sum() / total_count if total_count else 0.0
+    counts = snapshot.rating_count[rows]
+    return (snapshot.rating_sum[rows] + RATING_PRIOR * prior) / (counts + RATING_PRIOR) / 5
+
+
+def _rows_of(snapshot, hits):
+    """Lignes de l'instantané et scores des résultats d'une source (produits absents ignorés)"""
+    if not hits:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    ids = np.array([product_id for product_id, _ in hits], dtype=np.int64)
+    scores = np.array([score for _, score in hits], dtype=np.float64)
+    rows = np.minimum(np.searchsorted(snapshot.ids, ids), len(snapshot.ids) - 1)
+    known = (snapshot.ids[rows] == ids) & snapshot.alive[rows]
+    return rows[known], scores[known]
+
+
+def _submit(source, product_id):
+    """
+    Interroge une source indexée dans le pool, sauf si elle est saturée
+
+    Returns:
+        Future | None: Requête soumise ; None si la source a déjà
+            `MAX_IN_FLIGHT_PER_SOURCE` requêtes en cours ou en file
+    """
+    slot = _in_flight[source]
+    if not slot.acquire(blocking=False):
+        return None
+    try:
+        future = _executor.submit(_INDEXED_SOURCES[source], product_id, CANDIDATES_PER_SOURCE)
+    except BaseException:
+        slot.release()
+        raise
+    future.add_done_callback(lambda _: slot.release())  # Aussi à l'annulation
+    return future
+
+
+def hybrid_recommendations(product_id, k=6, budget_ms=None):
+    """
+    Recommandations hybrides pour un produit
+
+    Args:
+        product_id (int): Produit de référence
+        k (int): Nombre de produits à renvoyer
+        budget_ms (float): Temps laissé aux sources indexées (`RECS_HYBRID_BUDGET_MS`)
+
+    Returns:
+        tuple | None: (IDs recommandés du meilleur au moins bon, état de chaque
+            source : 'ok', 'empty', 'timeout', 'busy', 'error' ou 'disabled') ; None si
+            le produit n'existe pas
+    """
+    started = time.monotonic()
+    if budget_ms is None:
+        budget_ms = getattr(settings, 'RECS_HYBRID_BUDGET_MS', 150)
+    blend = weights()
+    status = {source: 'disabled' for source in SOURCES if not blend[source]}
+
+    snapshot = get_snapshot()
+    base_row = snapshot.row_of(product_id)
+    if base_row is None:
+        return None
+
+    futures = {}
+    for source in _INDEXED_SOURCES:
+        if not blend[source]:
+            continue
+        future = _submit(source, product_id)
+        if future is None:
+            status[source] = 'busy'
+        else:
+            futures[future] = source
+
+    base_cents = int(snapshot.price_cents[base_row])
+
+    # Sources calculées sur l'instantané : gamme de prix et meilleures notes
+    candidates = [np.zeros(0, dtype=np.int64)]
+    if blend['price']:
+        band = snapshot.price_between(
+            int(base_cents * (1 - PRICE_BAND)), int(np.ceil(base_cents * (1 + PRICE_BAND))),
+        )
+        rows = np.flatnonzero(band)
+        if len(rows) > CANDIDATES_PER_SOURCE:
+            closeness = np.abs(snapshot.price_cents[rows] - base_cents)
+            rows = rows[np.argpartition(closeness, CANDIDATES_PER_SOURCE - 1)[:CANDIDATES_PER_SOURCE]]
+        candidates.append(rows)
+        status['price'] = 'ok' if len(rows) else 'empty'
+    if blend['rating']:
+        rows, _ = _rows_of(snapshot, [(pid, 0) for pid in snapshot.top_rated(CANDIDATES_PER_SOURCE)])
+        candidates.append(rows)
+        status['rating'] = 'ok' if len(rows) else 'empty'
+
+    # Sources indexées : attendues au plus jusqu'à l'échéance du budget
+    remaining = max(0.0, budget_ms / 1000 - (time.monotonic() - started))
+    done, pending = wait(futures, timeout=remaining)
+    signals = {}
+    for future in pending:
+        future.cancel()  # Sans effet si elle a déjà démarré
+        status[futures[future]] = 'timeout'
+    for future in done:
+        source = futures[future]
+        try:
+            rows, scores = _rows_of(snapshot, future.result())
+        except Exception:
+            logger.exception('Source de recommandations %s en échec', source)
+            status[source] = 'error'
+            continue
+        status[source] = 'ok' if len(rows) else 'empty'
+        if len(rows):
+            signals[source] = (rows, scores / scores.max() if scores.max() > 0 else scores)
+            candidates.append(rows)
+
+    # Candidats dédoublonnés, sans le produit de référence
+    rows = np.unique(np.concatenate(candidates))
+    rows = rows[rows != base_row]
+    if not len(rows):
+        return [], status
+
+    features = np.zeros((len(rows), len(SOURCES)))
+    for column, source in enumerate(SOURCES[:2]):
+        if source in signals:
+            source_rows, scores = signals[source]
+            features[np.searchsorted(rows, source_rows), column] = scores
+    features[:, 2] = _price_proximity(snapshot, rows, base_cents)
+    features[:, 3] = _bayesian_ratings(snapshot, rows)
+    scores = features @ np.array([blend[source] for source in SOURCES])
+
+    if len(rows) > k:
+        top = np.argpartition(-scores, k - 1)[:k]
+        rows, scores = rows[top], scores[top]
+    order = np.lexsort((-snapshot.ids[rows], -scores))  # Ex aequo : produits récents d'abord
+    return snapshot.ids[rows[order]].tolist(), status
@@ -0,0 +1,327 @@
+"""
+Fichier: api/recs_personal.py
+
+Description (FR):
+- Recommandations personnalisées, précalculées chaque nuit pour tous les
+    utilisateurs ayant acheté ou noté des produits :
+    - profil d'un utilisateur : somme des lignes TF-IDF (`recs_tfidf`) des
+        produits de ses commandes payées (poids 1) et de ses avis (poids
+        (note - 3) / 2 : un avis 5 étoiles rapproche, un avis 1 étoile éloigne),
+        atténués par l'ancienneté (demi-vie `RECS_PERSONAL_HALF_LIFE_DAYS`) ;
+    - le catalogue est noté par similarité cosinus avec le profil, par lots
+        d'utilisateurs (`chunk_users`) répartis sur un pool de processus
+        (`RECS_PERSONAL_WORKERS`, calcul dans `recs_personal_build`) ; les
+        produits déjà achetés ou notés sont exclus ;
+    - seuls les `RECS_PERSONAL_TOPN` meilleurs produits de chaque utilisateur
+        sont conservés.
+- Liste « populaire » calculée avec la table : produits les plus vendus sur
+    `RECS_PERSONAL_POPULAR_DAYS` jours, complétés par les mieux notés. Elle
+    sert les utilisateurs sans historique (démarrage à froid) et complète, dès
+    le build, les listes personnelles trop courtes (sans les produits déjà
+    achetés ou notés).
+- Stockage compact (`recs_index/personal/v<ns>/`, publié comme la table des
+    co-achats) :
+    - `user_rows.npy` : ligne de chaque utilisateur, indexée directement par
+        son ID (int32, -1 = aucune) ;
+    - `recommendations.npy` : IDs produits (int32, (utilisateurs, topn), -1 = vide).
+  Lecture en O(1) : deux accès à des tableaux projetés en mémoire.
+
+Comment ces fichiers se connectent :
+- La commande `build_personal_recs` (cron, chaque nuit) appelle `build_table`.
+- La vue `MyRecommendations` (`api/views.py`) appelle `personal_recommendations`.
+"""
+
+import json
+import logging
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+from scipy.sparse import csr_matrix, vstack
+
+from .catalog import get_snapshot
+from .models import Order, OrderItem, Review
+from .recs_copurchase import atomic_write, published_dir, publish_version
+from .recs_personal_build import init_worker, score_users
+from .recs_tfidf import STORE_DIR as TFIDF_STORE_DIR, get_index
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# STOCKAGE
+# =============================================================================
+STORE_DIR = TFIDF_STORE_DIR / 'personal'
+
+USER_ROWS_FILE = 'user_rows.npy'  # Ligne de chaque utilisateur, indexée par son ID (int32, -1 = aucune)
+RECOMMENDATIONS_FILE = 'recommendations.npy'  # IDs produits (int32, (utilisateurs, topn), -1 = vide)
+POPULAR_FILE = 'popular.npy'  # IDs des produits populaires (int64)
+META_FILE = 'meta.json'  # Paramètres et statistiques du build
+
+PURCHASE_WEIGHT = 1.0  # Poids d'un produit acheté dans le profil
+
+
+# =============================================================================
+# CONSTRUCTION
+# =============================================================================
+def _decay(dates, now, half_life_days):
+    """Atténuation par l'ancienneté : 1 aujourd'hui, 0,5 après une demi-vie"""
+    ages = np.array([(now - date).total_seconds() for date in dates], dtype=np.float64)
+    return 0.5 ** (np.maximum(ages, 0) / (half_life_days * 86400))
+
+
+def _user_ids():
+    """IDs (triés) des utilisateurs ayant une commande payée ou un avis (commandes invitées exclues)"""
+    buyers = Order.objects.filter(
+        status=Order.COMPLETED, user__isnull=False,
+    ).values_list('user_id', flat=True).distinct()
+    reviewers = Review.objects.values_list('user_id', flat=True).distinct()
+    return np.union1d(np.array(list(buyers), dtype=np.int64), np.array(list(reviewers), dtype=np.int64))
+
+
+def _interactions(user_ids, now, half_life_days):
+    """
+    Interactions pondérées d'un lot d'utilisateurs
+
+    Returns:
+        tuple: (IDs utilisateurs, IDs produits, poids), tableaux de même longueur
+    """
+    purchases = list(OrderItem.objects.filter(
+        order__user_id__in=user_ids, order__user__isnull=False, order__status=Order.COMPLETED,
+    ).values_list('order__user_id', 'product_id', 'order__created_at'))
+    reviews = list(Review.objects.filter(user_id__in=user_ids).values_list(
+        'user_id', 'product_id', 'rating', 'updated_at',
+    ))
+    users = np.array([row[0] for row in purchases] + [row[0] for row in reviews], dtype=np.int64)
+    products = np.array([row[1] for row in purchases] + [row[1] for row in reviews], dtype=np.int64)
+    weights = np.concatenate([
+        np.full(len(purchases), PURCHASE_WEIGHT),
+        (np.array([row[2] for row in reviews], dtype=np.float64) - 3) / 2,
+    ])
+    dates = [row[2] for row in purchases] + [row[3] for row in reviews]
+    return users, products, weights * _decay(dates, now, half_life_days)
+
+
+def _catalog():
+    """
+    Catalogue indexé : matrice TF-IDF (base puis delta), masque des lignes
+    valides et ID produit de chaque ligne ; None si l'index est vide
+    """
+    index = get_index()
+    if index is None or index.is_empty:
+        return None
+    matrix = index.dequantized_matrix().astype(np.float32)
+    if index.delta_matrix is not None:
+        matrix = vstack([matrix, index.delta_matrix.astype(np.float32)]).tocsr()
+    ids = np.array(index.ids + index.delta_ids, dtype=np.int64)
+    return matrix, index.alive.copy(), ids
+
+
+def _weight_chunks(user_ids, product_rows, n_rows, chunk_users, now, half_life_days):
+    """
+    Lots d'utilisateurs sous forme de matrices creuses utilisateurs x lignes
+
+    Args:
+        product_rows: Fonction IDs produits -> lignes du catalogue (-1 si absent)
+        n_rows (int): Nombre de lignes du catalogue
+
+    Yields:
+        tuple: (IDs utilisateurs du lot, matrice CSR des poids)
+    """
+    for start in range(0, len(user_ids), chunk_users):
+        chunk = user_ids[start:start + chunk_users]
+        users, products, weights = _interactions(chunk.tolist(), now, half_life_days)
+        rows = product_rows(products)
+        known = rows >= 0
+        yield chunk, csr_matrix(
+            (weights[known], (np.searchsorted(chunk, users[known]), rows[known])),
+            shape=(len(chunk), n_rows), dtype=np.float32,
+        )  # Les doublons (achat + avis d'un même produit) sont additionnés ; les sommes nulles restent stockées
+
+
+def _score_chunks(chunks, matrix, alive, popular, topn, workers):
+    """
+    Note les lots d'utilisateurs, en parallèle si `workers` > 1
+
+    Au plus deux lots par processus sont en attente, comme `_count_shards`
+    (`recs_tfidf`) : la mémoire reste bornée quel que soit le nombre d'utilisateurs.
+
+    Yields:
+        tuple: (IDs utilisateurs du lot, lignes recommandées), dans l'ordre des lots
+    """
+    if workers <= 1:
+        init_worker(matrix, alive, popular)
+        for users, weights in chunks:
+            yield users, score_users(weights, topn)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(matrix, alive, popular)) as executor:
+        pending = deque()
+        for users, weights in chunks:
+            pending.append((users, executor.submit(score_users, weights, topn)))
+            if len(pending) >= 2 * workers:
+                users, future = pending.popleft()
+                yield users, future.result()
+        while pending:
+            users, future = pending.popleft()
+            yield users, future.result()
+
+
+def popular_products(limit, days=None):
+    """
+    Produits les plus vendus (commandes payées récentes), complétés par les
+    mieux notés du catalogue
+
+    Returns:
+        list: Jusqu'à `limit` IDs produits
+    """
+    if days is None:
+        days = getattr(settings, 'RECS_PERSONAL_POPULAR_DAYS', 30)
+    snapshot = get_snapshot()
+    sold = OrderItem.objects.filter(
+        order__status=Order.COMPLETED, order__created_at__gte=timezone.now() - timedelta(days=days),
+    ).values('product_id').annotate(units=Sum('quantity')).order_by('-units', 'product_id')
+    ids = [row['product_id'] for row in sold[:2 * limit] if snapshot.row_of(row['product_id']) is not None][:limit]
+    chosen = set(ids)
+    ids += [pid for pid in snapshot.top_rated(2 * limit) if pid not in chosen]
+    return ids[:limit]
+
+
+def build_table(topn=None, workers=None, chunk_users=500, half_life_days=None):
+    """
+    Calcule et publie les recommandations de tous les utilisateurs
+
+    Args:
+        topn (int): Produits conservés par utilisateur (`RECS_PERSONAL_TOPN`)
+        workers (int): Processus de calcul (`RECS_PERSONAL_WORKERS`)
+        chunk_users (int): Utilisateurs par lot
+        half_life_days (float): Demi-vie des interactions (`RECS_PERSONAL_HALF_LIFE_DAYS`)
+
+    Returns:
+        dict: Statistiques du build (publié même sans index TF-IDF : seule la
+            liste populaire est alors servie)
+    """
+    topn = topn or getattr(settings, 'RECS_PERSONAL_TOPN', 50)
+    workers = workers or getattr(settings, 'RECS_PERSONAL_WORKERS', 2)
+    half_life_days = half_life_days or getattr(settings, 'RECS_PERSONAL_HALF_LIFE_DAYS', 90)
+
+    started = time.monotonic()
+    now = timezone.now()
+    # Réserve pour compléter les listes une fois les produits de l'utilisateur exclus
+    popular = np.array(popular_products(2 * topn), dtype=np.int64)
+    catalog = _catalog()
+    user_ids = _user_ids() if catalog is not None else np.zeros(0, dtype=np.int64)
+
+    STORE_DIR.mkdir(parents=True, exist_ok=True)
+    # Écriture dans un répertoire temporaire : une version n'est visible qu'une fois complète
+    building = Path(tempfile.mkdtemp(prefix='.building-', dir=STORE_DIR))
+    user_rows = np.full(int(user_ids[-1]) + 1 if len(user_ids) else 0, -1, dtype=np.int32)
+    user_rows[user_ids] = np.arange(len(user_ids), dtype=np.int32)
+    # Tableau écrit directement sur disque, lot par lot
+    recommendations = np.lib.format.open_memmap(
+        building / RECOMMENDATIONS_FILE, mode='w+', dtype=np.int32, shape=(len(user_ids), topn),
+    )
+    if len(user_ids):
+        matrix, alive, ids = catalog
+        if ids.max() > np.iinfo(np.int32).max:
+            raise ValueError('product ids do not fit the int32 recommendations table')
+        alive_rows = np.flatnonzero(alive)
+        alive_rows = alive_rows[np.argsort(ids[alive_rows])]
+        sorted_ids = ids[alive_rows]
+
+        def product_rows(products):
+            positions = np.minimum(np.searchsorted(sorted_ids, products), len(sorted_ids) - 1)
+            return np.where(sorted_ids[positions] == products, alive_rows[positions], -1)
+
+        chunks = _weight_chunks(user_ids, product_rows, len(ids), chunk_users, now, half_life_days)
+        popular_rows = product_rows(popular)
+        popular_rows = popular_rows[popular_rows >= 0]
+        for users, best in _score_chunks(chunks, matrix, alive, popular_rows, topn, workers):
+            start = int(user_rows[users[0]])
+            best_ids = np.where(best >= 0, ids[np.maximum(best, 0)], -1)
+            recommendations[start:start + len(users), :best.shape[1]] = best_ids
+            recommendations[start:start + len(users), best.shape[1]:] = -1
+    recommendations.flush()
+    del recommendations
+
+    stats = {
+        'topn': topn, 'workers': workers, 'half_life_days': half_life_days,
+        'users': len(user_ids), 'popular': len(popular),
+        'built_at': time.time(), 'seconds': round(time.monotonic() - started, 3),
+    }
+    atomic_write(building / USER_ROWS_FILE, lambda fh: np.save(fh, user_rows))
+    atomic_write(building / POPULAR_FILE, lambda fh: np.save(fh, popular))
+    atomic_write(building / META_FILE, lambda fh: fh.write(json.dumps(stats).encode('utf-8')))
+    root = publish_version(STORE_DIR, building)
+    logger.info('Recommandations personnalisées publiées dans %s : %s', root, stats)
+    return stats
+
+
+# =============================================================================
+# LECTURE
+# =============================================================================
+class PersonalTable:
+    """Recommandations d'une version publiée (tableaux projetés en mémoire)"""
+
+    def __init__(self, root):
+        self.name = root.name
+        self.user_rows = np.load(root / USER_ROWS_FILE, mmap_mode='r')
+        self.recommendations = np.load(root / RECOMMENDATIONS_FILE, mmap_mode='r')
+        self.popular = np.load(root / POPULAR_FILE).tolist()
+
+    def for_user(self, user_id, k):
+        """Jusqu'à k IDs produits recommandés à un utilisateur ([] s'il est inconnu)"""
+        if not 0 <= user_id < len(self.user_rows):
+            return []
+        row = int(self.user_rows[user_id])
+        if row < 0:
+            return []
+        return [int(pid) for pid in self.recommendations[row, :k] if pid >= 0]
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def get_table():
+    """Table de la version publiée (rechargée si `CURRENT` change), ou None"""
+    global _table
+    root = published_dir(STORE_DIR)
+    if root is None:
+        return None
+    current = _table
+    if current is not None and current.name == root.name:
+        return current
+    with _table_lock:
+        if _table is None or _table.name != root.name:
+            _table = PersonalTable(root)
+        return _table
+
+
+def personal_recommendations(user_id, k=12):
+    """
+    Produits recommandés à un utilisateur
+
+    Sans liste (nouvel utilisateur, table non construite), les produits
+    populaires sont renvoyés ; ils complètent aussi une liste plus courte que k.
+
+    Returns:
+        tuple: (IDs produits, source : 'personal' ou 'popular')
+    """
+    table = get_table()
+    if table is None:
+        return get_snapshot().top_rated(k), 'popular'
+    ids = table.for_user(user_id, k)
+    source = 'personal' if ids else 'popular'
+    if len(ids) < k:
+        chosen = set(ids)
+        ids += [pid for pid in table.popular if pid not in chosen][:k - len(ids)]
+    return ids, source
@@ -0,0 +1,100 @@
+"""
+Fichier: api/recs_personal_build.py
+
+Description (FR):
+- Calcul des recommandations personnalisées d'un lot d'utilisateurs, utilisé
+    par `recs_personal.build_table()` :
+    - init_worker(matrix, alive, popular) : reçoit une fois par processus la
+        matrice TF-IDF du catalogue (lignes normalisées), le masque des lignes
+        valides et les lignes des produits populaires ;
+    - score_users(weights, topn) : profils des utilisateurs (somme pondérée des
+        lignes de leurs produits, normalisée), score cosinus de tout le
+        catalogue par blocs d'utilisateurs à mémoire bornée
+        (`SCORE_BLOCK_BYTES`), puis `topn` meilleures lignes par utilisateur.
+        Les produits populaires reçoivent un score plancher infime : ils
+        complètent les listes trop courtes, dans l'ordre de popularité. Les
+        produits avec lesquels l'utilisateur a déjà interagi sont exclus.
+
+Comment ce fichier se connecte :
+- Le module n'importe pas Django : les processus du pool peuvent le charger
+    sans initialiser l'application (méthode de démarrage `spawn` sous Windows
+    et macOS), comme `recs_tfidf_build`.
+"""
+
+import numpy as np
+from sklearn.preprocessing import normalize
+
+_matrix = None  # Matrice TF-IDF (produits x vocabulaire) du processus
+_matrix_t = None  # Transposée CSR, pour le produit profils x catalogue
+_alive = None  # Masque des lignes valides
+_popular = None  # Lignes des produits populaires, du plus au moins populaire
+_popular_floor = None  # Scores planchers correspondants (décroissants, << tout cosinus utile)
+
+POPULAR_FLOOR = 1e-6
+SCORE_BLOCK_BYTES = 64 * 2 ** 20  # Mémoire de travail visée par bloc d'utilisateurs
+# Octets par case (utilisateur, produit) : produit creux, scores float32,
+# indices int64 de `argpartition`
+BYTES_PER_SCORE = 32
+
+
+def init_worker(matrix, alive, popular):
+    """Initialise un processus du pool avec le catalogue"""
+    global _matrix, _matrix_t, _alive, _popular, _popular_floor
+    _matrix = matrix.tocsr()
+    _matrix_t = _matrix.T.tocsr()
+    _alive = alive
+    _popular = popular
+    _popular_floor = POPULAR_FLOOR * np.arange(len(popular), 0, -1, dtype=np.float32) / max(len(popular), 1)
+
+
+def score_users(weights, topn):
+    """
+    Meilleures lignes du catalogue pour un lot d'utilisateurs
+
+    Les scores sont calculés par blocs d'utilisateurs dimensionnés d'après la
+    taille du catalogue : la matrice dense des scores d'un bloc (et les
+    tableaux de la sélection) reste sous `SCORE_BLOCK_BYTES`, quel que soit
+    le nombre d'utilisateurs du lot.
+
+    Args:
+        weights: Matrice CSR (utilisateurs x lignes du catalogue) des poids
+            d'interaction (achats, avis, atténués par l'ancienneté) ; chaque
+            interaction y est stockée, même de poids nul
+        topn (int): Lignes conservées par utilisateur
+
+    Returns:
+        numpy.ndarray: Lignes recommandées int32 (utilisateurs, topn), par score
+            décroissant, -1 pour les cases vides (score non positif)
+    """
+    n_users, n_rows = weights.shape
+    topn = min(topn, n_rows)
+    best = np.full((n_users, topn), -1, dtype=np.int32)
+    if not topn:
+        return best
+    block = max(1, SCORE_BLOCK_BYTES // (BYTES_PER_SCORE * max(n_rows, 1)))
+    for start in range(0, n_users, block):
+        stop = min(start + block, n_users)
+        best[start:stop] = _score_block(weights[start:stop], topn)
+    return best
+
+
+def _score_block(weights, topn):
+    """`score_users` pour un bloc d'utilisateurs tenant dans le budget mémoire"""
+    profiles = normalize(weights @ _matrix)
+    scores = (profiles @ _matrix_t).toarray().astype(np.float32, copy=False)
+    scores[:, _popular] = np.maximum(scores[:, _popular], _popular_floor)
+    scores[:, ~_alive] = 0
+    # Produits déjà achetés ou notés : structure de la matrice, pas ses valeurs
+    # (un avis 3 étoiles pèse 0, un achat suivi d'un avis 1 étoile aussi)
+    users = np.repeat(np.arange(weights.shape[0]), np.diff(weights.indptr))
+    scores[users, weights.indices] = 0
+
+    # Sélection partielle sans copie négative de la matrice : les `topn` plus
+    # grands scores sont en fin de ligne
+    top = np.argpartition(scores, scores.shape[1] - topn, axis=1)[:, -topn:]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    del scores
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1).astype(np.int32)
+    top[np.take_along_axis(top_scores, order, axis=1) <= 0] = -1
+    return top
@@ -1,140 +1,1676 @@
-"""
-Fichier: api/recs_tfidf.py
-
-Description (FR):
-- Implémente une indexation locale TF-IDF pour fournir des recommandations
-    de produits similaires sans dépendre de services externes.
-
-- Fonctions principales :
-    - build_index(force=False) : construit l'index TF-IDF à partir des champs
-        `name` + `description` des produits, et persiste le vecteur, la matrice et
-        la liste d'ids sur disque avec joblib dans `recs_index/`.
-    - query_similar(product_id, k=6) : charge les artefacts et renvoie jusqu'à k
-        produits similaires sous forme de liste de tuples (product_id, score).
-
-Comment ces fichiers se connectent :
-- La vue `TFIDFRecommendations` dans `api/views.py` appelle `query_similar`
-    pour récupérer les ids similaires puis sérialise les produits via
-    `ProductSerializer` pour renvoyer des objets JSON au frontend.
-
-Remarque sécurité/ops :
-- Les dépendances (scikit-learn, joblib, numpy) doivent être installées côté
-    backend avant d'exécuter `python manage.py build_recs_index`.
-"""
-
-import os
-from pathlib import Path
-from sklearn.feature_extraction.text import TfidfVectorizer  # Vectorisation TF-IDF
-from sklearn.metrics.pairwise import linear_kernel  # Calcul similarité cosinus
-import joblib  # Sauvegarde/chargement des modèles
-
-from .models import Product  # Modèle Product pour récupérer les données
-
-# =============================================================================
-# CONFIGURATION DES CHEMINS DE STOCKAGE
-# =============================================================================
-BASE_DIR = Path(__file__).resolve().parent.parent  # Répertoire racine du projet
-STORE_DIR = BASE_DIR / 'recs_index'  # Dossier de stockage des index
-STORE_DIR.mkdir(exist_ok=True)  # Crée le dossier s'il n'existe pas
-
-# Chemins des fichiers de sauvegarde
-VECTORIZER_PATH = STORE_DIR / 'tfidf_vectorizer.joblib'  # Vecteur TF-IDF entraîné
-MATRIX_PATH = STORE_DIR / 'tfidf_matrix.joblib'  # Matrice des caractéristiques
-IDS_PATH = STORE_DIR / 'product_ids.joblib'  # Liste des IDs produits indexés
-
-
-def build_index(force=False):
-    """
-    Construit l'index TF-IDF à partir des noms et descriptions des produits
-    
-    Args:
-        force (bool): Si True, force la reconstruction même si l'index existe
-    """
-    # Vérifie si l'index existe déjà et si on ne force pas la reconstruction
-    if VECTORIZER_PATH.exists() and MATRIX_PATH.exists() and IDS_PATH.exists() and not force:
-        return  # Index déjà existant, on sort
-
-    # Récupère tous les produits de la base de données
-    products = Product.objects.all()
-    docs = []  # Liste des textes à analyser (nom + description)
-    ids = []   # Liste des IDs produits correspondants
-    
-    # Prépare les données pour le TF-IDF
-    for p in products:
-        # Combine le nom et la description en un seul texte
-        text = f"{p.name or ''} " + (p.description or '')
-        docs.append(text)
-        ids.append(p.id)
-
-    # Cas où il n'y a pas de produits à indexer
-    if not docs:
-        # Sauvegarde des structures vides
-        joblib.dump([], IDS_PATH)
-        joblib.dump(None, VECTORIZER_PATH)
-        joblib.dump(None, MATRIX_PATH)
-        return
-
-    # Création du vectoriseur TF-IDF avec paramètres
-    vectorizer = TfidfVectorizer(
-        max_features=10000,  # Nombre maximum de caractéristiques (mots)
-        stop_words='english'  # Supprime les mots vides anglais (the, and, etc.)
-    )
-    
-    # Transformation des textes en matrice TF-IDF
-    matrix = vectorizer.fit_transform(docs)
-
-    # Sauvegarde des artefacts sur le disque
-    joblib.dump(vectorizer, VECTORIZER_PATH)  # Sauvegarde le vectoriseur
-    joblib.dump(matrix, MATRIX_PATH)          # Sauvegarde la matrice TF-IDF
-    joblib.dump(ids, IDS_PATH)                # Sauvegarde la liste des IDs
-
-
-def query_similar(product_id, k=6):
-    """
-    Trouve les produits similaires à un produit donné
-    
-    Args:
-        product_id (int): ID du produit de référence
-        k (int): Nombre maximum de produits similaires à retourner
-    
-    Returns:
-        list: Liste de tuples (product_id, score_similarité)
-    """
-    # Vérifie si les fichiers d'index existent, sinon construit l'index
-    if not VECTORIZER_PATH.exists() or not MATRIX_PATH.exists() or not IDS_PATH.exists():
-        build_index()  # Construction automatique si index manquant
-
-    # Chargement des artefacts depuis le disque
-    ids = joblib.load(IDS_PATH)           # Liste des IDs produits
-    vectorizer = joblib.load(VECTORIZER_PATH)  # Vectoriseur TF-IDF
-    matrix = joblib.load(MATRIX_PATH)     # Matrice des caractéristiques
-
-    # Vérification des données chargées
-    if not ids or vectorizer is None or matrix is None:
-        return []  # Retourne liste vide si problème
-
-    try:
-        # Trouve l'index du produit dans la liste
-        idx = ids.index(product_id)
-    except ValueError:
-        # Produit non trouvé dans l'index
-        return []
-
-    # Calcul des similarités cosinus entre le produit et tous les autres
-    cosine_similarities = linear_kernel(matrix[idx:idx+1], matrix).flatten()
-    
-    # Met la similarité avec soi-même à -1 pour éviter de se recommander
-    cosine_similarities[idx] = -1
-    
-    # Trie les indices par similarité décroissante et prend les k premiers
-    related_indices = cosine_similarities.argsort()[::-1][:k]
-
-    # Construction du résultat
-    result = []
-    for i in related_indices:
-        if cosine_similarities[i] <= 0:
-            continue  # Ignore les similarités négatives ou nulles
-        # Ajoute le tuple (ID produit, score de similarité)
-        result.append((ids[i], float(cosine_similarities[i])))
-
-    return result
+"""
+Fichier: api/recs_tfidf.py
+
+Description (FR):
+- Implémente une indexation locale TF-IDF pour fournir des recommandations
+    de produits similaires sans dépendre de services externes.
+
+- Fonctions principales :
+    - build_index(force=False, storage=None, quantize=None, workers=None) : construit
+        l'index TF-IDF à partir des champs `name` + `description` des produits, lus
+        en flux (`values_list().iterator()`) et tokenisés par lots dans un pool de
+        processus (voir `api/recs_tfidf_build.py`), et persiste
+        le vecteur, la matrice et la liste d'ids dans `recs_index/`, soit avec
+        joblib (format historique), soit au format `npy` : tableaux CSR bruts
+        (`data`/`indices`/`indptr`) en float32, éventuellement quantifiés en int8,
+        ouverts en `mmap_mode='r'` pour que les workers partagent le cache disque.
+    - build_neighbours(topk, chunk_size) : précalcule, par blocs de produits
+        matriciels creux, les k plus proches voisins de chaque produit et les
+        persiste en tableaux compacts int32/float32 (`.npy`).
+    - build_ann(tables, bits) : construit un index approximatif (LSH par
+        projections aléatoires / SimHash) pour les très gros catalogues ; le moteur
+        utilisé par `query_similar` est choisi par `settings.RECS_TFIDF_ENGINE`
+        ('exact' ou 'ann'), et `evaluate_ann_recall()` mesure le rappel@k de l'ANN
+        face au moteur exact.
+    - get_index() : renvoie l'index chargé en mémoire pour le processus courant
+        (`TfidfIndex`), rechargé uniquement si les artefacts sur disque changent.
+        Chaque build est écrit dans un répertoire de version `recs_index/v<ns>/`
+        puis publié en remplaçant atomiquement le pointeur `recs_index/CURRENT`.
+    - request_build() / index_ready() : sur le chemin des requêtes, l'index
+        manquant est construit dans un thread d'arrière-plan (un seul builder à
+        la fois grâce au verrou `build.lock`) ; la requête n'attend jamais.
+    - query_similar(product_id, k=6) : utilise l'index en mémoire et renvoie jusqu'à k
+        produits similaires sous forme de liste de tuples (product_id, score).
+        Si la table des voisins existe, la réponse est une simple lecture O(k).
+    - search_products(query, offset, limit) : recherche plein texte classée par
+        pertinence : la requête est vectorisée avec le `TfidfVectorizer` persisté
+        et comparée aux seuls produits contenant ses termes (index inversé CSC).
+    - query_similar_many(product_ids, k=6, merge='max') : recommandations pour un
+        ensemble de produits (ex: contenu d'un panier) calculées en une seule
+        opération matricielle creuse, sans les produits d'entrée.
+
+- Maintenance incrémentale (déclenchée par les signaux de `Product`) :
+    - upsert_product(product_id, text) : vectorise un produit créé/modifié avec
+        les poids IDF existants et l'ajoute (ou le remplace) dans un petit
+        segment « delta » persisté à côté de l'index principal.
+    - remove_product(product_id) : marque un produit supprimé (tombstone).
+    - Ces deux fonctions ne bloquent jamais la requête : si le verrou d'écriture
+        est pris (build, compaction), la modification est mise en file et
+        écrite par un thread d'arrière-plan dès sa libération. Un index publié
+        sans vocabulaire (catalogue vide) est reconstruit en arrière-plan.
+    - compact_index() : fusionne le delta dans l'index principal, uniquement
+        quand la dérive (delta + tombstones) dépasse un seuil.
+    - Une reconstruction complète (ré-apprentissage des poids IDF) est lancée
+        périodiquement (`RECS_TFIDF_REFIT_INTERVAL`).
+    - Compaction et ré-apprentissage ne s'exécutent jamais dans la requête qui
+        modifie un produit : `request_maintenance()` les lance dans un thread
+        d'arrière-plan, ou `build_recs_index --maintain` depuis un cron.
+
+Comment ces fichiers se connectent :
+- La vue `TFIDFRecommendations` dans `api/views.py` appelle `query_similar`
+    pour récupérer les ids similaires puis sérialise les produits via
+    `ProductSerializer` pour renvoyer des objets JSON au frontend.
+- `api/signals.py` appelle `upsert_product` / `remove_product` après chaque
+    création, modification ou suppression de produit.
+
+Remarque sécurité/ops :
+- Les dépendances (scikit-learn, joblib, numpy) doivent être installées côté
+    backend avant d'exécuter `python manage.py build_recs_index`.
+"""
+
+import copy
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+from scipy.sparse import csr_matrix, vstack  # Reconstruction / fusion des matrices creuses
+import joblib  # Sauvegarde/chargement des modèles
+from django.conf import settings
+
+from .models import Product  # Modèle Product pour récupérer les données
+from .recs_tfidf_build import count_shard, assemble_tfidf  # Étapes de calcul par lots
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl  # Verrou de fichier inter-processus (Unix)
+except ImportError:  # Windows : seul le verrou entre threads s'applique
+    fcntl = None
+
+# =============================================================================
+# CONFIGURATION DES CHEMINS DE STOCKAGE
+# =============================================================================
+BASE_DIR = Path(__file__).resolve().parent.parent  # Répertoire racine du projet
+STORE_DIR = BASE_DIR / 'recs_index'  # Dossier de stockage des index
+STORE_DIR.mkdir(exist_ok=True)  # Crée le dossier s'il n'existe pas
+
+# Chaque build est écrit dans son propre répertoire `v<horodatage>/`, puis publié
+# en remplaçant atomiquement le pointeur `CURRENT` (os.replace) : un lecteur voit
+# toujours un jeu de fichiers complet, jamais un vectoriseur neuf avec une
+# ancienne matrice. Les versions précédentes restent lisibles par les processus
+# qui les ont déjà chargées (mmap) jusqu'à leur suppression.
+CURRENT_PATH = STORE_DIR / 'CURRENT'  # Nom du répertoire de la version servie
+LOCK_PATH = STORE_DIR / 'build.lock'  # Verrou des écritures de l'index
+VERSIONS_KEPT = 3  # Versions conservées sur disque (dont la version courante)
+
+# Fichiers d'une version
+VECTORIZER_FILE = 'tfidf_vectorizer.joblib'  # Vecteur TF-IDF entraîné
+MATRIX_FILE = 'tfidf_matrix.joblib'  # Matrice des caractéristiques
+IDS_FILE = 'product_ids.joblib'  # Liste des IDs produits indexés
+META_FILE = 'index_meta.json'  # Format de stockage et métadonnées
+
+# Format `npy` : matrice CSR éclatée en tableaux bruts, ouverts en mmap
+DATA_FILE = 'tfidf_data.npy'  # Valeurs non nulles (float32 ou int8)
+INDICES_FILE = 'tfidf_indices.npy'  # Colonnes des valeurs (int32)
+INDPTR_FILE = 'tfidf_indptr.npy'  # Début de chaque ligne (int32/int64)
+IDS_NPY_FILE = 'product_ids.npy'  # IDs produits (int64)
+
+# Fichiers propres à chaque format de stockage
+STORAGE_FILES = {
+    'joblib': (MATRIX_FILE, IDS_FILE),
+    'npy': (DATA_FILE, INDICES_FILE, INDPTR_FILE, IDS_NPY_FILE),
+}
+STORAGE_FORMATS = tuple(STORAGE_FILES)
+QUANTIZATIONS = ('int8',)
+INT8_SCALE = 1.0 / 127  # Les poids TF-IDF (lignes normalisées L2) sont dans [0, 1]
+MERGE_MODES = ('max', 'centroid')  # Fusion des scores dans query_similar_many
+ENGINES = ('exact', 'ann')  # Moteurs de recherche des voisins (settings.RECS_TFIDF_ENGINE)
+
+# Table optionnelle des k plus proches voisins (voir build_neighbours)
+NEIGHBOURS_IDX_FILE = 'neighbours_idx.npy'  # Lignes voisines (int32, -1 = vide)
+NEIGHBOURS_SCORES_FILE = 'neighbours_scores.npy'  # Scores cosinus (float32)
+
+# Index approximatif optionnel (voir build_ann)
+ANN_PLANES_FILE = 'ann_planes.npy'  # Hyperplans aléatoires (V x tables*bits)
+ANN_CODES_FILE = 'ann_codes.npy'  # Codes de hachage triés par table (tables x n)
+ANN_ORDER_FILE = 'ann_order.npy'  # Lignes correspondant aux codes triés
+ANN_FILES = (ANN_PLANES_FILE, ANN_CODES_FILE, ANN_ORDER_FILE)
+
+OPTIONAL_FILES = (NEIGHBOURS_IDX_FILE, NEIGHBOURS_SCORES_FILE) + ANN_FILES
+
+# Maintenance incrémentale
+DELTA_FILE = 'tfidf_delta.joblib'  # Produits ajoutés/modifiés et tombstones
+
+
+# =============================================================================
+# INDEX APPROXIMATIF (LSH PAR PROJECTIONS ALÉATOIRES)
+# =============================================================================
+class RandomProjectionLsh:
+    """
+    Index LSH « SimHash » sur les vecteurs TF-IDF
+
+    Chaque table projette un vecteur sur `bits` hyperplans aléatoires et garde le
+    signe de chaque projection : deux vecteurs proches en cosinus partagent le
+    même code avec une forte probabilité. Les codes de chaque table sont triés,
+    ce qui permet de retrouver un compartiment par recherche dichotomique
+    (O(log n)) ; seuls les candidats sont ensuite re-classés avec le cosinus exact.
+
+    Attributs :
+        planes (numpy.ndarray): Hyperplans (V x tables*bits, float32)
+        sorted_codes (numpy.ndarray): Codes triés de chaque table (tables x n, uint32)
+        order (numpy.ndarray): Ligne de la matrice pour chaque code trié (tables x n)
+    """
+
+    def __init__(self, planes, sorted_codes, order):
+        self.planes = planes
+        self.sorted_codes = sorted_codes
+        self.order = order
+        self.tables = sorted_codes.shape[0]
+        self.bits = planes.shape[1] // self.tables
+
+    @staticmethod
+    def hash(vectors, planes, tables, bits):
+        """
+        Codes de hachage de vecteurs (m x V)
+
+        Returns:
+            tuple: (codes uint32 de forme (m, tables), projections (m, tables*bits))
+        """
+        projections = np.asarray(vectors @ planes, dtype=np.float32)
+        signs = (projections > 0).reshape(-1, tables, bits)
+        weights = np.left_shift(np.uint32(1), np.arange(bits, dtype=np.uint32))
+        codes = (signs * weights).sum(axis=2, dtype=np.uint32)
+        return codes, projections
+
+    @classmethod
+    def build(cls, matrix, tables=16, bits=None, chunk_size=4096, seed=0):
+        """
+        Construit l'index LSH d'une matrice TF-IDF
+
+        Args:
+            matrix: Matrice CSR flottante (n x V)
+            tables (int): Nombre de tables de hachage (plus = meilleur rappel)
+            bits (int | None): Bits par code ; par défaut choisi pour viser
+                environ 256 produits par compartiment
+            chunk_size (int): Lignes hachées par bloc
+            seed (int): Graine des hyperplans (builds reproductibles)
+        """
+        n_rows, n_features = matrix.shape
+        if bits is None:
+            bits = int(np.clip(np.round(np.log2(max(n_rows, 1) / 256)), 4, 24))
+        rng = np.random.default_rng(seed)
+        planes = rng.standard_normal((n_features, tables * bits)).astype(np.float32)
+
+        codes = np.empty((tables, n_rows), dtype=np.uint32)
+        for start in range(0, n_rows, chunk_size):
+            stop = min(start + chunk_size, n_rows)
+            block_codes, _ = cls.hash(matrix[start:stop], planes, tables, bits)
+            codes[:, start:stop] = block_codes.T
+
+        order = np.argsort(codes, axis=1, kind='stable').astype(np.int32)
+        sorted_codes = np.take_along_axis(codes, order, axis=1)
+        return cls(planes, sorted_codes, order)
+
+    def candidates(self, query, probes=4):
+        """
+        Lignes candidates pour un vecteur requête (1 x V)
+
+        Args:
+            query: Vecteur requête creux
+            probes (int): Nombre de compartiments voisins visités par table
+                (« multi-probe » : on inverse les bits dont la projection est la
+                plus proche de zéro, donc la moins sûre)
+
+        Returns:
+            numpy.ndarray: Lignes candidates (uniques)
+        """
+        codes, projections = self.hash(query, self.planes, self.tables, self.bits)
+        found = []
+        for table in range(self.tables):
+            code = codes[0, table]
+            probe_codes = [code]
+            if probes:
+                margins = np.abs(projections[0, table * self.bits:(table + 1) * self.bits])
+                for bit in np.argsort(margins)[:probes]:
+                    probe_codes.append(code ^ np.uint32(1 << int(bit)))
+            column = self.sorted_codes[table]
+            for probe in probe_codes:
+                lo = np.searchsorted(column, probe, side='left')
+                hi = np.searchsorted(column, probe, side='right')
+                if hi > lo:
+                    found.append(self.order[table, lo:hi])
+        if not found:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate(found))
+
+
+# =============================================================================
+# INDEX EN MÉMOIRE (CACHE PAR PROCESSUS)
+# =============================================================================
+class TfidfIndex:
+    """
+    Index TF-IDF chargé une seule fois par processus et partagé entre les requêtes
+
+    Les lignes `0..base_size-1` sont celles de l'index principal ; les lignes
+    suivantes sont celles du delta (produits créés/modifiés depuis le dernier
+    build). Les lignes remplacées ou supprimées sont masquées via `alive`.
+
+    Attributs :
+        vectorizer: TfidfVectorizer entraîné
+        matrix: Matrice TF-IDF au format CSR (une ligne par produit)
+        ids (list): IDs produits, dans l'ordre des lignes de la matrice
+        row_of (dict): Correspondance product_id -> numéro de ligne (lookup O(1))
+        neighbours (tuple | None): Table précalculée (lignes int32, scores float32)
+        ann (RandomProjectionLsh | None): Index approximatif (moteur 'ann')
+        scale (float): Facteur de déquantification des valeurs de la matrice
+        meta (dict): Métadonnées du build (format, quantification, date...)
+        delta_ids (list): IDs des produits du delta
+        delta_matrix: Matrice CSR float32 des produits du delta (ou None)
+        tombstones (set): IDs des produits supprimés depuis le dernier build
+        alive (numpy.ndarray): Masque booléen des lignes encore valides
+        root (Path): Répertoire de la version chargée
+        signature (tuple): Empreinte (version, mtime/taille des fichiers optionnels)
+        loaded_at (float): Horodatage du chargement
+    """
+
+    def __init__(self, vectorizer, matrix, ids, signature, neighbours=None, scale=1.0, meta=None,
+                 delta=None, ann=None, root=None):
+        self.vectorizer = vectorizer
+        self.matrix = matrix.tocsr() if matrix is not None else None
+        self.ids = list(ids) if ids is not None else []
+        self.row_of = {pid: row for row, pid in enumerate(self.ids)}
+        self.base_size = len(self.ids)
+        # La table n'est utilisable que si elle correspond à la matrice chargée
+        if neighbours is not None and neighbours[0].shape[0] != len(self.ids):
+            neighbours = None
+        self.neighbours = neighbours
+        if ann is not None and ann.order.shape[1] != len(self.ids):
+            ann = None
+        self.ann = ann
+        self.scale = scale
+        self.meta = meta or {}
+        self._postings = None  # Index inversé (CSC), construit à la première recherche
+        self.root = root
+        self.signature = signature
+        self.loaded_at = time.time()
+        self._apply_delta(delta)
+
+    def _apply_delta(self, delta):
+        """Superpose le segment delta à l'index principal (sans le copier)"""
+        delta = delta or {}
+        self.delta_ids = list(delta.get('ids') or [])
+        self.delta_matrix = delta.get('matrix') if self.delta_ids else None
+        self.delta_row_of = {pid: self.base_size + i for i, pid in enumerate(self.delta_ids)}
+        self.tombstones = set(delta.get('tombstones') or [])
+
+        # Les lignes de base remplacées par le delta ou supprimées sont masquées
+        self.alive = np.ones(self.base_size + len(self.delta_ids), dtype=bool)
+        for pid in self.tombstones.union(self.delta_row_of):
+            row = self.row_of.get(pid)
+            if row is not None:
+                self.alive[row] = False
+        self.size = int(self.alive.sum())
+
+    def with_delta(self, delta, signature):
+        """Nouvel index partageant la base de celui-ci, avec un autre delta"""
+        clone = copy.copy(self)
+        clone._apply_delta(delta)
+        clone.signature = signature
+        clone.loaded_at = time.time()
+        return clone
+
+    @property
+    def is_empty(self):
+        """Vrai si l'index ne contient aucun produit exploitable"""
+        return not self.size or self.vectorizer is None or self.matrix is None
+
+    @property
+    def has_delta(self):
+        """Vrai si des produits ont été ajoutés/modifiés/supprimés depuis le build"""
+        return bool(self.delta_ids or self.tombstones)
+
+    @property
+    def drift(self):
+        """Part de l'index modifiée depuis le dernier build (delta + tombstones)"""
+        return (len(self.delta_ids) + len(self.tombstones)) / max(self.base_size, 1)
+
+    @property
+    def neighbours_k(self):
+        """Nombre de voisins précalculés par produit (0 si pas de table)"""
+        return self.neighbours[0].shape[1] if self.neighbours is not None else 0
+
+    def row_for(self, product_id):
+        """Ligne courante d'un produit (None s'il n'est pas indexé ou supprimé)"""
+        row = self.delta_row_of.get(product_id)
+        if row is not None:
+            return row
+        if product_id in self.tombstones:
+            return None
+        return self.row_of.get(product_id)
+
+    def id_at(self, row):
+        """ID produit correspondant à une ligne (base ou delta)"""
+        if row < self.base_size:
+            return self.ids[row]
+        return self.delta_ids[row - self.base_size]
+
+    def row_vector(self, row):
+        """Vecteur TF-IDF (1 x V, flottant) d'une ligne de la base ou du delta"""
+        if row >= self.base_size:
+            offset = row - self.base_size
+            return self.delta_matrix[offset:offset + 1]
+        query = self.matrix[row:row + 1]
+        if self.scale != 1.0:
+            query = query.astype(np.float32) * np.float32(self.scale)
+        return query
+
+    def rows_matrix(self, rows):
+        """Vecteurs TF-IDF (m x V, flottants) de plusieurs lignes, base ou delta"""
+        return vstack([self.row_vector(row) for row in rows]).tocsr()
+
+    def scores(self, query):
+        """
+        Produit scalaire d'un vecteur requête (1 x V) avec toutes les lignes
+
+        Fonctionne quel que soit le stockage (float64, float32 ou int8 quantifié) :
+        la requête est en flottants, ce qui évite tout débordement entier.
+
+        Returns:
+            numpy.ndarray: Vecteur dense de scores ; les lignes masquées valent -1
+        """
+        return self.max_scores(query)
+
+    def max_scores(self, queries):
+        """
+        Pour chaque ligne de l'index, meilleur score parmi plusieurs requêtes
+
+        Un seul produit creux (index x requêtes^T) est calculé puis réduit par
+        un max ligne à ligne : le résultat intermédiaire reste creux.
+
+        Args:
+            queries: Matrice creuse (m x V) de vecteurs requêtes en flottants
+
+        Returns:
+            numpy.ndarray: Vecteur dense de scores ; les lignes masquées valent -1
+        """
+        if self.scale != 1.0:
+            queries = queries.astype(np.float32)
+        scores = _row_max(self.matrix @ queries.T)
+        if self.scale != 1.0:
+            scores *= self.scale
+        if self.delta_matrix is not None:
+            scores = np.concatenate([scores, _row_max(self.delta_matrix @ queries.T)])
+        if self.has_delta:
+            scores[~self.alive] = -1
+        return scores
+
+    def similarities(self, row):
+        """
+        Similarités cosinus entre la ligne `row` et toutes les lignes de l'index
+
+        Returns:
+            numpy.ndarray: Vecteur dense de scores (base puis delta)
+        """
+        return self.scores(self.row_vector(row))
+
+    def table_neighbours(self, row, k):
+        """
+        Voisins lus dans la table précalculée, complétés par le delta
+
+        Returns:
+            list | None: Liste de (ligne, score) triée, ou None si la table ne
+                permet pas de garantir les k meilleurs résultats
+        """
+        if k > self.neighbours_k or row >= self.base_size:
+            return None
+        rows = np.asarray(self.neighbours[0][row])
+        scores = np.asarray(self.neighbours[1][row], dtype=np.float64)
+        full = bool((rows >= 0).all())
+        valid = rows >= 0
+        rows, scores = rows[valid], scores[valid]
+
+        if self.has_delta:
+            keep = self.alive[rows]
+            # Des voisins précalculés ont été remplacés/supprimés : d'autres lignes
+            # de la base, absentes de la table, pourraient maintenant faire partie
+            # des k meilleurs ; on laisse le calcul exact répondre
+            if full and np.count_nonzero(keep) < k:
+                return None
+            rows, scores = rows[keep], scores[keep]
+            if self.delta_matrix is not None:
+                extra = (self.delta_matrix @ self.row_vector(row).T).toarray().ravel()
+                positive = np.flatnonzero(extra > 0)
+                rows = np.concatenate([rows, positive + self.base_size])
+                scores = np.concatenate([scores, extra[positive]])
+
+        order = np.argsort(-scores, kind='stable')[:k]
+        return [(int(rows[i]), float(scores[i])) for i in order]
+
+    def ann_neighbours(self, row, k, probes=4):
+        """
+        Voisins approximatifs via l'index LSH, complétés par le delta
+
+        Seuls les candidats retournés par le LSH sont re-classés avec le cosinus
+        exact : le coût ne dépend plus de la taille du catalogue.
+
+        Returns:
+            list | None: Liste de (ligne, score) triée, ou None sans index LSH
+        """
+        if self.ann is None:
+            return None
+        query = self.row_vector(row)
+        rows = self.ann.candidates(query, probes=probes)
+        rows = rows[rows != row]
+        if self.has_delta and len(rows):
+            rows = rows[self.alive[rows]]
+
+        candidate_matrix = self.matrix[rows]
+        if self.scale != 1.0:
+            candidate_matrix = candidate_matrix.astype(np.float32)
+            query = query.astype(np.float32)
+        scores = (candidate_matrix @ query.T).toarray().ravel().astype(np.float64) * self.scale
+
+        if self.delta_matrix is not None:
+            extra = (self.delta_matrix @ query.T).toarray().ravel()
+            delta_rows = np.arange(self.base_size, self.base_size + len(self.delta_ids))
+            keep = delta_rows != row
+            rows = np.concatenate([rows, delta_rows[keep]])
+            scores = np.concatenate([scores, extra[keep]])
+
+        positive = scores > 0
+        rows, scores = rows[positive], scores[positive]
+        if len(rows) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return [(int(rows[i]), float(scores[i])) for i in order]
+
+    @property
+    def postings(self):
+        """
+        Index inversé de la matrice de base : copie CSC (une colonne par terme)
+
+        Construit à la première recherche puis partagé par les clones `with_delta`.
+        """
+        if self._postings is None:
+            self._postings = self.matrix.tocsc()
+        return self._postings
+
+    def search(self, text, offset=0, limit=20):
+        """
+        Recherche plein texte classée par pertinence (cosinus requête / produit)
+
+        La requête est vectorisée avec le vocabulaire et les poids IDF de l'index ;
+        elle ne contient que quelques termes, donc seules les listes de postings
+        de ces termes sont parcourues (pas de balayage du catalogue).
+
+        Args:
+            text (str): Texte recherché
+            offset (int): Rang du premier résultat renvoyé
+            limit (int): Nombre maximum de résultats renvoyés
+
+        Returns:
+            tuple: (nombre total de produits correspondants,
+                liste de (ligne, score) triée par score décroissant)
+        """
+        if self.vectorizer is None or self.matrix is None:
+            return 0, []
+        query = self.vectorizer.transform([text]).tocsr()
+        if query.nnz == 0:
+            return 0, []  # Uniquement des mots vides ou des termes inconnus
+
+        hits = self.postings[:, query.indices].tocoo()
+        weights = hits.data.astype(np.float64) * query.data[hits.col] * self.scale
+        rows, inverse = np.unique(hits.row, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        if self.has_delta:
+            keep = self.alive[rows]
+            rows, scores = rows[keep], scores[keep]
+        if self.delta_matrix is not None:
+            extra = (self.delta_matrix @ query.T).toarray().ravel()
+            matched = np.flatnonzero(extra > 0)
+            rows = np.concatenate([rows, self.base_size + matched])
+            scores = np.concatenate([scores, extra[matched]])
+        positive = scores > 0
+        rows, scores = rows[positive], scores[positive]
+
+        total = len(rows)
+        stop = min(offset + limit, total)
+        if offset >= stop:
+            return total, []
+        # Sélection partielle des `stop` meilleurs, puis tri stable (score, ligne)
+        top = np.argpartition(-scores, stop - 1)[:stop]
+        top = top[np.lexsort((rows[top], -scores[top]))][offset:stop]
+        return total, [(int(rows[i]), float(scores[i])) for i in top]
+
+    def dequantized_matrix(self):
+        """Matrice de base en flottants (copie en mémoire si l'index est quantifié)"""
+        if self.scale == 1.0:
+            return self.matrix
+        return self.matrix.astype(np.float32) * np.float32(self.scale)
+
+    def __len__(self):
+        return self.size
+
+
+def _row_max(products):
+    """Max par ligne d'un produit matriciel creux (n x m), sous forme dense (n,)"""
+    if products.shape[1] == 1:
+        return products.toarray().ravel()
+    return products.tocsr().max(axis=1).toarray().ravel()
+
+
+_index = None  # Index courant du processus
+_index_lock = threading.Lock()  # Évite les chargements concurrents entre threads
+
+
+def _current_dir():
+    """
+    Répertoire de la version publiée par le pointeur `CURRENT`
+
+    Returns:
+        Path | None: Le répertoire, ou None si aucun index n'a encore été publié
+    """
+    try:
+        name = CURRENT_PATH.read_text(encoding='utf-8').strip()
+    except FileNotFoundError:
+        return None
+    root = STORE_DIR / name
+    return root if name and root.is_dir() else None
+
+
+def _read_meta(root):
+    """Lit les métadonnées d'une version (`index_meta.json`)"""
+    with open(root / META_FILE, encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def _stat_signature(path):
+    """(mtime, taille) d'un fichier, ou (0, 0) s'il n'existe pas"""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return (0, 0)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _artifacts_signature(root):
+    """
+    Empreinte des artefacts principaux d'une version (hors delta)
+
+    Les fichiers d'un build ne sont jamais réécrits : le nom de la version suffit,
+    complété par l'état des fichiers optionnels ajoutés après coup (table des
+    voisins, index LSH), qui valent (0, 0) s'ils sont absents.
+    """
+    return (root.name,) + tuple(_stat_signature(root / name) for name in OPTIONAL_FILES)
+
+
+def _load_delta(root, meta):
+    """
+    Charge le segment delta s'il correspond à la version de l'index principal
+
+    Returns:
+        dict | None: {'base_version', 'ids', 'matrix', 'tombstones'} ou None
+    """
+    try:
+        delta = joblib.load(root / DELTA_FILE)
+    except FileNotFoundError:
+        return None
+    # Un delta écrit pour un ancien build est obsolète (le build l'a intégré)
+    if delta.get('base_version') != meta.get('version'):
+        return None
+    return delta
+
+
+def _load_index(root, signature):
+    """Charge les artefacts d'une version (joblib ou npy) et construit un `TfidfIndex`"""
+    meta = _read_meta(root)
+    vectorizer = joblib.load(root / VECTORIZER_FILE)
+    scale = 1.0
+
+    if meta.get('format') == 'npy':
+        # Tableaux projetés en mémoire : les pages sont partagées entre workers
+        # via le cache disque au lieu d'être copiées dans le tas de chaque processus
+        data = np.load(root / DATA_FILE, mmap_mode='r')
+        indices = np.load(root / INDICES_FILE, mmap_mode='r')
+        indptr = np.load(root / INDPTR_FILE, mmap_mode='r')
+        ids = np.load(root / IDS_NPY_FILE).tolist()
+        matrix = csr_matrix((data, indices, indptr), shape=tuple(meta['shape']), copy=False)
+        if meta.get('quantization') == 'int8':
+            scale = meta.get('scale', INT8_SCALE)
+    else:
+        ids = joblib.load(root / IDS_FILE)
+        matrix = joblib.load(root / MATRIX_FILE)
+
+    neighbours = None
+    if (root / NEIGHBOURS_IDX_FILE).exists() and (root / NEIGHBOURS_SCORES_FILE).exists():
+        neighbours = (
+            np.load(root / NEIGHBOURS_IDX_FILE, mmap_mode='r'),
+            np.load(root / NEIGHBOURS_SCORES_FILE, mmap_mode='r'),
+        )
+    ann = None
+    if all((root / name).exists() for name in ANN_FILES):
+        ann = RandomProjectionLsh(
+            np.load(root / ANN_PLANES_FILE),
+            np.load(root / ANN_CODES_FILE, mmap_mode='r'),
+            np.load(root / ANN_ORDER_FILE, mmap_mode='r'),
+        )
+    return TfidfIndex(
+        vectorizer, matrix, ids, signature,
+        neighbours=neighbours, scale=scale, meta=meta, delta=_load_delta(root, meta), ann=ann, root=root,
+    )
+
+
+def get_index():
+    """
+    Renvoie l'index TF-IDF du processus courant
+
+    L'index est chargé au premier appel puis réutilisé ; il n'est rechargé que si
+    le pointeur `CURRENT` désigne une autre version ou si les fichiers optionnels
+    ont changé. Si seul le delta a changé, la base déjà chargée est réutilisée
+    telle quelle. Cette fonction ne construit jamais l'index (voir `request_build`).
+
+    Returns:
+        TfidfIndex | None: L'index chargé, ou None si aucune version n'est publiée
+    """
+    global _index
+    root = _current_dir()
+    if root is None:
+        return None
+    base_signature = _artifacts_signature(root)
+    signature = (base_signature, _stat_signature(root / DELTA_FILE))
+
+    current = _index
+    if current is not None and current.signature == signature:
+        return current  # Chemin rapide : aucun verrou, aucune lecture disque
+
+    with _index_lock:
+        # Un autre thread a pu recharger l'index pendant l'attente du verrou
+        if _index is not None and _index.signature == signature:
+            return _index
+        if _index is not None and _index.signature[0] == base_signature:
+            _index = _index.with_delta(_load_delta(root, _index.meta), signature)
+        else:
+            _index = _load_index(root, signature)
+        return _index
+
+
+def index_state():
+    """
+    Version de l'index servi, sans le charger (quelques `stat`)
+
+    Returns:
+        tuple: (empreinte des artefacts et du delta, date de publication ou de
+        dernière mise à jour en ns) ; (None, 0) si aucun index n'est publié
+    """
+    root = _current_dir()
+    if root is None:
+        return None, 0
+    base_signature = _artifacts_signature(root)
+    delta = _stat_signature(root / DELTA_FILE)
+    updated = max(
+        [_stat_signature(CURRENT_PATH)[0], delta[0]] + [mtime for mtime, _ in base_signature[1:]]
+    )
+    return (base_signature, delta), updated
+
+
+def invalidate_index():
+    """Oublie l'index en mémoire (il sera rechargé au prochain `get_index()`)"""
+    global _index
+    with _index_lock:
+        _index = None
+
+
+# =============================================================================
+# CONSTRUCTION EN ARRIÈRE-PLAN (CHEMIN DES REQUÊTES)
+# =============================================================================
+_build_thread = None  # Thread de construction lancé par ce processus
+_build_state_lock = threading.Lock()
+
+
+def _background_build(force=False):
+    """Construit l'index si aucun autre thread ou processus ne le fait déjà"""
+    with index_write_lock(blocking=False) as acquired:
+        if not acquired:
+            return  # Un autre builder détient le verrou : il publiera la version
+        try:
+            build_index(force=force)
+        except Exception:
+            logger.exception("Échec de la construction de l'index TF-IDF en arrière-plan")
+
+
+def request_build(force=False):
+    """
+    Demande la construction de l'index sans bloquer l'appelant
+
+    Un seul thread de construction par processus, et un seul builder à la fois
+    entre processus grâce au verrou `build.lock` (pris sans attente). Désactivé
+    par `settings.RECS_TFIDF_AUTO_BUILD = False` (index construit par cron).
+
+    Args:
+        force (bool): Reconstruit même si une version est publiée (index
+            construit sur un catalogue vide)
+
+    Returns:
+        bool: True si un thread de construction a été lancé par cet appel
+    """
+    global _build_thread
+    if not getattr(settings, 'RECS_TFIDF_AUTO_BUILD', True):
+        return False
+    with _build_state_lock:
+        if _build_thread is not None and _build_thread.is_alive():
+            return False
+        _build_thread = threading.Thread(
+            target=_background_build, kwargs={'force': force}, name='recs-tfidf-build', daemon=True,
+        )
+        _build_thread.start()
+    return True
+
+
+def index_ready():
+    """
+    Indique si un index est publié ; sinon demande sa construction en arrière-plan
+
+    Les vues s'en servent pour basculer sur les recommandations heuristiques
+    tant que l'index n'existe pas, au lieu d'attendre un build.
+    """
+    if get_index() is not None:
+        return True
+    request_build()
+    return False
+
+
+# =============================================================================
+# ÉCRITURE DES ARTEFACTS
+# =============================================================================
+_write_lock = threading.RLock()  # Sérialise les écritures entre threads
+_write_depth = 0  # Profondeur de réentrance (le verrou fichier n'est pris qu'une fois)
+
+
+@contextmanager
+def index_write_lock(blocking=True):
+    """
+    Verrou exclusif pour toute écriture de l'index (build, delta, compaction)
+
+    Combine un verrou réentrant entre threads et, sous Unix, un verrou `flock`
+    sur `build.lock` pour exclure les autres processus (workers, cron).
+
+    Args:
+        blocking (bool): Si False, n'attend pas : le contexte renvoie False
+            quand un autre thread ou processus détient déjà le verrou
+
+    Yields:
+        bool: True si le verrou est détenu
+    """
+    global _write_depth
+    if not _write_lock.acquire(blocking=blocking):
+        yield False
+        return
+    handle = None
+    try:
+        if _write_depth == 0 and fcntl is not None:
+            handle = open(LOCK_PATH, 'a')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                handle.close()
+                handle = None
+                yield False
+                return
+        _write_depth += 1
+        try:
+            yield True
+        finally:
+            _write_depth -= 1
+            if handle is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+                handle.close()
+    finally:
+        _write_lock.release()
+
+
+def _remove_files(paths):
+    """Supprime une liste de fichiers en ignorant ceux qui n'existent pas"""
+    for path in paths:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _atomic_write(path, dump):
+    """
+    Écrit un fichier via un fichier temporaire puis `os.replace`
+
+    Les lecteurs voient soit l'ancien fichier complet, soit le nouveau ; un
+    processus qui a projeté l'ancien fichier en mémoire (mmap) garde son inode.
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as fh:
+        dump(fh)
+    os.replace(tmp_path, path)
+
+
+def _write_json(path, payload):
+    """Écrit un fichier JSON (utilisé pour les métadonnées de l'index)"""
+    _atomic_write(path, lambda fh: fh.write(json.dumps(payload).encode('utf-8')))
+
+
+def _save_array(path, array):
+    """Écrit un tableau numpy au format `.npy`"""
+    _atomic_write(path, lambda fh: np.save(fh, array))
+
+
+def _save_joblib(path, obj):
+    """Sérialise un objet Python avec joblib"""
+    _atomic_write(path, lambda fh: joblib.dump(obj, fh))
+
+
+def _save_npy(root, matrix, ids, quantize=None):
+    """
+    Écrit la matrice CSR et les ids sous forme de tableaux `.npy` bruts
+
+    Args:
+        root (Path): Répertoire de la version en cours d'écriture
+        matrix: Matrice TF-IDF CSR
+        ids (list): IDs produits dans l'ordre des lignes
+        quantize (str | None): 'int8' pour quantifier les poids sur 8 bits
+
+    Returns:
+        dict: Métadonnées à enregistrer dans `index_meta.json`
+    """
+    matrix = matrix.tocsr()
+    # int32 suffit tant que le nombre de valeurs non nulles tient sur 31 bits
+    index_dtype = np.int32 if matrix.nnz < np.iinfo(np.int32).max else np.int64
+    meta = {'format': 'npy', 'shape': list(matrix.shape), 'nnz': int(matrix.nnz), 'quantization': None}
+
+    if quantize == 'int8':
+        data = np.rint(matrix.data / INT8_SCALE).clip(0, 127).astype(np.int8)
+        meta.update(quantization='int8', scale=INT8_SCALE)
+    else:
+        data = matrix.data.astype(np.float32)
+
+    _save_array(root / DATA_FILE, data)
+    _save_array(root / INDICES_FILE, matrix.indices.astype(index_dtype))
+    _save_array(root / INDPTR_FILE, matrix.indptr.astype(index_dtype))
+    _save_array(root / IDS_NPY_FILE, np.asarray(ids, dtype=np.int64))
+    return meta
+
+
+def _version_dirs():
+    """Répertoires de versions publiées, du plus ancien au plus récent"""
+    return sorted(
+        (path for path in STORE_DIR.iterdir() if path.is_dir() and path.name.startswith('v')),
+        key=lambda path: path.name,
+    )
+
+
+def _prune_versions(current):
+    """
+    Supprime les anciennes versions et les builds interrompus
+
+    Appelée sous `index_write_lock()` : tout répertoire `.building-*` restant
+    provient d'un build qui a échoué. Les `VERSIONS_KEPT` dernières versions
+    sont conservées pour les processus qui ne les ont pas encore quittées.
+    """
+    for path in STORE_DIR.glob('.building-*'):
+        shutil.rmtree(path, ignore_errors=True)
+    versions = [path for path in _version_dirs() if path.name != current]
+    for path in versions[:max(len(versions) - (VERSIONS_KEPT - 1), 0)]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _publish(root):
+    """Fait pointer `CURRENT` vers une version complète (remplacement atomique)"""
+    _atomic_write(CURRENT_PATH, lambda fh: fh.write(root.name.encode('utf-8')))
+
+
+def _persist(vectorizer, matrix, ids, storage, quantize=None, fitted_at=None):
+    """
+    Écrit un index complet dans un nouveau répertoire de version puis le publie
+
+    Args:
+        vectorizer: TfidfVectorizer entraîné (None si le catalogue est vide)
+        matrix: Matrice TF-IDF CSR (None si le catalogue est vide)
+        ids (list): IDs produits dans l'ordre des lignes
+        storage (str): 'joblib' ou 'npy'
+        quantize (str | None): 'int8' pour quantifier la matrice (format npy)
+        fitted_at (float | None): Date d'apprentissage des poids IDF (conservée
+            lors d'une compaction, qui ne ré-apprend pas le vocabulaire)
+
+    Returns:
+        Path: Répertoire de la version publiée
+    """
+    now = time.time()
+    # Écriture dans un répertoire temporaire : une version n'est visible qu'une fois complète
+    building = Path(tempfile.mkdtemp(prefix='.building-', dir=STORE_DIR))
+    _save_joblib(building / VECTORIZER_FILE, vectorizer)  # Sauvegarde le vectoriseur
+    if storage == 'npy':
+        meta = _save_npy(building, matrix, ids, quantize=quantize)
+    else:
+        _save_joblib(building / MATRIX_FILE, matrix)  # Sauvegarde la matrice TF-IDF
+        _save_joblib(building / IDS_FILE, ids)        # Sauvegarde la liste des IDs
+        meta = {'format': 'joblib'}
+        if matrix is not None:
+            meta.update(shape=list(matrix.shape), nnz=int(matrix.nnz))
+
+    meta.update(products=len(ids), version=now, built_at=now, fitted_at=fitted_at or now)
+    _write_json(building / META_FILE, meta)
+
+    # Le delta, la table des voisins et l'index LSH décrivaient l'ancienne matrice :
+    # la nouvelle version part sans eux
+    root = STORE_DIR / f'v{time.time_ns()}'
+    os.replace(building, root)
+    _publish(root)
+    _prune_versions(root.name)
+    invalidate_index()  # Le processus qui construit recharge immédiatement
+    return root
+
+
+def product_text(name, description):
+    """Texte indexé pour un produit : nom + description"""
+    return f"{name or ''} " + (description or '')
+
+
+def _stream_shards(shard_size, chunk_size):
+    """
+    Lit les produits en flux et les regroupe en lots de `shard_size` textes
+
+    Seuls `id`, `name` et `description` sont chargés (pas d'instances de modèle),
+    et le curseur de base de données est parcouru par paquets de `chunk_size`.
+
+    Yields:
+        tuple: (ids du lot, textes du lot)
+    """
+    rows = Product.objects.order_by('pk').values_list('id', 'name', 'description')
+    ids, docs = [], []
+    for product_id, name, description in rows.iterator(chunk_size=chunk_size):
+        ids.append(product_id)
+        docs.append(product_text(name, description))
+        if len(docs) >= shard_size:
+            yield ids, docs
+            ids, docs = [], []
+    if docs:
+        yield ids, docs
+
+
+def _count_shards(shards, workers):
+    """
+    Tokenise les lots, en parallèle si `workers` > 1
+
+    Au plus deux lots par processus sont en attente : le texte brut des lots
+    déjà comptés est libéré au fur et à mesure de la lecture.
+
+    Yields:
+        tuple: (ids du lot, résultat de `count_shard`), dans l'ordre des lots
+    """
+    if workers <= 1:
+        for ids, docs in shards:
+            yield ids, count_shard(docs)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for ids, docs in shards:
+            pending.append((ids, executor.submit(count_shard, docs)))
+            if len(pending) >= 2 * workers:
+                ids, future = pending.popleft()
+                yield ids, future.result()
+        while pending:
+            ids, future = pending.popleft()
+            yield ids, future.result()
+
+
+def build_index(force=False, storage=None, quantize=None, workers=None, shard_size=None,
+                chunk_size=2000, progress=None):
+    """
+    Construit l'index TF-IDF à partir des noms et descriptions des produits
+
+    Args:
+        force (bool): Si True, force la reconstruction même si l'index existe
+        storage (str | None): 'joblib' ou 'npy' (défaut : `settings.RECS_TFIDF_STORAGE`)
+        quantize (str | None): 'int8' pour quantifier la matrice (format npy
+            uniquement ; défaut : `settings.RECS_TFIDF_QUANTIZE`)
+        workers (int | None): Processus de tokenisation (défaut :
+            `settings.RECS_TFIDF_BUILD_WORKERS`, 1 = sans pool)
+        shard_size (int | None): Produits par lot (défaut : `settings.RECS_TFIDF_SHARD_SIZE`)
+        chunk_size (int): Lignes lues par aller-retour avec la base de données
+        progress (callable | None): Appelée avec le nombre de produits traités
+            après chaque lot
+
+    Returns:
+        dict: Statistiques (`products`, `shards`, `workers`, `seconds`), ou None si
+            l'index existait déjà
+
+    Remarque : une reconstruction publie une nouvelle version sans table des
+    voisins ; il faut relancer `build_neighbours()` pour la régénérer.
+    """
+    storage = storage or getattr(settings, 'RECS_TFIDF_STORAGE', 'joblib')
+    if quantize is None:
+        quantize = getattr(settings, 'RECS_TFIDF_QUANTIZE', None) or None
+    if storage not in STORAGE_FORMATS:
+        raise ValueError(f"Format de stockage inconnu : {storage}")
+    if quantize is not None and (storage != 'npy' or quantize not in QUANTIZATIONS):
+        raise ValueError(f"Quantification '{quantize}' non supportée pour le format {storage}")
+    workers = workers or getattr(settings, 'RECS_TFIDF_BUILD_WORKERS', 1)
+    shard_size = shard_size or getattr(settings, 'RECS_TFIDF_SHARD_SIZE', 5000)
+
+    started = time.perf_counter()
+    with index_write_lock():
+        # Vérifie sous le verrou si l'index existe déjà (un autre processus a pu
+        # le publier pendant l'attente) et si on ne force pas la reconstruction
+        if _current_dir() is not None and not force:
+            return None  # Index déjà existant, on sort
+
+        # Lecture en flux et tokenisation des lots : seuls les comptages sont conservés
+        ids = []   # IDs produits, dans l'ordre des lignes de la matrice
+        shards = []
+        for shard_ids, counted in _count_shards(_stream_shards(shard_size, chunk_size), workers):
+            ids.extend(shard_ids)
+            shards.append(counted)
+            if progress is not None:
+                progress(len(ids))
+
+        # Cas où il n'y a pas de produits à indexer
+        if not ids:
+            # Sauvegarde des structures vides
+            _persist(None, None, [], storage='joblib')
+        else:
+            # Vocabulaire, poids IDF et matrice TF-IDF normalisée
+            vectorizer, matrix = assemble_tfidf(shards)
+            del shards
+
+            # Sauvegarde des artefacts sur le disque
+            _persist(vectorizer, matrix, ids, storage=storage, quantize=quantize)
+
+    return {
+        'products': len(ids),
+        'shards': -(-len(ids) // shard_size),
+        'workers': workers,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def compute_neighbours(matrix, topk, chunk_size=1024):
+    """
+    Calcule les `topk` plus proches voisins (cosinus) de chaque ligne de la matrice
+
+    Le calcul se fait par blocs de `chunk_size` lignes : chaque bloc est un produit
+    de matrices creuses (bloc x matrice^T), ce qui borne la mémoire utilisée à la
+    taille d'un bloc de similarités au lieu de la matrice n x n complète.
+
+    Args:
+        matrix: Matrice TF-IDF CSR (lignes normalisées L2)
+        topk (int): Nombre de voisins à conserver par produit
+        chunk_size (int): Nombre de lignes traitées par bloc
+
+    Returns:
+        tuple: (lignes voisines int32 de forme (n, topk), -1 pour les cases vides ;
+            scores float32 de forme (n, topk), triés par score décroissant)
+    """
+    matrix = matrix.tocsr()
+    n_rows = matrix.shape[0]
+    neighbour_rows = np.full((n_rows, topk), -1, dtype=np.int32)
+    neighbour_scores = np.zeros((n_rows, topk), dtype=np.float32)
+    matrix_t = matrix.T.tocsc()
+
+    for start in range(0, n_rows, chunk_size):
+        stop = min(start + chunk_size, n_rows)
+        block = (matrix[start:stop] @ matrix_t).tocsr()  # Similarités creuses du bloc
+
+        for offset in range(stop - start):
+            row = start + offset
+            lo, hi = block.indptr[offset], block.indptr[offset + 1]
+            cols = block.indices[lo:hi]
+            scores = block.data[lo:hi]
+
+            # Exclut le produit lui-même et les similarités nulles
+            keep = (cols != row) & (scores > 0)
+            cols, scores = cols[keep], scores[keep]
+            if not len(cols):
+                continue
+
+            # Sélection partielle O(n) puis tri des seuls k gagnants
+            if len(cols) > topk:
+                best = np.argpartition(-scores, topk - 1)[:topk]
+                cols, scores = cols[best], scores[best]
+            order = np.argsort(-scores, kind='stable')
+            count = len(order)
+            neighbour_rows[row, :count] = cols[order]
+            neighbour_scores[row, :count] = scores[order]
+
+    return neighbour_rows, neighbour_scores
+
+
+def build_neighbours(topk, chunk_size=1024):
+    """
+    Précalcule et persiste la table des k plus proches voisins de l'index courant
+
+    Args:
+        topk (int): Nombre de voisins à conserver par produit
+        chunk_size (int): Nombre de lignes traitées par bloc de calcul
+
+    Returns:
+        dict: Statistiques (`products`, `topk`, `nbytes`) ou None si l'index est vide
+    """
+    with index_write_lock():
+        index = get_index()
+        if index is None or index.is_empty:
+            return None
+
+        neighbour_rows, neighbour_scores = compute_neighbours(index.dequantized_matrix(), topk, chunk_size)
+        _save_array(index.root / NEIGHBOURS_IDX_FILE, neighbour_rows)
+        _save_array(index.root / NEIGHBOURS_SCORES_FILE, neighbour_scores)
+        invalidate_index()
+
+    return {
+        'products': index.base_size,
+        'topk': topk,
+        'nbytes': neighbour_rows.nbytes + neighbour_scores.nbytes,
+    }
+
+
+def build_ann(tables=16, bits=None, chunk_size=4096):
+    """
+    Construit et persiste l'index approximatif (LSH) de l'index courant
+
+    Args:
+        tables (int): Nombre de tables de hachage
+        bits (int | None): Bits par code (None = choix automatique)
+        chunk_size (int): Lignes hachées par bloc
+
+    Returns:
+        dict: Statistiques (`products`, `tables`, `bits`, `nbytes`) ou None si l'index est vide
+    """
+    with index_write_lock():
+        index = get_index()
+        if index is None or index.is_empty:
+            return None
+
+        ann = RandomProjectionLsh.build(index.dequantized_matrix(), tables=tables, bits=bits, chunk_size=chunk_size)
+        _save_array(index.root / ANN_PLANES_FILE, ann.planes)
+        _save_array(index.root / ANN_CODES_FILE, ann.sorted_codes)
+        _save_array(index.root / ANN_ORDER_FILE, ann.order)
+        invalidate_index()
+
+    return {
+        'products': index.base_size,
+        'tables': ann.tables,
+        'bits': ann.bits,
+        'nbytes': ann.planes.nbytes + ann.sorted_codes.nbytes + ann.order.nbytes,
+    }
+
+
+def evaluate_ann_recall(k=6, sample=200, seed=0):
+    """
+    Mesure le rappel@k du moteur ANN par rapport au moteur exact
+
+    Args:
+        k (int): Nombre de voisins comparés
+        sample (int): Nombre de produits tirés au hasard
+        seed (int): Graine du tirage
+
+    Returns:
+        dict: `recall` moyen, latences moyennes (`exact_ms`, `ann_ms`) et
+            `sampled` ; None si l'index ou l'index LSH n'existe pas
+    """
+    index = get_index()
+    if index is None or index.is_empty or index.ann is None:
+        return None
+
+    rng = np.random.default_rng(seed)
+    alive_rows = np.flatnonzero(index.alive[:index.base_size])
+    rows = rng.choice(alive_rows, size=min(sample, len(alive_rows)), replace=False)
+    recalls, exact_time, ann_time = [], 0.0, 0.0
+    for row in rows:
+        started = time.perf_counter()
+        scores = index.similarities(row)
+        scores[row] = -1
+        top = np.sort(scores)[::-1][:k]
+        expected = top[top > 0]
+        exact_time += time.perf_counter() - started
+
+        started = time.perf_counter()
+        found = index.ann_neighbours(row, k)
+        ann_time += time.perf_counter() - started
+
+        # Rappel tolérant aux ex aequo : un voisin compte s'il atteint le k-ième score exact
+        if len(expected):
+            hits = sum(1 for _, score in found if score >= expected[-1] - 1e-6)
+            recalls.append(min(hits, len(expected)) / len(expected))
+
+    sampled = len(rows)
+    return {
+        'recall': float(np.mean(recalls)) if recalls else 1.0,
+        'exact_ms': 1000 * exact_time / max(sampled, 1),
+        'ann_ms': 1000 * ann_time / max(sampled, 1),
+        'sampled': sampled,
+    }
+
+
+def _rebuild_derived(index):
+    """Recalcule la table des voisins et l'index LSH s'ils existaient pour `index`"""
+    if index.neighbours_k:
+        build_neighbours(index.neighbours_k)
+    if index.ann is not None:
+        build_ann(tables=index.ann.tables, bits=index.ann.bits)
+
+
+# =============================================================================
+# MAINTENANCE INCRÉMENTALE
+# =============================================================================
+def _write_delta(index, delta):
+    """Persiste le delta (ou le supprime s'il est vide) pour la version courante"""
+    if not delta['ids'] and not delta['tombstones']:
+        _remove_files((index.root / DELTA_FILE,))
+        return
+    delta['base_version'] = index.meta.get('version')
+    _save_joblib(index.root / DELTA_FILE, delta)
+
+
+def _current_delta(index):
+    """Copie modifiable du delta de l'index courant"""
+    return {
+        'ids': list(index.delta_ids),
+        'matrix': index.delta_matrix,
+        'tombstones': set(index.tombstones),
+    }
+
+
+def _drop_from_delta(delta, product_id):
+    """Retire un produit du delta s'il y figure"""
+    if product_id not in delta['ids']:
+        return
+    keep = [i for i, pid in enumerate(delta['ids']) if pid != product_id]
+    delta['ids'] = [delta['ids'][i] for i in keep]
+    delta['matrix'] = delta['matrix'][keep] if keep else None
+
+
+_pending = {}  # product_id -> texte (None = suppression), en attente du verrou d'écriture
+_pending_lock = threading.Lock()
+_flush_thread = None  # Thread qui écrit la file dès que le verrou se libère
+
+
+def _apply_pending(index, pending):
+    """Écrit un lot de modifications dans le delta de l'index (une seule écriture)"""
+    delta = _current_delta(index)
+    for product_id, text in pending.items():
+        _drop_from_delta(delta, product_id)
+        if text is None:
+            if product_id in index.row_of:
+                delta['tombstones'].add(product_id)
+            continue
+        vector = index.vectorizer.transform([text]).astype(np.float32).tocsr()
+        delta['ids'].append(product_id)
+        delta['matrix'] = vector if delta['matrix'] is None else vstack([delta['matrix'], vector]).tocsr()
+        delta['tombstones'].discard(product_id)
+    _write_delta(index, delta)
+
+
+def _flush_pending(blocking):
+    """
+    Écrit les modifications en file dans le delta
+
+    Sans index utilisable (aucune version publiée, ou version construite sur
+    un catalogue vide, sans vocabulaire), la file est abandonnée et une
+    construction est demandée : elle lira les produits dans la base.
+
+    Returns:
+        bool: False si le verrou d'écriture n'a pas pu être pris (file conservée)
+    """
+    with index_write_lock(blocking=blocking) as acquired:
+        if not acquired:
+            return False
+        with _pending_lock:
+            pending = dict(_pending)
+            _pending.clear()
+        if not pending:
+            return True
+        index = get_index()
+        if index is not None and index.vectorizer is not None:
+            _apply_pending(index, pending)
+    if index is None or index.vectorizer is None:
+        request_build(force=index is not None)
+    else:
+        request_maintenance()
+    return True
+
+
+def _background_flush():
+    """Attend le verrou d'écriture et vide la file, tant qu'elle n'est pas vide"""
+    global _flush_thread
+    while True:
+        try:
+            _flush_pending(blocking=True)
+        except Exception:
+            logger.exception("Échec de la mise à jour incrémentale de l'index TF-IDF en arrière-plan")
+        with _pending_lock:
+            if not _pending:
+                _flush_thread = None
+                return
+
+
+def _enqueue(product_id, text):
+    """
+    Met une modification en file et l'écrit sans attendre le verrou
+
+    Returns:
+        bool: True si elle a été traitée par cet appel (écrite dans le delta,
+            ou confiée à la construction demandée) ; False si elle attend
+            qu'un build ou une compaction libère le verrou
+    """
+    global _flush_thread
+    with _pending_lock:
+        _pending.pop(product_id, None)  # La dernière modification d'un produit l'emporte
+        _pending[product_id] = text
+    if _flush_pending(blocking=False):
+        return True
+    with _pending_lock:
+        if _pending and _flush_thread is None:
+            _flush_thread = threading.Thread(target=_background_flush, name='recs-tfidf-delta', daemon=True)
+            _flush_thread.start()
+    return False
+
+
+def upsert_product(product_id, text):
+    """
+    Ajoute ou remplace un produit dans l'index sans reconstruction complète
+
+    Le texte est vectorisé avec le vocabulaire et les poids IDF existants puis
+    écrit dans le delta ; la ligne de base éventuelle est masquée. N'attend
+    jamais le verrou d'écriture (voir `_enqueue`).
+
+    Returns:
+        bool: True si la modification a été traitée par cet appel
+    """
+    return _enqueue(product_id, text)
+
+
+def remove_product(product_id):
+    """
+    Retire un produit de l'index (tombstone) sans reconstruction complète
+
+    Returns:
+        bool: True si la modification a été traitée par cet appel
+    """
+    return _enqueue(product_id, None)
+
+
+def compact_index():
+    """
+    Fusionne le delta dans l'index principal (sans ré-apprendre les poids IDF)
+
+    Les lignes masquées sont retirées, les lignes du delta ajoutées à la fin, et
+    la table des voisins / l'index LSH sont recalculés s'ils existaient.
+
+    Returns:
+        bool: True si une compaction a eu lieu
+    """
+    with index_write_lock():
+        index = get_index()
+        if index is None or index.vectorizer is None or not index.has_delta:
+            return False
+
+        base_rows = np.flatnonzero(index.alive[:index.base_size])
+        parts = [index.dequantized_matrix()[base_rows]]
+        if index.delta_matrix is not None:
+            parts.append(index.delta_matrix.astype(parts[0].dtype))
+        matrix = vstack(parts).tocsr()
+        ids = [index.ids[row] for row in base_rows] + index.delta_ids
+
+        _persist(
+            index.vectorizer, matrix, ids,
+            storage=index.meta.get('format', 'joblib'),
+            quantize=index.meta.get('quantization'),
+            fitted_at=index.meta.get('fitted_at'),
+        )
+        _rebuild_derived(index)
+    return True
+
+
+def refit_index():
+    """
+    Reconstruction complète (ré-apprentissage du vocabulaire et des poids IDF)
+    en conservant le format de stockage, la table des voisins et l'index LSH
+    """
+    with index_write_lock():
+        index = get_index()
+        meta = index.meta if index is not None else {}
+        build_index(
+            force=True,
+            storage=meta.get('format'),
+            quantize=meta.get('quantization'),
+        )
+        if index is not None:
+            _rebuild_derived(index)
+
+
+def _maintenance_due(index):
+    """
+    Opération de maintenance nécessaire pour un index
+
+    - Ré-apprentissage complet si les poids IDF ont plus de
+      `RECS_TFIDF_REFIT_INTERVAL` secondes ;
+    - sinon compaction si la dérive dépasse `RECS_TFIDF_COMPACT_THRESHOLD`.
+
+    Returns:
+        str | None: 'refit', 'compact' ou None
+    """
+    if index is None or not index.has_delta:
+        return None
+    refit_interval = getattr(settings, 'RECS_TFIDF_REFIT_INTERVAL', 24 * 3600)
+    fitted_at = index.meta.get('fitted_at') or index.meta.get('built_at') or 0
+    if refit_interval and time.time() - fitted_at > refit_interval:
+        return 'refit'
+    if index.drift > getattr(settings, 'RECS_TFIDF_COMPACT_THRESHOLD', 0.2):
+        return 'compact'
+    return None
+
+
+def maintain_index():
+    """
+    Ré-apprend ou compacte l'index si nécessaire (voir `_maintenance_due`)
+
+    Opération coûteuse (reconstruction, table des voisins, LSH) : appelée en
+    arrière-plan par `request_maintenance` ou par `build_recs_index --maintain`
+    (cron), jamais dans le thread d'une requête.
+
+    Returns:
+        str | None: 'refit', 'compact' ou None si rien n'a été fait
+    """
+    action = _maintenance_due(get_index())
+    if action == 'refit':
+        refit_index()
+    elif action == 'compact':
+        compact_index()
+    return action
+
+
+_maintenance_thread = None  # Thread de maintenance lancé par ce processus
+
+
+def _background_maintenance():
+    """Maintenance de l'index si aucun autre thread ou processus n'écrit l'index"""
+    with index_write_lock(blocking=False) as acquired:
+        if not acquired:
+            return  # Le détenteur du verrou publiera une nouvelle version ; revérifié au prochain delta
+        try:
+            maintain_index()
+        except Exception:
+            logger.exception("Échec de la maintenance de l'index TF-IDF en arrière-plan")
+
+
+def request_maintenance():
+    """
+    Lance `maintain_index` dans un thread d'arrière-plan si elle est nécessaire
+
+    Appelée après chaque écriture du delta : le ré-apprentissage ou la
+    compaction ne s'exécute jamais dans la requête qui a modifié le produit.
+    Un seul thread de maintenance par processus ; désactivé, comme
+    `request_build`, par `RECS_TFIDF_AUTO_BUILD = False` (maintenance par cron).
+
+    Returns:
+        bool: True si un thread de maintenance a été lancé par cet appel
+    """
+    global _maintenance_thread
+    if not getattr(settings, 'RECS_TFIDF_AUTO_BUILD', True) or _maintenance_due(get_index()) is None:
+        return False
+    with _build_state_lock:
+        if _maintenance_thread is not None and _maintenance_thread.is_alive():
+            return False
+        _maintenance_thread = threading.Thread(
+            target=_background_maintenance, name='recs-tfidf-maintenance', daemon=True,
+        )
+        _maintenance_thread.start()
+    return True
+
+
+# =============================================================================
+# REQUÊTES
+# =============================================================================
+def query_similar(product_id, k=6, engine=None):
+    """
+    Trouve les produits similaires à un produit donné
+
+    Args:
+        product_id (int): ID du produit de référence
+        k (int): Nombre maximum de produits similaires à retourner
+        engine (str | None): 'exact' ou 'ann' (défaut : `settings.RECS_TFIDF_ENGINE`) ;
+            le moteur 'ann' retombe sur 'exact' si l'index LSH n'a pas été construit
+
+    Returns:
+        list: Liste de tuples (product_id, score_similarité)
+    """
+    index = get_index()
+    if index is None:
+        request_build()  # Construction en arrière-plan : la requête n'attend jamais
+        return []
+
+    # Vérification des données chargées
+    if index.is_empty:
+        return []  # Retourne liste vide si problème
+
+    # Trouve la ligne du produit dans la matrice (dictionnaire, O(1))
+    idx = index.row_for(product_id)
+    if idx is None:
+        # Produit non trouvé dans l'index
+        return []
+
+    # Chemin rapide : lecture directe dans la table précalculée, O(k)
+    hits = index.table_neighbours(idx, k)
+    if hits is not None:
+        return [(index.id_at(row), score) for row, score in hits]
+
+    # Moteur approximatif : re-classement exact des seuls candidats LSH
+    engine = engine or getattr(settings, 'RECS_TFIDF_ENGINE', 'exact')
+    if engine == 'ann':
+        probes = getattr(settings, 'RECS_ANN_PROBES', 4)
+        hits = index.ann_neighbours(idx, k, probes=probes)
+        if hits is not None:
+            return [(index.id_at(row), score) for row, score in hits]
+
+    # Calcul des similarités cosinus entre le produit et tous les autres
+    cosine_similarities = index.similarities(idx)
+
+    # Met la similarité avec soi-même à -1 pour éviter de se recommander
+    cosine_similarities[idx] = -1
+
+    # Trie les indices par similarité décroissante et prend les k premiers
+    related_indices = cosine_similarities.argsort()[::-1][:k]
+
+    # Construction du résultat
+    result = []
+    for i in related_indices:
+        if cosine_similarities[i] <= 0:
+            continue  # Ignore les similarités négatives ou nulles
+        # Ajoute le tuple (ID produit, score de similarité)
+        result.append((index.id_at(i), float(cosine_similarities[i])))
+
+    return result
+
+
+def search_products(query, offset=0, limit=20):
+    """
+    Recherche de produits classée par pertinence TF-IDF
+
+    Args:
+        query (str): Texte recherché
+        offset (int): Rang du premier résultat
+        limit (int): Taille de la page
+
+    Returns:
+        tuple | None: (nombre total de résultats, liste de (product_id, score)),
+            ou None si l'index n'est pas encore construit (construction demandée
+            en arrière-plan) ou si aucun produit ne partage un terme avec la
+            requête (termes inconnus, fautes de frappe, fragments de mots) :
+            l'appelant se rabat alors sur la recherche ORM
+    """
+    index = get_index()
+    if index is None:
+        request_build()
+        return None
+    total, hits = index.search(query, offset=offset, limit=limit)
+    if total == 0:
+        return None
+    return total, [(index.id_at(row), score) for row, score in hits]
+
+
+def query_similar_many(product_ids, k=6, merge='max'):
+    """
+    Recommandations pour un ensemble de produits (panier, liste, commande)
+
+    Les similarités sont calculées en une seule opération creuse sur tout
+    l'ensemble, au lieu d'un appel `query_similar` par produit.
+
+    Args:
+        product_ids (list): IDs des produits de référence
+        k (int): Nombre maximum de produits à retourner
+        merge (str): Fusion des scores :
+            - 'max' : meilleur score obtenu face à l'un des produits d'entrée
+            - 'centroid' : similarité avec le barycentre (normalisé) des entrées
+
+    Returns:
+        list: Liste de tuples (product_id, score) triée, sans les produits d'entrée
+    """
+    if merge not in MERGE_MODES:
+        raise ValueError(f"Mode de fusion inconnu : {merge}")
+
+    index = get_index()
+    if index is None:
+        request_build()
+        return []
+    if index.is_empty:
+        return []
+
+    # Lignes des produits d'entrée (les inconnus sont ignorés, les doublons fusionnés)
+    rows = list(dict.fromkeys(
+        row for row in (index.row_for(pid) for pid in product_ids) if row is not None
+    ))
+    if not rows:
+        return []
+
+    queries = index.rows_matrix(rows)
+    if merge == 'centroid':
+        centroid = csr_matrix(queries.sum(axis=0))
+        norm = np.sqrt(centroid.multiply(centroid).sum())
+        if norm == 0:
+            return []
+        queries = centroid / norm
+    scores = index.max_scores(queries)
+
+    # Exclut les produits d'entrée puis sélection partielle des k meilleurs
+    scores[rows] = -1
+    k = min(k, len(scores))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return [(index.id_at(i), float(scores[i])) for i in top if scores[i] > 0]
@@ -0,0 +1,95 @@
+"""
+Fichier: api/recs_tfidf_build.py
+
+Description (FR):
+- Étapes de calcul de la construction TF-IDF par lots (« shards ») de produits,
+    utilisées par `recs_tfidf.build_index()` pour les gros catalogues :
+    - count_shard(docs) : tokenise un lot de textes et renvoie son vocabulaire
+        local et sa matrice creuse de comptages. Exécutée dans un pool de
+        processus : seul le lot en cours de traitement garde son texte brut.
+    - assemble_tfidf(shards) : fusionne les vocabulaires des lots, applique la
+        limite `max_features`, calcule les poids IDF et assemble la matrice CSR
+        normalisée, équivalente à `TfidfVectorizer.fit_transform` sur le
+        catalogue complet (à l'ordre près des ex aequo de `max_features`).
+
+Comment ce fichier se connecte :
+- Le module n'importe pas Django : les processus du pool peuvent le charger
+    sans initialiser l'application (méthode de démarrage `spawn` sous Windows
+    et macOS).
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+MAX_FEATURES = 10000  # Nombre maximum de caractéristiques (mots)
+STOP_WORDS = 'english'  # Supprime les mots vides anglais (the, and, etc.)
+
+
+def count_shard(docs):
+    """
+    Tokenise un lot de textes produits
+
+    Args:
+        docs (list): Textes (nom + description) du lot
+
+    Returns:
+        tuple: (termes triés du lot (numpy.ndarray de str),
+            comptages CSR int32 de forme (len(docs), len(termes)))
+    """
+    counter = CountVectorizer(stop_words=STOP_WORDS, dtype=np.int32)
+    try:
+        counts = counter.fit_transform(docs)
+    except ValueError:
+        # Lot sans aucun mot utile (uniquement des mots vides, textes vides...)
+        return np.array([], dtype=str), csr_matrix((len(docs), 0), dtype=np.int32)
+    terms = counter.get_feature_names_out()
+    return terms, counts.tocsr()
+
+
+def assemble_tfidf(shards, max_features=MAX_FEATURES):
+    """
+    Assemble le vectoriseur et la matrice TF-IDF à partir des lots comptés
+
+    Args:
+        shards (list): Résultats de `count_shard`, dans l'ordre des produits
+        max_features (int): Taille maximale du vocabulaire (termes les plus fréquents)
+
+    Returns:
+        tuple: (TfidfVectorizer prêt pour `transform`, matrice CSR normalisée L2)
+    """
+    vocabulary = np.unique(np.concatenate([terms for terms, _ in shards]))
+
+    # Projection des colonnes locales de chaque lot sur le vocabulaire global
+    totals = np.zeros(len(vocabulary), dtype=np.int64)
+    remapped = []
+    for terms, counts in shards:
+        columns = np.searchsorted(vocabulary, terms).astype(np.int32)
+        counts = csr_matrix(
+            (counts.data, columns[counts.indices], counts.indptr),
+            shape=(counts.shape[0], len(vocabulary)),
+        )
+        totals += np.bincount(counts.indices, weights=counts.data, minlength=len(vocabulary)).astype(np.int64)
+        remapped.append(counts)
+
+    # Limite du vocabulaire aux termes les plus fréquents du catalogue
+    keep = np.arange(len(vocabulary))
+    if max_features is not None and len(vocabulary) > max_features:
+        keep = np.sort(np.argsort(-totals, kind='stable')[:max_features])
+    counts = vstack([shard[:, keep] for shard in remapped], format='csr')
+    counts.sort_indices()
+
+    # Poids IDF lissés, identiques à TfidfTransformer(smooth_idf=True)
+    n_docs = counts.shape[0]
+    df = np.bincount(counts.indices, minlength=len(keep))
+    idf = np.log((1 + n_docs) / (1 + df)) + 1
+
+    matrix = counts.astype(np.float64)
+    matrix.data *= idf[matrix.indices]
+    matrix = normalize(matrix, norm='l2', copy=False)
+
+    vectorizer = TfidfVectorizer(max_features=max_features, stop_words=STOP_WORDS)
+    vectorizer.vocabulary_ = {term: column for column, term in enumerate(vocabulary[keep].tolist())}
+    vectorizer.idf_ = idf
+    return vectorizer, matrix
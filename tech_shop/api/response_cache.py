@@ -0,0 +1,186 @@
+"""
+Fichier: api/response_cache.py
+
+Description (FR):
+- Cache des réponses des endpoints publics en lecture (liste des produits, avis
+    d'un produit, recommandations heuristiques et TF-IDF), à deux niveaux :
+    - L1 : cache mémoire du processus (`CACHES['default']`, locmem) ;
+    - L2 : cache partagé entre workers et serveurs (`CACHES['shared']` :
+        fichiers par défaut, Redis si `CACHE_REDIS_URL` est défini).
+  Une réponse trouvée en L2 est recopiée en L1 ; seules les réponses 200 sont
+  mises en cache (les données DRF, avant rendu JSON), sauf celles marquées
+  `Cache-Control: no-store` (résultat partiel, ex : recommandations dégradées).
+- Clés versionnées, jamais effacées une à une :
+    - par version du catalogue (`CatalogVersion`) pour les listes et les
+        recommandations, complétée par l'empreinte de l'index TF-IDF publié ;
+    - par génération de produit pour les avis : compteur en L2, incrémenté par
+        les signaux de Product et de Review (`invalidate_product`), qui n'invalide
+        que les avis du produit concerné.
+  Une écriture rend les anciennes clés inaccessibles ; elles expirent d'elles-mêmes.
+- Protection contre l'effet de meute (« single-flight ») : sur une clé absente,
+    un seul calcul par clé et par processus (verrou local), et un seul entre
+    processus (verrou `add()` atomique en L2) ; les autres requêtes attendent le
+    résultat publié en L2 au plus `RESPONSE_CACHE_LOCK_WAIT` secondes, puis
+    calculent elles-mêmes en dernier recours.
+
+Comment ce fichier se connecte :
+- `cached_response()` est appelée par les méthodes `get` des vues (`api/views.py`).
+- `invalidate_product()` est appelée par `api/signals.py` après le commit.
+"""
+
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+from .conditional import catalog_state
+from .recs_tfidf import index_state
+
+KEY_PREFIX = 'resp'
+POLL_INTERVAL = 0.05  # Attente entre deux lectures du L2 pendant le calcul d'un autre processus
+LOCK_STRIPES = 64  # Verrous locaux partagés par hachage des clés (mémoire bornée)
+
+_local_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+def _enabled():
+    return getattr(settings, 'RESPONSE_CACHE_ENABLED', True)
+
+
+def _l1():
+    return caches['default']
+
+
+def _l2():
+    return caches['shared']
+
+
+# =============================================================================
+# VERSIONS DES CLÉS
+# =============================================================================
+def catalog_version(request):
+    """
+    Version du catalogue (lue une fois par requête, partagée avec l'ETag)
+
+    La date du dernier changement accompagne la version : une base recréée,
+    dont le compteur repart de 0, ne retombe pas sur les clés de l'ancienne.
+    """
+    version, changed_at = catalog_state(request)
+    return f'{version}.{changed_at.timestamp() if changed_at else 0}'
+
+
+def index_version():
+    """Empreinte courte de l'index TF-IDF publié"""
+    signature = index_state()[0]
+    return hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()[:16]
+
+
+def product_generation(product_id):
+    """Génération des données d'un produit (0 tant qu'il n'a pas été modifié)"""
+    return _l2().get(f'{KEY_PREFIX}:gen:product:{product_id}', 0)
+
+
+def invalidate_product(product_id):
+    """Rend inaccessibles les réponses mises en cache pour un produit"""
+    key = f'{KEY_PREFIX}:gen:product:{product_id}'
+    try:
+        _l2().incr(key)
+    except ValueError:
+        # Clé absente (jamais incrémentée, ou expirée) : une nouvelle génération
+        # unique évite de retomber sur une ancienne valeur encore en cache
+        _l2().set(key, time.time_ns(), timeout=None)
+
+
+# =============================================================================
+# LECTURE / CALCUL
+# =============================================================================
+def _key(request, scope, versions):
+    """Clé d'une réponse : portée, versions et URL complète (pagination, champs)"""
+    url = hashlib.sha1(request.build_absolute_uri().encode('utf-8')).hexdigest()
+    return ':'.join([KEY_PREFIX, scope] + [str(version) for version in versions] + [url])
+
+
+def _local_lock(key):
+    """Verrou local d'une clé (deux clés peuvent partager le même verrou)"""
+    return _local_locks[hash(key) % LOCK_STRIPES]
+
+
+def _lookup(key):
+    """Valeur en L1, sinon en L2 (recopiée en L1), sinon None"""
+    data = _l1().get(key)
+    if data is not None:
+        return data
+    data = _l2().get(key)
+    if data is not None:
+        _l1().set(key, data, getattr(settings, 'RESPONSE_CACHE_L1_TIMEOUT', 60))
+    return data
+
+
+def _plain(data):
+    """Copie en dict / list simples (les `ReturnList` DRF référencent leur serializer)"""
+    if isinstance(data, dict):
+        return {key: _plain(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_plain(value) for value in data]
+    return data
+
+
+def _store(key, data):
+    data = _plain(data)
+    _l2().set(key, data, getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+    _l1().set(key, data, getattr(settings, 'RESPONSE_CACHE_L1_TIMEOUT', 60))
+
+
+def _compute(key, compute):
+    """Calcule la réponse ; ne la met en cache que si elle vaut 200 (et n'est pas `no-store`)"""
+    response = compute()
+    if response.status_code == 200 and 'no-store' not in response.get('Cache-Control', ''):
+        _store(key, response.data)
+    return response
+
+
+def cached_response(request, scope, versions, compute):
+    """
+    Réponse d'un endpoint public, servie depuis le cache si possible
+
+    Args:
+        request: Requête DRF
+        scope (str): Nom de l'endpoint dans la clé (ex : 'products')
+        versions (tuple): Versions des données dont dépend la réponse
+        compute: Fonction sans argument qui produit la `Response` DRF
+
+    Returns:
+        Response: Réponse DRF (données en cache ou fraîchement calculées)
+    """
+    if not _enabled():
+        return compute()
+    key = _key(request, scope, versions)
+    data = _lookup(key)
+    if data is not None:
+        return Response(data)
+
+    with _local_lock(key):
+        # Un autre thread du processus a pu calculer la réponse pendant l'attente
+        data = _lookup(key)
+        if data is not None:
+            return Response(data)
+
+        lock_key = f'{key}:lock'
+        lock_wait = getattr(settings, 'RESPONSE_CACHE_LOCK_WAIT', 5.0)
+        if _l2().add(lock_key, 1, timeout=max(1, int(lock_wait * 2))):
+            try:
+                return _compute(key, compute)
+            finally:
+                _l2().delete(lock_key)
+
+        # Un autre processus calcule : attend sa publication en L2
+        deadline = time.monotonic() + lock_wait
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            data = _lookup(key)
+            if data is not None:
+                return Response(data)
+        return _compute(key, compute)
@@ -8,10 +8,17 @@ Description (FR):
 
 - Principales classes :
     - UserSerializer : sérialisation/création d'utilisateurs.
-    - ProductSerializer : sérialisation des produits ; ajoute des champs calculés
-        comme `review_count` et `average_rating`.
+    - ProductSerializer : sérialisation des produits ; ajoute `review_count` et
+        `average_rating`, lus dans les agrégats stockés sur le produit.
     - CartSerializer : sérialise le champ `items` du modèle Cart (JSONField).
-    - OrderSerializer : pour créer/afficher des commandes (stocke la liste products comme JSON).
+    - OrderSerializer : pour créer/afficher des commandes (stocke la liste products comme JSON) ;
+        la création passe par `api/checkout.py` (prix de la base, réservation du stock).
+    - ProductListSerializer / OrderListSerializer : représentations compactes des
+        listes (grille du catalogue, tableaux de commandes), sans description
+        complète ni JSON des produits commandés.
+- Champs partiels (« sparse fieldsets ») : `?fields=id,name,price` limite les
+    champs renvoyés par les serializers `SparseFieldsetMixin` ; `restrict_columns()`
+    limite en conséquence les colonnes lues en base (`QuerySet.only()`).
 
 Comment ces fichiers se connectent :
 - Les vues dans `api/views.py` utilisent ces serializers pour valider les données
@@ -20,9 +27,75 @@ Comment ces fichiers se connectent :
 
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 
+from .checkout import CheckoutError, cancel_order, place_order
 from .models import Product, Cart, Order, Review
 
+FIELDS_QUERY_PARAM = 'fields'
+
+
+# =============================================================================
+# CHAMPS PARTIELS (?fields=)
+# =============================================================================
+def requested_fields(request):
+    """Champs demandés par `?fields=a,b` sur une lecture (None = tous)"""
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    raw = request.query_params.get(FIELDS_QUERY_PARAM)
+    if not raw:
+        return None
+    return {name.strip() for name in raw.split(',') if name.strip()}
+
+
+class SparseFieldsetMixin:
+    """
+    Ne sérialise que les champs demandés par `?fields=` (noms inconnus ignorés)
+
+    `Meta.columns` associe un champ calculé aux colonnes du modèle dont il a
+    besoin (par défaut : la colonne de même nom, ou celle de sa `source`).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = requested_fields(self.context.get('request'))
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+    @classmethod
+    def columns_for(cls, names):
+        """Colonnes (chemins `only()`) nécessaires pour sérialiser les champs `names`"""
+        declared = getattr(cls.Meta, 'columns', {})
+        model_fields = {field.name for field in cls.Meta.model._meta.concrete_fields}
+        fields = cls().fields
+        columns = {'pk'}
+        for name in names:
+            if name in declared:
+                columns.update(declared[name])
+            elif name in fields:
+                source = fields[name].source.replace('.', '__')
+                if source.split('__')[0] in model_fields:
+                    columns.add(source)
+        return columns
+
+
+def restrict_columns(queryset, serializer_class, request):
+    """
+    Limite les colonnes lues (`only()`) aux champs sérialisés par la requête
+
+    Les relations traversées (ex : `user__username`) sont jointes via
+    `select_related` : aucune requête supplémentaire par ligne.
+    """
+    if not issubclass(serializer_class, SparseFieldsetMixin) or request.method not in SAFE_METHODS:
+        return queryset
+    names = requested_fields(request) or serializer_class().fields.keys()
+    columns = serializer_class.columns_for(names)
+    related = {column.rsplit('__', 1)[0] for column in columns if '__' in column}
+    if related:
+        queryset = queryset.select_related(*related)
+    return queryset.only(*columns)
+
 
 class UserSerializer(serializers.ModelSerializer):
     """
@@ -55,17 +128,17 @@ class UserSerializer(serializers.ModelSerializer):
         return user
     
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     Serializer pour le modèle Product
     
-    Ajoute des champs calculés :
-    - review_count: Nombre total d'avis
-    - average_rating: Note moyenne des avis
+    Ajoute des champs calculés, sans requête supplémentaire par produit :
+    - review_count: Nombre total d'avis (colonne `rating_count`)
+    - average_rating: Note moyenne des avis (`rating_sum / rating_count`)
     """
     
-    # Champ calculé - nombre total d'avis
-    review_count = serializers.IntegerField(source='reviews.count', read_only=True)
+    # Nombre total d'avis, stocké sur le produit
+    review_count = serializers.IntegerField(source='rating_count', read_only=True)
     
     # Champ calculé - note moyenne via une méthode
     average_rating = serializers.SerializerMethodField(read_only=True)
@@ -73,6 +146,9 @@ class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = '__all__'  # Inclut tous les champs du modèle
+        # Agrégats maintenus par les signaux de Review, jamais par l'API
+        read_only_fields = ('rating_count', 'rating_sum')
+        columns = {'average_rating': ('rating_sum', 'rating_count')}
         
     def get_average_rating(self, obj):
         """
@@ -85,7 +161,23 @@ class ProductSerializer(serializers.ModelSerializer):
             float: Note moyenne ou 0 si aucun avis
         """
         return obj.average_rating()  # Appelle la méthode du modèle
-    
+
+
+class ProductListSerializer(ProductSerializer):
+    """
+    Représentation compacte d'un produit pour la grille du catalogue
+
+    La description complète est remplacée par `summary`, ses premiers
+    caractères, calculés par la base (annotation `summary` de la vue) :
+    le texte complet n'est jamais lu.
+    """
+
+    summary = serializers.CharField(read_only=True)
+
+    class Meta(ProductSerializer.Meta):
+        fields = ('id', 'name', 'price', 'image', 'quantity', 'summary', 'review_count', 'average_rating')
+        columns = {'average_rating': ('rating_sum', 'rating_count'), 'summary': ()}
+
 
 class CartSerializer(serializers.ModelSerializer):
     """
@@ -93,21 +185,28 @@ class CartSerializer(serializers.ModelSerializer):
     
     Format des items JSON :
     [{"product_id": 1, "quantity": 2}, ...]
+
+    `version` : incrémentée à chaque écriture (concurrence optimiste)
     """
     
     class Meta:
         model = Cart
-        fields = ['items']  # Seul champ sérialisé (contenu du panier)
+        fields = ['items', 'version']  # Contenu du panier et sa version
+        read_only_fields = ['version']
         
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     Serializer pour le modèle Order (Commande)
     
     Gère :
     - Sérialisation des produits en JSON
     - Affichage des informations utilisateur
-    - Calcul automatique du prix total
+    - Calcul du prix total à partir des prix de la base (`Decimal`)
+    - Réservation du stock à la création, jusqu'à `reserved_until`
+    - Statut et paiement en lecture seule : ils pilotent le stock réservé et ne
+      changent que par `checkout` (paiement, annulation, expiration) ; un client
+      peut seulement demander l'annulation (`{"status": "CANCELLED"}`)
     """
     
     # Champ produits stocké en JSON
@@ -120,38 +219,69 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = [
             'id', 'user', 'address', 'city', 'country', 
-            'products', 'total_price', 'status'
+            'products', 'total_price', 'status', 'reserved_until'
         ]
         read_only_fields = [
-            'id', 'user', 'total_price', 'created_at', 'updated_at'
+            'id', 'user', 'total_price', 'status', 'payment_completed',
+            'created_at', 'updated_at', 'reserved_until'
         ]
+        columns = {'user': ('user__id', 'user__username')}
         
     def create(self, validated_data):
         """
-        Surcharge de la création pour gérer les produits JSON
-        
+        Passe la commande : seuls `product_id` (ou `id`) et `quantity` des
+        produits sont lus, prix et noms viennent de la base
+
         Args:
             validated_data: Données validées du serializer
-        
+
         Returns:
-            Order: Instance de commande créée
+            Order: Commande PENDING, stock réservé
         """
-        # Extrait les données produits
         products_data = validated_data.pop('products')
-        
-        # Crée la commande sans les produits d'abord
-        order = Order.objects.create(**validated_data)
-        
-        # Assigne les produits en JSON
-        order.products = products_data
-        
-        # Sauvegarde (déclenche calculate_total automatiquement)
-        order.save()
-        
-        return order
+        try:
+            return place_order(lines=products_data, request=self.context.get('request'), **validated_data)
+        except CheckoutError as exc:
+            raise serializers.ValidationError({'products': [str(exc)]})
+
+    def update(self, instance, validated_data):
+        """
+        Les produits d'une commande passée ne changent plus (stock réservé) ;
+        une demande d'annulation passe par `checkout.cancel_order` (stock rendu)
+        """
+        validated_data.pop('products', None)
+        requested = self.initial_data.get('status') if isinstance(self.initial_data, dict) else None
+        if requested is not None and requested != instance.status:
+            if requested != Order.CANCELLED:
+                raise serializers.ValidationError({'status': ['Only cancellation can be requested.']})
+            if not cancel_order(instance):
+                raise serializers.ValidationError({'status': ['Only an unpaid pending order can be cancelled.']})
+        return super().update(instance, validated_data)
+
 
+class UserSummarySerializer(serializers.ModelSerializer):
+    """Auteur d'une commande dans les listes : ID et nom d'utilisateur"""
 
-class ReviewSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ('id', 'username')
+
+
+class OrderListSerializer(OrderSerializer):
+    """
+    Représentation compacte d'une commande pour les tableaux de commandes
+
+    Sans adresse ni JSON des produits commandés (voir le détail de la commande) ;
+    l'auteur est joint dans la même requête (`select_related`).
+    """
+
+    user = UserSummarySerializer(read_only=True)
+
+    class Meta(OrderSerializer.Meta):
+        fields = ['id', 'user', 'status', 'total_price', 'payment_completed', 'created_at']
+
+
+class ReviewSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     Serializer pour le modèle Review (Avis)
     
@@ -165,4 +295,5 @@ class ReviewSerializer(serializers.ModelSerializer):
         model = Review
         fields = [
             'id', 'product', 'user', 'rating', 'comment', 'created_at'
-        ]
\ No newline at end of file
+        ]
+        columns = {'user': ('user__id', 'user__username')}
\ No newline at end of file
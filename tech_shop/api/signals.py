@@ -8,6 +8,21 @@ Description (FR):
 - Fonctionnalité :
     - `create_or_update_cart` : écoute le signal `post_save` du modèle User
     - Crée automatiquement un panier vide pour tout nouvel utilisateur
+    - `update_tfidf_index_on_save` / `update_tfidf_index_on_delete` : écoutent
+      `post_save` / `post_delete` du modèle Product et maintiennent l'index TF-IDF
+      de façon incrémentale (voir `api/recs_tfidf.py`), une fois la transaction
+      validée, sans attendre une reconstruction complète
+    - `track_review_rating` / `update_rating_aggregates_*` : tiennent à jour
+      `Product.rating_count` / `rating_sum` à chaque création, modification ou
+      suppression d'avis, par des UPDATE atomiques `F()` (pas de lecture-écriture)
+    - `update_suggest_index_*` : tiennent à jour l'index de préfixes de
+      l'autocomplétion (voir `api/suggest.py`) sur les modifications de produits
+      et d'avis
+    - `record_catalog_change_*` : journalisent chaque modification de produit
+      ou d'avis (`CatalogChange`), qui fait avancer la version de l'instantané
+      en mémoire du catalogue (voir `api/catalog.py`)
+    - `invalidate_response_cache_*` : invalident les réponses en cache d'un
+      produit modifié ou dont les avis ont changé (voir `api/response_cache.py`)
 
 Comment ces fichiers se connectent :
 - Le signal est connecté dans `api/apps.py` via la méthode `ready()`
@@ -16,10 +31,18 @@ Comment ces fichiers se connectent :
 - Évite les erreurs dans les vues où on suppose qu'un utilisateur a toujours un panier
 """
 
-from django.db.models.signals import post_save
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Cart
+from .models import Cart, Product, Review
+from . import catalog, recs_tfidf, response_cache, suggest
+
+logger = logging.getLogger(__name__)
 
 
 # Signal pour créer un panier à chaque fois qu'un nouvel utilisateur est créé
@@ -37,4 +60,222 @@ def create_or_update_cart(sender, instance, created, **kwargs):
     if created:
         # Crée un nouveau panier seulement si l'utilisateur est nouvellement créé
         Cart.objects.create(user=instance)
-        # Note: Le panier est créé avec items=[] (valeur par défaut du JSONField)
\ No newline at end of file
+        # Note: Le panier est créé avec items=[] (valeur par défaut du JSONField)
+
+
+# =============================================================================
+# AGRÉGATS DES AVIS SUR PRODUCT
+# =============================================================================
+def _shift_rating(product_id, count, rating):
+    """
+    Ajoute (ou retire si count = -1) une note aux agrégats d'un produit
+
+    Un retrait qui rendrait les agrégats négatifs (avis jamais compté, ex :
+    chargé par `loaddata` avant correction) est ignoré au lieu de violer la
+    contrainte `rating_count >= 0`.
+    """
+    products = Product.objects.filter(pk=product_id)
+    if count < 0:
+        products = products.filter(rating_count__gte=-count, rating_sum__gte=-count * rating)
+    products.update(
+        rating_count=F('rating_count') + count,
+        rating_sum=F('rating_sum') + count * rating,
+    )
+
+
+def recompute_rating_aggregates(product_id):
+    """Recalcule les agrégats d'un produit à partir de ses avis (fixtures, réparation)"""
+    totals = Review.objects.filter(product_id=product_id).aggregate(count=Count('id'), total=Sum('rating'))
+    Product.objects.filter(pk=product_id).update(rating_count=totals['count'], rating_sum=totals['total'] or 0)
+    catalog.record_change(product_id)
+
+
+@receiver(pre_save, sender=Review)
+def track_review_rating(sender, instance, raw=False, **kwargs):
+    """Mémorise le produit et la note d'origine d'un avis modifié"""
+    instance._rating_before = None
+    if raw or instance.pk is None:
+        return
+    instance._rating_before = (
+        Review.objects.filter(pk=instance.pk).values_list('product_id', 'rating').first()
+    )
+
+
+@receiver(post_save, sender=Review)
+def update_rating_aggregates_on_save(sender, instance, created, raw=False, **kwargs):
+    """
+    Répercute un avis créé ou modifié sur les agrégats du produit
+
+    Un avis chargé par `loaddata` (`raw`) peut être nouveau ou déjà compté :
+    les agrégats de son produit sont recalculés après le commit.
+    """
+    if raw:
+        transaction.on_commit(lambda: recompute_rating_aggregates(instance.product_id))
+        return
+    before = getattr(instance, '_rating_before', None)
+    current = (instance.product_id, instance.rating)
+    if not created and before == current:
+        return  # Commentaire modifié, note inchangée
+    if before is not None:
+        _shift_rating(before[0], -1, before[1])
+    _shift_rating(instance.product_id, 1, instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_aggregates_on_delete(sender, instance, **kwargs):
+    """Retire la note d'un avis supprimé (sans effet si le produit est supprimé)"""
+    _shift_rating(instance.product_id, -1, instance.rating)
+
+
+# =============================================================================
+# MAINTENANCE INCRÉMENTALE DE L'INDEX TF-IDF
+# =============================================================================
+def _incremental_index_enabled():
+    """La maintenance incrémentale peut être coupée via `RECS_TFIDF_INCREMENTAL`"""
+    return getattr(settings, 'RECS_TFIDF_INCREMENTAL', True)
+
+
+def _run_index_update(func, *args):
+    """
+    Écrit le delta de l'index après le commit
+
+    Seule l'écriture du delta (un produit) a lieu dans la requête : une
+    compaction ou un ré-apprentissage éventuel part en arrière-plan
+    (`recs_tfidf.request_maintenance`). Une erreur d'indexation ne doit jamais
+    faire échouer l'enregistrement du produit : elle est journalisée et
+    rattrapée par la prochaine reconstruction.
+    """
+    def run():
+        try:
+            func(*args)
+        except Exception:
+            logger.exception("Échec de la mise à jour incrémentale de l'index TF-IDF")
+    transaction.on_commit(run)
+
+
+@receiver(post_save, sender=Product)
+def update_tfidf_index_on_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """
+    Vectorise un produit créé ou modifié et l'ajoute au delta de l'index
+
+    Args:
+        instance: Le produit sauvegardé
+        raw (bool): True lors d'un chargement de fixtures (ignoré)
+        update_fields: Champs modifiés ; si ni le nom ni la description n'ont
+            changé (ex: mise à jour du stock), l'index n'est pas touché
+    """
+    if raw or not _incremental_index_enabled():
+        return
+    if update_fields is not None and not {'name', 'description'} & set(update_fields):
+        return
+    text = recs_tfidf.product_text(instance.name, instance.description)
+    _run_index_update(recs_tfidf.upsert_product, instance.pk, text)
+
+
+@receiver(post_delete, sender=Product)
+def update_tfidf_index_on_delete(sender, instance, **kwargs):
+    """Marque un produit supprimé comme tombstone dans l'index"""
+    if not _incremental_index_enabled():
+        return
+    _run_index_update(recs_tfidf.remove_product, instance.pk)
+
+
+# =============================================================================
+# INDEX DE PRÉFIXES DE L'AUTOCOMPLÉTION
+# =============================================================================
+def _run_suggest_update(func, *args):
+    """Met à jour l'index d'autocomplétion après le commit (erreurs journalisées)"""
+    def run():
+        try:
+            func(*args)
+        except Exception:
+            logger.exception("Échec de la mise à jour de l'index d'autocomplétion")
+    transaction.on_commit(run)
+
+
+@receiver(post_save, sender=Product)
+def update_suggest_index_on_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Ajoute ou renomme un produit dans l'index (ignoré si le nom n'a pas changé)"""
+    if raw or (update_fields is not None and 'name' not in update_fields):
+        return
+    _run_suggest_update(suggest.product_changed, instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=Product)
+def update_suggest_index_on_delete(sender, instance, **kwargs):
+    """Retire un produit supprimé de l'index"""
+    _run_suggest_update(suggest.product_removed, instance.pk)
+
+
+@receiver(post_save, sender=Review)
+def update_suggest_index_on_review(sender, instance, raw=False, **kwargs):
+    """Un avis change la popularité de son produit (et de l'ancien s'il a été déplacé)"""
+    if raw:
+        return
+    before = getattr(instance, '_rating_before', None)
+    product_ids = {instance.product_id} | ({before[0]} if before else set())
+    _run_suggest_update(suggest.ratings_changed, *product_ids)
+
+
+@receiver(post_delete, sender=Review)
+def update_suggest_index_on_review_delete(sender, instance, **kwargs):
+    """Un avis supprimé change la popularité de son produit"""
+    _run_suggest_update(suggest.ratings_changed, instance.product_id)
+
+
+# =============================================================================
+# VERSION DE L'INSTANTANÉ DU CATALOGUE
+# =============================================================================
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def record_catalog_change_on_product(sender, instance, raw=False, **kwargs):
+    """Journalise la création, la modification ou la suppression d'un produit"""
+    if raw:
+        return
+    catalog.record_change(instance.pk)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def record_catalog_change_on_review(sender, instance, raw=False, **kwargs):
+    """Les agrégats d'avis du produit (et de l'ancien produit d'un avis déplacé) ont changé"""
+    if raw:
+        return
+    before = getattr(instance, '_rating_before', None)
+    if before is not None and before[0] != instance.product_id:
+        catalog.record_change(before[0])
+    catalog.record_change(instance.product_id)
+
+
+# =============================================================================
+# CACHE DES RÉPONSES PUBLIQUES
+# =============================================================================
+def _invalidate_cached_product(product_id):
+    """Invalide les réponses en cache d'un produit après le commit (erreurs journalisées)"""
+    def run():
+        try:
+            response_cache.invalidate_product(product_id)
+        except Exception:
+            logger.exception("Échec de l'invalidation du cache des réponses")
+    transaction.on_commit(run)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_response_cache_on_product(sender, instance, raw=False, **kwargs):
+    """Produit créé, modifié ou supprimé"""
+    if raw:
+        return
+    _invalidate_cached_product(instance.pk)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_response_cache_on_review(sender, instance, raw=False, **kwargs):
+    """Avis ajouté, modifié ou supprimé : ses avis (et ceux de l'ancien produit) changent"""
+    if raw:
+        return
+    before = getattr(instance, '_rating_before', None)
+    if before is not None and before[0] != instance.product_id:
+        _invalidate_cached_product(before[0])
+    _invalidate_cached_product(instance.product_id)
@@ -0,0 +1,365 @@
+"""
+Fichier: api/suggest.py
+
+Description (FR):
+- Index de préfixes en mémoire pour l'autocomplétion de la barre de recherche
+    (`/api/products/suggest/?q=`), servi sans aucune requête en base.
+- Structure :
+    - `tokens` : liste triée des mots distincts des noms de produits ; un préfixe
+        correspond à une plage contiguë trouvée par dichotomie (`bisect`).
+    - `postings` : pour chaque mot, les produits qui le contiennent, triés par
+        poids décroissant (popularité : note moyenne x log(1 + nombre d'avis),
+        lue dans les agrégats `rating_count` / `rating_sum` du produit).
+    - Un petit cache des dernières réponses, vidé à chaque modification.
+- Fonctions principales :
+    - get_prefix_index() : index du processus courant, construit en arrière-plan
+        (une seule requête `values_list`) au premier appel puis quand un autre
+        processus signale un renommage ou une suppression ; synchronisé au plus
+        toutes les `SUGGEST_SYNC_INTERVAL` secondes avec le journal
+        `CatalogChange` (poids des produits dont les avis ont changé) ; None tant
+        que la première construction n'est pas terminée.
+    - suggest(query, limit) : meilleures suggestions pour la saisie en cours
+        (aucune tant que l'index n'est pas prêt).
+    - product_changed(...) / product_removed(...) / ratings_changed(...) :
+        appelées par `api/signals.py` pour tenir l'index à jour.
+
+Comment ce fichier se connecte :
+- Les modifications sont appliquées directement à l'index du processus qui les
+    fait. Les autres workers les reçoivent :
+    - création, renommage ou suppression d'un produit : `recs_index/suggest.stamp`
+        est touché (un simple `stat` par requête détecte le changement) et
+        l'index est reconstruit ;
+    - avis : rejeu en arrière-plan des lignes du journal `CatalogChange` plus
+        récentes que la version de l'index (`CatalogVersion`, voir
+        `api/catalog.py`), qui ne relit que les produits concernés.
+"""
+
+import heapq
+import logging
+import math
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+
+from .models import CatalogChange, CatalogVersion, Product
+from .recs_tfidf import STORE_DIR
+
+STAMP_PATH = STORE_DIR / 'suggest.stamp'  # Touché à chaque création, renommage ou suppression
+CACHE_SIZE = 1024  # Réponses mémorisées (les préfixes tapés se répètent beaucoup)
+TOKEN_RE = re.compile(r'\w+')
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize(text):
+    """Mots en minuscules d'un nom de produit ou d'une saisie"""
+    return TOKEN_RE.findall((text or '').lower())
+
+
+class PrefixIndex:
+    """
+    Index de préfixes sur les noms de produits
+
+    Attributs :
+        tokens (list): Mots distincts, triés
+        postings (dict): mot -> liste de (-poids, product_id) triée
+        products (dict): product_id -> (nom, poids, mots)
+        stamp (tuple): État de `suggest.stamp` au moment de la construction
+        version (int): Version du catalogue (`CatalogVersion`) prise en compte
+        synced_at (float): Dernière synchronisation avec le journal (monotonic)
+    """
+
+    def __init__(self, rows, stamp=None, version=0):
+        """
+        Args:
+            rows: Itérable de (product_id, nom, poids)
+            stamp (tuple | None): Empreinte de `suggest.stamp` lue avant la lecture des données
+            version (int): Version du catalogue lue avant la lecture des données
+        """
+        self.products = {}
+        self.postings = {}
+        for product_id, name, weight in rows:
+            words = frozenset(tokenize(name))
+            self.products[product_id] = (name, weight, words)
+            for word in words:
+                self.postings.setdefault(word, []).append((-weight, product_id))
+        for entries in self.postings.values():
+            entries.sort()
+        self.tokens = sorted(self.postings)
+        self.stamp = stamp
+        self.version = version
+        self.synced_at = time.monotonic()
+        self._cache = {}
+        self._lock = threading.Lock()  # Sérialise les modifications (lectures sans verrou)
+
+    def __len__(self):
+        return len(self.products)
+
+    def suggest(self, query, limit=8):
+        """
+        Meilleures suggestions pour une saisie
+
+        Les mots complets de la saisie doivent tous figurer dans le nom ; le dernier
+        mot (en cours de frappe) est traité comme un préfixe.
+
+        Returns:
+            list: Liste de (product_id, nom), par poids décroissant
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        key = (' '.join(words), limit)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        *complete, prefix = words
+        lo = bisect_left(self.tokens, prefix)
+        hi = bisect_left(self.tokens, prefix + '\uffff', lo)
+        if complete:
+            result = self._suggest_phrase(complete, prefix, lo, hi, limit)
+        else:
+            # Chaque liste est déjà triée par poids : seuls ses `limit` premiers
+            # éléments peuvent figurer dans le résultat
+            heads = [self.postings.get(token, [])[:limit] for token in self.tokens[lo:hi]]
+            result, seen = [], set()
+            for _, product_id in heapq.merge(*heads):
+                if product_id not in seen:
+                    seen.add(product_id)
+                    result.append(product_id)
+                    if len(result) == limit:
+                        break
+        # `.get` : une modification concurrente a pu retirer un produit entre-temps
+        result = [
+            (product_id, entry[0]) for product_id, entry in
+            ((product_id, self.products.get(product_id)) for product_id in result) if entry is not None
+        ]
+
+        if len(self._cache) >= CACHE_SIZE:
+            self._cache.clear()
+        self._cache[key] = result
+        return result
+
+    def _suggest_phrase(self, complete, prefix, lo, hi, limit):
+        """Saisie de plusieurs mots : parcourt la liste du mot complet le plus rare"""
+        lists = [self.postings.get(word) for word in complete]
+        if not all(lists) or lo == hi:
+            return []
+        rarest = min(lists, key=len)
+        required = set(complete)
+        result = []
+        for _, product_id in list(rarest):
+            entry = self.products.get(product_id)
+            if entry is None:
+                continue
+            words = entry[2]
+            if required <= words and any(word.startswith(prefix) for word in words):
+                result.append(product_id)
+                if len(result) == limit:
+                    break
+        return result
+
+    def upsert(self, product_id, name, weight=None):
+        """Ajoute ou met à jour un produit (le poids existant est conservé par défaut)"""
+        with self._lock:
+            previous = self.products.get(product_id)
+            if weight is None:
+                weight = previous[1] if previous else 0.0
+            if previous is not None:
+                self._discard(product_id, previous)
+            words = frozenset(tokenize(name))
+            self.products[product_id] = (name, weight, words)
+            for word in words:
+                entries = self.postings.get(word)
+                if entries is None:
+                    self.postings[word] = [(-weight, product_id)]
+                    insort(self.tokens, word)
+                else:
+                    insort(entries, (-weight, product_id))
+            self._cache = {}
+
+    def remove(self, product_id):
+        """Retire un produit"""
+        with self._lock:
+            previous = self.products.pop(product_id, None)
+            if previous is not None:
+                self._discard(product_id, previous)
+            self._cache = {}
+
+    def _discard(self, product_id, entry):
+        """Retire les entrées d'un produit des listes de ses mots"""
+        _, weight, words = entry
+        for word in words:
+            entries = self.postings[word]
+            entries.remove((-weight, product_id))
+            if not entries:
+                del self.postings[word]
+                del self.tokens[bisect_left(self.tokens, word)]
+
+
+# =============================================================================
+# INDEX DU PROCESSUS
+# =============================================================================
+_index = None
+_build_lock = threading.Lock()
+_rebuild_thread = None
+
+
+def _stamp():
+    """(mtime, taille) de `suggest.stamp`, (0, 0) s'il n'existe pas"""
+    try:
+        st = STAMP_PATH.stat()
+    except FileNotFoundError:
+        return (0, 0)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _popularity(rating_sum, rating_count):
+    """Poids d'un produit : note moyenne pondérée par le volume d'avis"""
+    if not rating_count:
+        return 0.0
+    return rating_sum / rating_count * math.log1p(rating_count)
+
+
+def _catalog_version():
+    """Dernière version validée du catalogue (0 si aucune modification)"""
+    return CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+
+def _load():
+    """Construit l'index à partir de la base (une requête, sans instances de modèle)"""
+    stamp = _stamp()
+    version = _catalog_version()
+    rows = Product.objects.values_list('id', 'name', 'rating_sum', 'rating_count').iterator(chunk_size=5000)
+    return PrefixIndex(
+        ((product_id, name, _popularity(rating_sum, rating_count))
+         for product_id, name, rating_sum, rating_count in rows),
+        stamp=stamp, version=version,
+    )
+
+
+def _replay(index):
+    """
+    Applique à l'index les modifications journalisées depuis sa version
+
+    Returns:
+        bool: False si le journal ne suffit pas (élagué au-delà de la version,
+            écriture en masse) : l'index doit être reconstruit
+    """
+    version = _catalog_version()
+    if version == index.version:
+        return True
+    changes = list(
+        CatalogChange.objects.filter(version__gt=index.version, version__lte=version)
+        .values_list('product_id', flat=True)
+    )
+    if len(changes) != version - index.version or None in changes:
+        return False
+    changed = set(changes)
+    rows = Product.objects.filter(pk__in=changed).values_list('id', 'name', 'rating_sum', 'rating_count')
+    for product_id, name, rating_sum, rating_count in rows:
+        changed.discard(product_id)
+        index.upsert(product_id, name, _popularity(rating_sum, rating_count))
+    for product_id in changed:
+        index.remove(product_id)
+    index.version = version
+    return True
+
+
+def _rebuild():
+    """Reconstruit l'index en arrière-plan puis le publie"""
+    global _index
+    try:
+        _index = _load()
+    except Exception:
+        logger.exception("Échec de la construction de l'index d'autocomplétion")
+
+
+def _sync():
+    """Synchronise l'index en arrière-plan avec le journal (reconstruit s'il ne suffit pas)"""
+    try:
+        if _replay(_index):
+            return
+    except Exception:
+        logger.exception("Échec de la synchronisation de l'index d'autocomplétion")
+        return
+    _rebuild()
+
+
+def _start(target, name):
+    """Lance une tâche de fond sur l'index, sauf si une autre est en cours"""
+    global _rebuild_thread
+    with _build_lock:
+        if _rebuild_thread is None or not _rebuild_thread.is_alive():
+            _rebuild_thread = threading.Thread(target=target, name=name, daemon=True)
+            _rebuild_thread.start()
+
+
+def get_prefix_index():
+    """
+    Index de préfixes du processus courant, ou None s'il n'est pas encore prêt
+
+    La construction est lancée en arrière-plan au premier appel (la requête
+    n'attend jamais le chargement du catalogue) ; ensuite, si un autre processus
+    a signalé un renommage ou une suppression, l'index est reconstruit de la
+    même façon et l'index actuel continue d'être servi jusqu'à son remplacement.
+    Au plus toutes les `SUGGEST_SYNC_INTERVAL` secondes, les modifications
+    journalisées depuis sa version sont rejouées en arrière-plan.
+    """
+    index = _index
+    if index is None or index.stamp != _stamp():
+        _start(_rebuild, 'suggest-rebuild')
+    elif time.monotonic() - index.synced_at >= getattr(settings, 'SUGGEST_SYNC_INTERVAL', 1.0):
+        index.synced_at = time.monotonic()
+        _start(_sync, 'suggest-sync')
+    return index
+
+
+def suggest(query, limit=8):
+    """Suggestions pour une saisie : liste de (product_id, nom), vide tant que l'index se construit"""
+    index = get_prefix_index()
+    if index is None:
+        return []
+    return index.suggest(query, limit=limit)
+
+
+def _notify(index):
+    """Signale un renommage ou une suppression aux autres processus sans rebuild local"""
+    STAMP_PATH.touch()
+    if index is not None:
+        index.stamp = _stamp()
+
+
+def product_changed(product_id, name):
+    """Produit créé ou enregistré : signalé aux autres processus seulement si son nom change"""
+    index = _index
+    if index is not None:
+        previous = index.products.get(product_id)
+        if previous is not None and previous[0] == name:
+            return
+        index.upsert(product_id, name)
+    _notify(index)
+
+
+def product_removed(product_id):
+    """Produit supprimé"""
+    index = _index
+    if index is not None:
+        index.remove(product_id)
+    _notify(index)
+
+
+def ratings_changed(*product_ids):
+    """
+    Avis ajouté, modifié ou supprimé : nouveau poids des produits concernés
+
+    Les autres processus le reçoivent par le journal (`_sync`), sans reconstruction.
+    """
+    index = _index
+    if index is not None:
+        rows = Product.objects.filter(pk__in=product_ids).values_list('id', 'name', 'rating_sum', 'rating_count')
+        for product_id, name, rating_sum, rating_count in rows:
+            index.upsert(product_id, name, _popularity(rating_sum, rating_count))
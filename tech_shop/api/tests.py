@@ -1,3 +1,1272 @@
-from django.test import TestCase
+"""
+Fichier: api/tests.py
 
-# Create your tests here.
+Description (FR):
+- Tests de l'index TF-IDF (répertoire temporaire, `TfidfStoreMixin`) :
+    index chargé une fois par version publiée, table des voisins précalculée,
+    format `npy` projeté en mémoire (float32 ou int8), build par lots en
+    parallèle identique au build d'un seul lot, versions publiées et élaguées,
+    un seul builder entre processus ; rappel du moteur LSH ;
+    maintenance incrémentale (delta, tombstones), mise en file sans attendre
+    le verrou d'écriture, compaction en arrière-plan ;
+    recommandations d'un produit et d'un ensemble de produits (bornes de `k`) ;
+    recherche classée et repli sur l'ORM quand l'index ne trouve rien.
+- Tests de l'autocomplétion : plages de préfixes, classement par popularité,
+    construction en arrière-plan, poids mis à jour sur place par les avis,
+    rejeu du journal dans les autres processus (sans reconstruction).
+- Tests des agrégats d'avis sur Product (création, déplacement, suppression,
+    chargement par `loaddata`).
+- Tests de l'instantané du catalogue : rafraîchissement incrémental,
+    rechargement complet après une écriture en masse, version lue sur le
+    compteur validé plutôt que sur le journal.
+- Tests des recommandations heuristiques : mots communs, fourchette de prix,
+    complément par les mieux notés, calculées sur l'instantané du catalogue.
+- Tests du nombre de requêtes SQL des listes de commandes et d'avis : chaque
+    endpoint doit exécuter un nombre fixe de requêtes, quel que soit le nombre
+    d'éléments de la page (pas de requête N+1 pour l'auteur d'une commande ou
+    d'un avis).
+- Tests de la pagination par curseur : pages stables malgré les insertions,
+    ex aequo sur la date départagés par l'ID.
+- Tests des champs partiels : liste compacte des produits, `?fields=` limite
+    les champs renvoyés et les colonnes lues, ignoré sur les écritures.
+- Tests des requêtes conditionnelles : `304 Not Modified` sans lire les
+    produits tant que le catalogue n'a pas changé.
+- Tests du cache des réponses : un seul calcul pour une rafale de requêtes
+    sur une clé absente, invalidation par les signaux des avis.
+- Tests du panier par opérations : regroupement des opérations, conflit de
+    version (409 / 412), panier hydraté (`?expand=products`) en deux requêtes.
+- Tests du passage de commande : prix de la base, réservation du stock sans
+    survente, annulation complète si un produit manque, expiration (filtrée
+    par produit en SQL), paiement tardif marqué à rembourser ; lignes
+    `OrderItem` écrites au passage de commande et par le backfill.
+- Tests des recommandations « achetés ensemble » : seules les commandes payées
+    comptent, support minimal, classement par cosinus ; recommandations
+    hybrides sans les sources en retard ou saturées.
+- Lancement : `python manage.py test api`
+"""
+
+import contextlib
+import io
+import json
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import addModuleCleanup, mock, skipUnless
+
+import numpy as np
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from . import catalog, recs_copurchase, recs_hybrid, recs_personal, recs_personal_build, recs_tfidf, suggest
+from .recs_heuristic import heuristic_recommendations
+from .recs_tfidf import TfidfIndex
+from .checkout import confirm_payment, release_expired
+from .models import Cart, CatalogChange, Order, OrderItem, Product, Review
+from .response_cache import cached_response
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-l1'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-l2'},
+}
+
+
+def setUpModule():
+    """
+    Les artefacts écrits par les signaux (delta TF-IDF, `suggest.stamp`...)
+    vont dans un répertoire temporaire, jamais dans `recs_index/`
+    """
+    store = Path(tempfile.mkdtemp())
+    addModuleCleanup(shutil.rmtree, store, True)
+    for module, name, value in (
+        (recs_tfidf, 'STORE_DIR', store), (recs_tfidf, 'CURRENT_PATH', store / 'CURRENT'),
+        (recs_tfidf, 'LOCK_PATH', store / 'build.lock'), (recs_tfidf, '_index', None),
+        (suggest, 'STAMP_PATH', store / 'suggest.stamp'),
+        (recs_copurchase, 'STORE_DIR', store / 'copurchase'), (recs_personal, 'STORE_DIR', store / 'personal'),
+    ):
+        patcher = mock.patch.object(module, name, value)
+        patcher.start()
+        addModuleCleanup(patcher.stop)
+
+
+class TfidfStoreMixin:
+    """Index TF-IDF construit dans un répertoire temporaire (`recs_index/` intact)"""
+
+    def setUp(self):
+        super().setUp()
+        store = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, store, True)
+        for name, value in (
+            ('STORE_DIR', store), ('CURRENT_PATH', store / 'CURRENT'),
+            ('LOCK_PATH', store / 'build.lock'), ('_index', None), ('_maintenance_thread', None),
+            ('_pending', {}), ('_flush_thread', None),
+        ):
+            patcher = mock.patch.object(recs_tfidf, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def build(self, **options):
+        return recs_tfidf.build_index(force=True, workers=1, **options)
+
+    def similar_ids(self, product, k=6, **options):
+        return [pid for pid, _ in recs_tfidf.query_similar(product.pk, k=k, **options)]
+
+
+@override_settings(RECS_TFIDF_AUTO_BUILD=False)
+class TfidfIndexTests(TfidfStoreMixin, TestCase):
+    """Index TF-IDF résident en mémoire et artefacts sur disque"""
+
+    @classmethod
+    def setUpTestData(cls):
+        names = ('Laptop gamer', 'Souris gamer', 'Clavier gamer', 'Casque gamer', 'Robe en soie', 'Jupe en soie')
+        cls.products = [
+            Product.objects.create(name=name, description=name, price='10.00', quantity=1) for name in names
+        ]
+
+    def test_index_is_loaded_once_per_version(self):
+        self.build()
+        with mock.patch.object(recs_tfidf, '_load_index', wraps=recs_tfidf._load_index) as load:
+            for product in self.products:
+                recs_tfidf.query_similar(product.pk)
+            index = recs_tfidf.get_index()
+            self.assertEqual(load.call_count, 1)
+
+            # Version publiée par un autre processus : rechargée au prochain appel
+            self.build()
+            recs_tfidf._index = index
+            self.assertIsNot(recs_tfidf.get_index(), index)
+            self.assertEqual(load.call_count, 2)
+        self.assertEqual(recs_tfidf.get_index().root.name, recs_tfidf.CURRENT_PATH.read_text())
+
+    def test_neighbour_table_matches_exact_engine(self):
+        self.build()
+        exact = {product.pk: recs_tfidf.query_similar(product.pk, k=3) for product in self.products}
+        stats = recs_tfidf.build_neighbours(topk=3, chunk_size=2)
+        self.assertEqual((stats['products'], stats['topk']), (6, 3))
+        self.assertEqual(recs_tfidf.get_index().neighbours_k, 3)
+
+        # Lecture O(k) dans la table : aucun calcul de similarités
+        with mock.patch.object(TfidfIndex, 'similarities', side_effect=AssertionError):
+            for product in self.products:
+                hits = recs_tfidf.query_similar(product.pk, k=3)
+                self.assertEqual({pid for pid, _ in hits}, {pid for pid, _ in exact[product.pk]})
+                scores = [score for _, score in hits]
+                self.assertEqual(scores, sorted(scores, reverse=True))
+                for score, expected in zip(scores, sorted((s for _, s in exact[product.pk]), reverse=True)):
+                    self.assertAlmostEqual(score, expected, places=5)
+
+        # k au-delà de la table : calcul exact
+        self.assertEqual(len(recs_tfidf.query_similar(self.products[0].pk, k=5)), 3)
+        # Un nouveau build publie une version sans table
+        self.build()
+        self.assertEqual(recs_tfidf.get_index().neighbours_k, 0)
+
+    def test_npy_storage_is_memory_mapped(self):
+        self.build(storage='joblib')
+        reference = {product.pk: dict(recs_tfidf.query_similar(product.pk)) for product in self.products}
+
+        for quantize, places in ((None, 5), ('int8', 1)):
+            with self.subTest(quantize=quantize):
+                self.build(storage='npy', quantize=quantize)
+                index = recs_tfidf.get_index()
+                self.assertEqual((index.meta['format'], index.meta['quantization']), ('npy', quantize))
+                # Vue en lecture seule sur le fichier projeté (mmap_mode='r'), pas une copie
+                self.assertFalse(index.matrix.data.flags.writeable)
+                self.assertEqual(index.matrix.data.dtype, np.int8 if quantize else np.float32)
+                for product in self.products:
+                    hits = dict(recs_tfidf.query_similar(product.pk))
+                    self.assertEqual(set(hits), set(reference[product.pk]))
+                    for pid, score in hits.items():
+                        self.assertAlmostEqual(score, reference[product.pk][pid], places=places)
+
+        with self.assertRaises(ValueError):
+            self.build(storage='joblib', quantize='int8')
+
+    def test_sharded_parallel_build_matches_single_shard(self):
+        self.build(shard_size=100)
+        single = recs_tfidf.get_index()
+
+        progress = []
+        stats = recs_tfidf.build_index(force=True, workers=2, shard_size=2, chunk_size=3, progress=progress.append)
+        self.assertEqual((stats['products'], stats['shards'], stats['workers']), (6, 3, 2))
+        self.assertEqual(progress, [2, 4, 6])
+
+        sharded = recs_tfidf.get_index()
+        self.assertEqual(sharded.ids, single.ids)
+        self.assertEqual(sharded.vectorizer.vocabulary_, single.vectorizer.vocabulary_)
+        np.testing.assert_allclose(sharded.matrix.toarray(), single.matrix.toarray(), rtol=1e-6)
+
+    def test_versions_are_published_and_pruned(self):
+        self.build()
+        self.assertIsNone(recs_tfidf.build_index(workers=1))  # Déjà publié, pas de force
+        leftover = Path(tempfile.mkdtemp(prefix='.building-', dir=recs_tfidf.STORE_DIR))  # Build interrompu
+        for _ in range(4):
+            self.build()
+
+        versions = [path.name for path in recs_tfidf._version_dirs()]
+        self.assertEqual(len(versions), recs_tfidf.VERSIONS_KEPT)
+        self.assertEqual(recs_tfidf.CURRENT_PATH.read_text(), versions[-1])
+        self.assertFalse(leftover.exists())
+        self.assertEqual(recs_tfidf.get_index().root.name, versions[-1])
+
+    @skipUnless(recs_tfidf.fcntl, 'flock indisponible')
+    @override_settings(RECS_TFIDF_AUTO_BUILD=True)
+    def test_single_builder_across_processes(self):
+        builds = []
+        with mock.patch.object(recs_tfidf, 'build_index', lambda **options: builds.append(1)), \
+                mock.patch.object(recs_tfidf, '_build_thread', None):
+            # Un autre processus (cron, worker) détient `build.lock` : le thread abandonne
+            with open(recs_tfidf.LOCK_PATH, 'a') as handle:
+                recs_tfidf.fcntl.flock(handle, recs_tfidf.fcntl.LOCK_EX)
+                self.assertFalse(recs_tfidf.index_ready())
+                recs_tfidf._build_thread.join(5)
+                recs_tfidf.fcntl.flock(handle, recs_tfidf.fcntl.LOCK_UN)
+            self.assertEqual(builds, [])
+
+            self.assertTrue(recs_tfidf.request_build())
+            recs_tfidf._build_thread.join(5)
+            self.assertEqual(builds, [1])
+
+
+@override_settings(RECS_TFIDF_AUTO_BUILD=False)
+class TfidfAnnTests(TfidfStoreMixin, TestCase):
+    """Moteur approximatif (LSH) face au moteur exact"""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = np.random.default_rng(0)
+        words = [f'mot{i}' for i in range(60)]
+        Product.objects.bulk_create(
+            Product(name=' '.join(rng.choice(words, 3, replace=False)),
+                    description=' '.join(rng.choice(words, 4, replace=False)), price='10.00', quantity=1)
+            for _ in range(400)
+        )
+
+    def test_recall_against_exact_engine(self):
+        self.build()
+        self.assertIsNone(recs_tfidf.evaluate_ann_recall())  # Pas encore d'index LSH
+        stats = recs_tfidf.build_ann(tables=16, bits=6)
+        self.assertEqual((stats['products'], stats['tables'], stats['bits']), (400, 16, 6))
+
+        report = recs_tfidf.evaluate_ann_recall(k=6, sample=100)
+        self.assertEqual(report['sampled'], 100)
+        self.assertGreaterEqual(report['recall'], 0.9)
+
+        product_id = recs_tfidf.get_index().ids[0]
+        exact = recs_tfidf.query_similar(product_id, k=6, engine='exact')
+        approx = recs_tfidf.query_similar(product_id, k=6, engine='ann')
+        self.assertNotIn(product_id, [pid for pid, _ in approx])
+        self.assertLessEqual(approx[0][1], exact[0][1] + 1e-6)
+
+
+@override_settings(RECS_TFIDF_AUTO_BUILD=False, RECS_TFIDF_REFIT_INTERVAL=0)
+class TfidfIncrementalTests(TfidfStoreMixin, TestCase):
+    """Delta et tombstones de l'index TF-IDF ; compaction hors du thread de la requête"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.laptop = Product.objects.create(name='Laptop gamer', description='Portable gamer', price='900', quantity=1)
+        cls.mouse = Product.objects.create(name='Souris gamer', description='Souris gamer', price='30', quantity=1)
+        cls.dress = Product.objects.create(name='Robe en soie', description='Robe', price='80', quantity=1)
+
+    def setUp(self):
+        super().setUp()
+        self.build()
+
+    def test_upsert_and_remove_are_visible(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            keyboard = Product.objects.create(
+                name='Clavier gamer', description='Clavier gamer', price='50', quantity=1,
+            )
+        self.assertIn(keyboard.pk, self.similar_ids(self.laptop))
+        self.assertTrue(recs_tfidf.get_index().has_delta)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mouse.delete()
+        self.assertNotIn(self.mouse.pk, self.similar_ids(self.laptop))
+        self.assertEqual(recs_tfidf.query_similar(self.mouse.pk), [])
+
+    @skipUnless(recs_tfidf.fcntl, 'flock indisponible')
+    def test_update_is_queued_while_the_index_is_locked(self):
+        # Un autre processus (build, compaction) détient `build.lock` : la requête n'attend pas
+        with open(recs_tfidf.LOCK_PATH, 'a') as handle:
+            recs_tfidf.fcntl.flock(handle, recs_tfidf.fcntl.LOCK_EX)
+            self.assertFalse(recs_tfidf.upsert_product(self.dress.pk, 'Robe gamer'))
+            self.assertFalse(recs_tfidf.remove_product(self.mouse.pk))
+            flush = recs_tfidf._flush_thread
+            self.assertFalse(recs_tfidf.get_index().has_delta)
+            recs_tfidf.fcntl.flock(handle, recs_tfidf.fcntl.LOCK_UN)
+        flush.join(5)
+
+        # Les deux modifications sont écrites en un seul delta
+        ids = self.similar_ids(self.laptop)
+        self.assertIn(self.dress.pk, ids)
+        self.assertNotIn(self.mouse.pk, ids)
+        self.assertEqual(recs_tfidf._pending, {})
+
+    def test_index_of_an_empty_catalogue_is_rebuilt(self):
+        Product.objects.all().delete()
+        self.build()
+        self.assertIsNone(recs_tfidf.get_index().vectorizer)
+        with mock.patch.object(recs_tfidf, 'request_build') as request_build:
+            self.assertTrue(recs_tfidf.upsert_product(self.laptop.pk, 'Laptop gamer'))
+        request_build.assert_called_once_with(force=True)
+
+    @override_settings(RECS_TFIDF_AUTO_BUILD=True, RECS_TFIDF_COMPACT_THRESHOLD=0.5)
+    def test_compaction_runs_in_background(self):
+        threads = []
+        compact = recs_tfidf.compact_index
+
+        def record_thread():
+            threads.append(threading.current_thread().name)
+            return compact()
+
+        with mock.patch.object(recs_tfidf, 'compact_index', record_thread):
+            with self.captureOnCommitCallbacks(execute=True):
+                Product.objects.create(name='Clavier gamer', description='Clavier', price='50', quantity=1)
+            self.assertIsNone(recs_tfidf._maintenance_thread)  # Dérive 1/3 : sous le seuil
+            with self.captureOnCommitCallbacks(execute=True):
+                Product.objects.create(name='Casque gamer', description='Casque', price='60', quantity=1)
+            recs_tfidf._maintenance_thread.join(5)
+
+        self.assertEqual(threads, ['recs-tfidf-maintenance'])
+        index = recs_tfidf.get_index()
+        self.assertFalse(index.has_delta)
+        self.assertEqual(index.base_size, 5)
+
+
+@override_settings(RECS_TFIDF_AUTO_BUILD=False, RESPONSE_CACHE_ENABLED=False)
+class TfidfRecommendationTests(TfidfStoreMixin, TestCase):
+    """Recommandations TF-IDF d'un produit et d'un ensemble de produits"""
+
+    @classmethod
+    def setUpTestData(cls):
+        names = ('Laptop gamer', 'Souris gamer', 'Clavier gamer', 'Casque gamer', 'Robe en soie', 'Jupe en soie')
+        cls.products = [
+            Product.objects.create(name=name, description=name, price='10.00', quantity=1) for name in names
+        ]
+
+    def setUp(self):
+        super().setUp()
+        self.build()
+        self.client = APIClient()
+
+    def test_batch_excludes_inputs(self):
+        laptop, mouse = self.products[:2]
+        for merge in ('max', 'centroid'):
+            with self.subTest(merge=merge):
+                response = self.client.post(
+                    f'/api/products/recommendations_tfidf/?k=2&merge={merge}',
+                    {'items': [{'product_id': laptop.pk, 'quantity': 1}, {'product_id': mouse.pk, 'quantity': 2}]},
+                    format='json',
+                )
+                data = response.json()
+                self.assertEqual(data['source'], 'tfidf')
+                self.assertEqual({item['id'] for item in data['recommendations']}, {p.pk for p in self.products[2:4]})
+
+        # Articles du frontend, identifiés par `id`
+        response = self.client.post(
+            '/api/products/recommendations_tfidf/?k=2',
+            {'items': [{'id': laptop.pk, 'quantity': 1}, {'id': mouse.pk, 'quantity': 2}]}, format='json',
+        )
+        ids = {item['id'] for item in response.json()['recommendations']}
+        self.assertEqual(ids, {p.pk for p in self.products[2:4]})
+
+        expected = [pid for pid, _ in recs_tfidf.query_similar_many([laptop.pk, mouse.pk], k=2)]
+        data = self.client.get(f'/api/products/recommendations_tfidf/?ids={laptop.pk},{mouse.pk}&k=2').json()
+        self.assertEqual([item['id'] for item in data['recommendations']], expected)
+
+    def test_k_is_validated_and_clamped(self):
+        laptop = self.products[0]
+        for url, params in (
+            (f'/api/products/{laptop.pk}/recommendations_tfidf/', {}),
+            ('/api/products/recommendations_tfidf/', {'ids': laptop.pk}),
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url, {**params, 'k': 'abc'})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'detail': 'k must be an integer.'})
+                self.assertEqual(self.client.get(url, {**params, 'k': -3}).json()['count'], 1)
+                self.assertEqual(self.client.get(url, {**params, 'k': 100000}).json()['count'], 3)
+
+
+@override_settings(RECS_TFIDF_AUTO_BUILD=False, RESPONSE_CACHE_ENABLED=False)
+class ProductSearchTests(TfidfStoreMixin, TestCase):
+    """Recherche classée par l'index TF-IDF, repli ORM si l'index ne trouve rien"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.laptop = Product.objects.create(name='Laptop gamer', description='Portable gamer rapide', price='900', quantity=1)
+        cls.mouse = Product.objects.create(name='Souris gamer', description='Souris sans fil', price='30', quantity=1)
+        cls.dress = Product.objects.create(name='Robe en soie', description='Robe de soirée', price='80', quantity=1)
+
+    def setUp(self):
+        super().setUp()
+        self.build()
+
+    def search(self, query):
+        return APIClient().get('/api/products/search/', {'q': query}).json()
+
+    def test_ranked_by_tfidf(self):
+        response = self.search('laptop gamer')
+        self.assertEqual(response['engine'], 'tfidf')
+        self.assertEqual([item['id'] for item in response['results']], [self.laptop.pk, self.mouse.pk])
+        self.assertGreater(response['results'][0]['score'], response['results'][1]['score'])
+
+    def test_unknown_terms_fall_back_to_orm(self):
+        # « soi » n'est pas un terme de l'index mais un fragment de « soie »
+        self.assertIsNone(recs_tfidf.search_products('soi'))
+        response = self.search('soi')
+        self.assertEqual(response['engine'], 'orm')
+        self.assertEqual([item['id'] for item in response['results']], [self.dress.pk])
+
+
+@override_settings(SUGGEST_SYNC_INTERVAL=3600)  # Pas de synchronisation en arrière-plan imprévue
+class SuggestTests(TestCase):
+    """Index de préfixes de l'autocomplétion"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reviewer', password='password')
+        cls.laptop = Product.objects.create(name='Laptop gamer', description='Portable', price='900', quantity=1)
+        cls.lamp = Product.objects.create(name='Lampe de bureau', description='Lampe', price='20', quantity=1)
+        cls.plate = Product.objects.create(name='Plateau', description='Plateau', price='15', quantity=1)
+        Review.objects.create(product=cls.lamp, user=cls.user, rating=3)
+
+    def setUp(self):
+        store = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, store, True)
+        for name, value in (('STAMP_PATH', store / 'suggest.stamp'), ('_index', None), ('_rebuild_thread', None)):
+            patcher = mock.patch.object(suggest, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_prefix_ranges_and_ordering(self):
+        index = suggest.PrefixIndex([(1, 'Laptop gamer', 2.0), (2, 'Lampe gamer', 5.0), (3, 'Plateau', 9.0)])
+        self.assertEqual(index.suggest('la'), [(2, 'Lampe gamer'), (1, 'Laptop gamer')])
+        self.assertEqual(index.suggest('lap'), [(1, 'Laptop gamer')])
+        self.assertEqual(index.suggest('gamer la', limit=1), [(2, 'Lampe gamer')])
+        self.assertEqual(index.suggest('z'), [])
+
+        index.upsert(1, 'Laptop gamer', 7.0)
+        index.remove(2)
+        self.assertEqual(index.suggest('la'), [(1, 'Laptop gamer')])
+        self.assertEqual(index.suggest('p'), [(3, 'Plateau')])
+
+    def test_first_request_does_not_wait_for_the_build(self):
+        ready = suggest.PrefixIndex([(self.laptop.pk, self.laptop.name, 0.0)], stamp=suggest._stamp())
+        with mock.patch.object(suggest, '_load', return_value=ready):
+            self.assertEqual(suggest.suggest('lap'), [])
+            suggest._rebuild_thread.join(5)
+        self.assertEqual(suggest.suggest('lap'), [(self.laptop.pk, 'Laptop gamer')])
+
+    def test_review_updates_weight_in_place(self):
+        index = suggest._index = suggest._load()
+        self.assertEqual([pid for pid, _ in index.suggest('la')], [self.lamp.pk, self.laptop.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(product=self.laptop, user=self.user, rating=5)
+        self.assertEqual([pid for pid, _ in index.suggest('la')], [self.laptop.pk, self.lamp.pk])
+        # Pas de reconstruction, ni locale ni dans les autres processus
+        self.assertFalse(suggest.STAMP_PATH.exists())
+        self.assertIs(suggest.get_prefix_index(), index)
+        self.assertIsNone(suggest._rebuild_thread)
+
+        # Renommage : signalé aux autres processus ; autre enregistrement : non
+        self.laptop.price = Decimal('800.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.laptop.save()
+        self.assertFalse(suggest.STAMP_PATH.exists())
+        self.laptop.name = 'Laptop pro'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.laptop.save()
+        self.assertTrue(suggest.STAMP_PATH.exists())
+        self.assertIs(suggest.get_prefix_index(), index)
+
+    def test_other_process_replays_the_journal(self):
+        index = suggest._index = suggest._load()
+        self.assertEqual([pid for pid, _ in index.suggest('la')], [self.lamp.pk, self.laptop.pk])
+
+        # Avis écrit par un autre processus : seul le journal le signale
+        with self.captureOnCommitCallbacks(execute=False):
+            Review.objects.create(product=self.laptop, user=self.user, rating=5)
+        with mock.patch.object(suggest, '_load') as load, CaptureQueriesContext(connection) as queries:
+            suggest._sync()
+        load.assert_not_called()
+        self.assertEqual(len(queries), 3)  # Version, journal, produits modifiés
+        self.assertEqual([pid for pid, _ in index.suggest('la')], [self.laptop.pk, self.lamp.pk])
+        self.assertEqual(index.version, catalog.current_state()[0])
+
+        # Écriture en masse : le journal ne suffit pas, reconstruction
+        catalog.record_change()
+        with mock.patch.object(suggest, '_load', return_value=index) as load:
+            suggest._sync()
+        load.assert_called_once()
+
+
+class RatingAggregateTests(TestCase):
+    """`Product.rating_count` / `rating_sum` suivent les écritures d'avis"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reviewer', password='password')
+        cls.other = User.objects.create_user('second', password='password')
+        cls.laptop = Product.objects.create(name='Laptop', description='Portable', price='900', quantity=1)
+        cls.phone = Product.objects.create(name='Phone', description='Mobile', price='100', quantity=1)
+
+    def aggregates(self, product):
+        product.refresh_from_db()
+        return product.rating_count, product.rating_sum
+
+    def test_create_move_and_delete(self):
+        review = Review.objects.create(product=self.laptop, user=self.user, rating=4)
+        Review.objects.create(product=self.laptop, user=self.other, rating=2)
+        self.assertEqual(self.aggregates(self.laptop), (2, 6))
+
+        review.rating = 5
+        review.save()
+        self.assertEqual(self.aggregates(self.laptop), (2, 7))
+
+        review.product = self.phone
+        review.save()
+        self.assertEqual((self.aggregates(self.laptop), self.aggregates(self.phone)), ((1, 2), (1, 5)))
+
+        review.delete()
+        self.assertEqual(self.aggregates(self.phone), (0, 0))
+
+    def test_loaddata_review_is_counted_and_deletable(self):
+        fixture = Path(tempfile.mkdtemp()) / 'reviews.json'
+        self.addCleanup(shutil.rmtree, fixture.parent, True)
+        fixture.write_text(json.dumps([{
+            'model': 'api.review', 'pk': 9001,
+            'fields': {
+                'product': self.laptop.pk, 'user': self.user.pk, 'rating': 3, 'comment': '',
+                'created_at': '2026-01-01T00:00:00Z', 'updated_at': '2026-01-01T00:00:00Z',
+            },
+        }]))
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('loaddata', str(fixture), verbosity=0)
+        self.assertEqual(self.aggregates(self.laptop), (1, 3))
+
+        # Rechargement du même avis : recalcul, pas de double comptage
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('loaddata', str(fixture), verbosity=0)
+        self.assertEqual(self.aggregates(self.laptop), (1, 3))
+
+        Review.objects.get(pk=9001).delete()
+        self.assertEqual(self.aggregates(self.laptop), (0, 0))
+        # Retrait d'un avis jamais compté : ignoré, pas d'erreur de contrainte
+        Review.objects.create(product=self.laptop, user=self.user, rating=4)
+        Product.objects.filter(pk=self.laptop.pk).update(rating_count=0, rating_sum=0)
+        Review.objects.get(product=self.laptop).delete()
+        self.assertEqual(self.aggregates(self.laptop), (0, 0))
+
+
+class CatalogSnapshotMixin:
+    """Instantané du catalogue propre à chaque test (la base est annulée entre les tests)"""
+
+    def setUp(self):
+        super().setUp()
+        for name, value in (('_snapshot', None), ('_stale', False), ('_checked_at', 0.0)):
+            patcher = mock.patch.object(catalog, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class CatalogSnapshotTests(CatalogSnapshotMixin, TestCase):
+    """Instantané en colonnes, rafraîchi à partir du journal des modifications"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.laptop = Product.objects.create(name='Laptop gamer', description='', price=Decimal('900.00'), quantity=3)
+        cls.dress = Product.objects.create(name='Robe en soie', description='', price=Decimal('80.50'), quantity=1)
+
+    def test_incremental_refresh(self):
+        snapshot = catalog.get_snapshot()
+        self.assertEqual(snapshot.price_cents.tolist(), [90000, 8050])
+
+        with mock.patch.object(catalog, '_load', wraps=catalog._load) as load:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.dress.name = 'Robe en lin'
+                self.dress.price = Decimal('60.00')
+                self.dress.save()
+            refreshed = catalog.get_snapshot()
+            self.assertEqual(load.call_count, 0)  # Seul le produit modifié est relu
+
+            self.assertGreater(refreshed.version, snapshot.version)
+            self.assertEqual(snapshot.price_cents.tolist(), [90000, 8050])  # Ancien instantané intact
+            self.assertEqual(refreshed.price_cents.tolist(), [90000, 6000])
+            self.assertEqual(refreshed.rows_with_tokens({'lin'}).tolist(), [1])
+            self.assertEqual(refreshed.rows_with_tokens({'soie'}).tolist(), [])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.laptop.delete()
+            refreshed = catalog.get_snapshot()
+            self.assertIsNone(refreshed.row_of(self.laptop.pk))
+            self.assertEqual(len(refreshed), 1)
+
+            # Écriture en masse : rechargement complet
+            with self.captureOnCommitCallbacks(execute=True):
+                catalog.record_change()
+            catalog.get_snapshot()
+            self.assertEqual(load.call_count, 1)
+
+    def test_version_follows_the_committed_counter(self):
+        snapshot = catalog.get_snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            first = catalog.record_change(self.laptop.pk)
+            second = catalog.record_change(self.dress.pk)
+        self.assertEqual((first.version, second.version), (snapshot.version + 1, snapshot.version + 2))
+        self.assertEqual(catalog.current_state()[0], second.version)
+        refreshed = catalog.get_snapshot()
+        self.assertEqual(refreshed.version, second.version)
+
+        # Ligne du journal au-delà du compteur (transaction concurrente non
+        # validée) : ni la version ni l'instantané n'avancent
+        CatalogChange.objects.create(product_id=self.dress.pk, version=second.version + 1)
+        Product.objects.filter(pk=self.dress.pk).update(price=Decimal('1.00'))
+        catalog.mark_stale()
+        self.assertIs(catalog.get_snapshot(), refreshed)
+        self.assertEqual(catalog.current_state()[0], second.version)
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class HeuristicRecommendationTests(CatalogSnapshotMixin, TestCase):
+    """Mots communs, fourchette de prix, puis complément par les mieux notés"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('reviewer', password='password')
+
+        def create(name, price):
+            return Product.objects.create(name=name, description=name, price=Decimal(price), quantity=1)
+
+        cls.base = create('Laptop gamer', '100.00')
+        cls.mouse = create('Souris gamer', '100.00')  # Mot commun + prix : 3
+        cls.keyboard = create('Clavier gamer', '500.00')  # Mot commun : 2
+        cls.lamp = create('Lampe', '130.00')  # Prix (borne incluse) : 1
+        cls.dress = create('Robe', '20.00')  # Mieux notée
+        cls.skirt = create('Jupe', '20.00')  # Sans avis
+        cls.cheap = create('Stylo', '69.99')  # Hors fourchette, sans avis
+        Review.objects.create(product=cls.dress, user=user, rating=5)
+
+    def test_scores_then_top_rated(self):
+        recommended = heuristic_recommendations(self.base, limit=6)
+        self.assertEqual(
+            [p.pk for p in recommended],
+            [self.mouse.pk, self.keyboard.pk, self.lamp.pk, self.dress.pk, self.skirt.pk, self.cheap.pk],
+        )
+        self.assertEqual([p.pk for p in heuristic_recommendations(self.base, limit=2)], [self.mouse.pk, self.keyboard.pk])
+
+    def test_endpoint_reads_the_snapshot(self):
+        url = f'/api/products/{self.base.pk}/recommendations/'
+        client = APIClient()
+        client.get(url)  # Charge l'instantané
+        # Version du catalogue (ETag), produit de référence, produits recommandés
+        with self.assertNumQueries(3):
+            response = client.get(url)
+        self.assertEqual([item['id'] for item in response.json()][:3], [self.mouse.pk, self.keyboard.pk, self.lamp.pk])
+        self.assertEqual(client.get('/api/products/999999/recommendations/').status_code, 404)
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class ListingQueryCountTests(TestCase):
+    """Nombre de requêtes constant sur les listes de commandes et d'avis"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.product = Product.objects.create(name='Laptop', description='Portable', price='999.00', quantity=5)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def _add_items(self, count):
+        """
+        Ajoute `count` commandes et `count` avis, chacun d'un utilisateur distinct,
+        ainsi que `count` avis de l'administrateur (sur d'autres produits)
+        """
+        start = User.objects.count()
+        for i in range(start, start + count):
+            user = User.objects.create_user(f'user{i}', password='password')
+            Order.objects.create(
+                user=user, address='1 rue', city='Niamey', country='Niger',
+                products=[{'product_id': self.product.pk, 'quantity': 1, 'price': '999.00'}],
+            )
+            Review.objects.create(product=self.product, user=user, rating=4, comment='Bien')
+            other = Product.objects.create(name=f'Phone {i}', description='Mobile', price='199.00', quantity=3)
+            Review.objects.create(product=other, user=self.admin, rating=5, comment='Parfait')
+
+    def assertConstantQueries(self, url, queries):
+        """La page renvoie plus d'éléments sans exécuter plus de requêtes"""
+        for count in (1, 7):
+            self._add_items(count)
+            with self.subTest(url=url, items_added=count), self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_admin_order_list(self):
+        # COUNT(*) + page de commandes jointe aux utilisateurs
+        self.assertConstantQueries('/api/admin_view_orders/', 2)
+
+    def test_user_order_list(self):
+        self.assertConstantQueries('/api/user_view_orders/', 2)
+
+    def test_user_order_detail(self):
+        order = Order.objects.create(user=self.admin, address='1 rue', city='Niamey', country='Niger')
+        self.assertConstantQueries(f'/api/orders/{order.pk}/', 1)
+
+    def test_product_review_list(self):
+        # Version du catalogue (ETag) + avis joints aux utilisateurs
+        self.assertConstantQueries(f'/products/{self.product.pk}/reviews/', 2)
+
+    def test_review_viewset_list(self):
+        self.assertConstantQueries(f'/reviews/?product_id={self.product.pk}', 2)
+
+    def test_my_reviews(self):
+        self.assertConstantQueries('/reviews/my_review/', 1)
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class CursorPaginationTests(TestCase):
+    """`?cursor=` : pages stables malgré les insertions, sans COUNT(*)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def walk(self, client, url, between_pages):
+        """IDs de toutes les pages ; `between_pages(n)` est appelée après la page n"""
+        seen, pages = [], 0
+        while url:
+            data = client.get(url).json()
+            self.assertNotIn('count', data)
+            seen.extend(item['id'] for item in data['results'])
+            url = data['next']
+            pages += 1
+            between_pages(pages)
+        return seen
+
+    def test_products_stable_across_inserts(self):
+        products = [
+            Product.objects.create(name=f'Produit {i}', description='', price='10.00', quantity=1) for i in range(12)
+        ]
+
+        def insert(pages):
+            if pages == 1:
+                Product.objects.create(name='Nouveau', description='', price='10.00', quantity=1)
+
+        client = APIClient()
+        seen = self.walk(client, '/products/?cursor=', insert)
+        self.assertEqual(seen, [product.pk for product in reversed(products)])
+
+        # Retour en arrière depuis la deuxième page : la première page
+        first = client.get('/products/?cursor=').json()
+        second = client.get(first['next']).json()
+        self.assertEqual(client.get(second['previous']).json()['results'], first['results'])
+        self.assertEqual(client.get('/products/?cursor=cD1ub3QtanNvbg==').status_code, 404)  # p=not-json
+
+    def test_orders_with_equal_dates(self):
+        created_at = timezone.now()
+        orders = [
+            Order.objects.create(user=self.admin, address='1 rue', city='Niamey', country='Niger') for _ in range(11)
+        ]
+        Order.objects.update(created_at=created_at)  # Ex aequo : départagés par l'ID
+
+        def insert(pages):
+            Order.objects.create(user=self.admin, address='1 rue', city='Niamey', country='Niger')
+
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        seen = self.walk(client, '/api/admin_view_orders/?cursor=', insert)
+        self.assertEqual(seen, [order.pk for order in reversed(orders)])
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class SparseFieldsetTests(TestCase):
+    """Représentation compacte des listes et `?fields=` sur les lectures"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reviewer', password='password')
+        cls.product = Product.objects.create(name='Laptop', description='x' * 500, price='999.00', quantity=5)
+        Review.objects.create(product=cls.product, user=cls.user, rating=4, comment='Bien')
+
+    def test_product_list_is_compact(self):
+        item = APIClient().get('/products/').json()['results'][0]
+        self.assertNotIn('description', item)
+        self.assertEqual(item['summary'], 'x' * 120)
+        self.assertEqual(item['average_rating'], 4)
+
+    def test_fields_restrict_payload_and_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get('/products/', {'fields': 'id,name,unknown'})
+        self.assertEqual(list(response.json()['results'][0]), ['id', 'name'])
+        select = next(q['sql'] for q in queries.captured_queries if 'FROM "api_product"' in q['sql'] and 'LIMIT' in q['sql'])
+        self.assertNotIn('"price"', select)
+        self.assertNotIn('"description"', select)  # `summary` non demandé : pas de SUBSTR
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        review = client.get('/reviews/', {'fields': 'id,rating'}).json()['results'][0]
+        self.assertEqual(review, {'id': review['id'], 'rating': 4})
+
+    def test_fields_ignored_on_writes(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        other = Product.objects.create(name='Phone', description='Mobile', price='100.00', quantity=1)
+        response = client.post('/reviews/?fields=id', {'product': other.pk, 'rating': 5, 'comment': 'Top'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('rating', response.json())
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class ConditionalGetTests(TestCase):
+    """ETag / 304 sur les endpoints publics du catalogue"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Laptop', description='Portable', price='999.00', quantity=5)
+
+    def test_not_modified_until_catalog_changes(self):
+        client = APIClient()
+        response = client.get('/products/')
+        etag = response['ETag']
+
+        # Seule la version du catalogue est lue : aucune requête sur les produits
+        with self.assertNumQueries(1):
+            response = client.get('/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.product.quantity = 4
+        self.product.save()
+        response = client.get('/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ResponseCacheTests(TestCase):
+    """Cache L1/L2 des réponses publiques"""
+
+    def setUp(self):
+        for alias in ('default', 'shared'):
+            caches[alias].clear()
+
+    def test_single_flight(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)  # Calcul lent : les autres requêtes arrivent pendant ce temps
+            return Response({'ok': True})
+
+        request = APIRequestFactory().get('/products/')
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cached_response(request, 'test', (1,), compute)))
+            for _ in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([response.data for response in results], [{'ok': True}] * 20)
+
+    def test_reviews_invalidated_by_signals(self):
+        user = User.objects.create_user('reviewer', password='password')
+        product = Product.objects.create(name='Laptop', description='Portable', price='999.00', quantity=5)
+        client = APIClient()
+        client.force_authenticate(user)
+        url = f'/products/{product.pk}/reviews/'
+        self.assertEqual(client.get(url).json(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(product=product, user=user, rating=5, comment='Parfait')
+        self.assertEqual([review['rating'] for review in client.get(url).json()], [5])
+
+
+class CartPatchTests(TestCase):
+    """PATCH du panier : opérations atomiques et concurrence optimiste"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='password')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def patch(self, ops, **extra):
+        return self.client.patch('/api/cart/', {'ops': ops}, format='json', **extra)
+
+    def test_ops_are_coalesced_into_one_write(self):
+        response = self.patch([
+            {'op': 'add', 'product_id': 1, 'name': 'Laptop', 'price': '999.00'},
+            {'op': 'add', 'product_id': 1, 'quantity': 2},
+            {'op': 'add', 'product_id': 2},
+            {'op': 'set', 'product_id': 2, 'quantity': 0},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], 1)
+        self.assertEqual(response.data['items'], [
+            {'product_id': 1, 'id': 1, 'name': 'Laptop', 'price': '999.00', 'quantity': 3},
+        ])
+
+        # Aucune écriture (ni nouvelle version) si le panier final est identique
+        response = self.patch([{'op': 'remove', 'product_id': 2}])
+        self.assertEqual(response.data['version'], 1)
+
+    def test_stale_version_is_rejected(self):
+        etag = self.client.get('/api/cart/')['ETag']
+        Cart.objects.filter(user=self.user).update(items=[{'id': 5, 'quantity': 1}], version=1)
+
+        response = self.patch([{'op': 'clear'}], HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response.data['version'], 1)
+        response = self.client.patch('/api/cart/', {'ops': [{'op': 'clear'}], 'version': 0}, format='json')
+        self.assertEqual(response.status_code, 409)
+
+        response = self.patch([{'op': 'add', 'product_id': 5}], HTTP_IF_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['items'], [{'id': 5, 'quantity': 2}])
+
+    def test_invalid_op(self):
+        self.assertEqual(self.patch([{'op': 'set', 'product_id': 1, 'quantity': -1}]).status_code, 400)
+
+    def test_expand_products(self):
+        laptop = Product.objects.create(name='Laptop', description='Portable', price='999.99', quantity=5)
+        phone = Product.objects.create(name='Phone', description='Mobile', price='0.10', quantity=2)
+        sold_out = Product.objects.create(name='Tablet', description='Tablette', price='300.00', quantity=0)
+        Cart.objects.update_or_create(user=self.user, defaults={'items': [
+            {'id': laptop.pk, 'quantity': 2, 'price': '999.99'},
+            {'product_id': phone.pk, 'quantity': 3, 'price': '0.20'},
+            {'id': sold_out.pk, 'quantity': 1},
+            {'id': 999999, 'quantity': 1},
+        ]})
+
+        # Panier + produits (une requête `id__in`)
+        with self.assertNumQueries(2):
+            data = self.client.get('/api/cart/?expand=products').data
+        self.assertEqual(
+            [(line['status'], line['line_total'], line['price_changed']) for line in data['lines']],
+            [('ok', '1999.98', False), ('insufficient_stock', '0.30', True),
+             ('out_of_stock', '300.00', False), ('deleted', None, False)],
+        )
+        self.assertEqual(data['total'], '2000.28')
+        self.assertEqual(data['item_count'], 5)
+        self.assertTrue(data['has_issues'])
+
+
+class CheckoutTests(TestCase):
+    """Passage de commande : prix serveur, réservation et libération du stock"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='password')
+        cls.laptop = Product.objects.create(name='Laptop', description='Portable', price='999.99', quantity=5)
+        cls.phone = Product.objects.create(name='Phone', description='Mobile', price='0.10', quantity=1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def order(self, products):
+        return self.client.post('/api/orders/new/', {
+            'address': '1 rue', 'city': 'Niamey', 'country': 'Niger', 'products': products,
+        }, format='json')
+
+    def stock(self, product):
+        product.refresh_from_db()
+        return product.quantity
+
+    def test_prices_come_from_database(self):
+        response = self.order([
+            {'id': self.laptop.pk, 'quantity': 2, 'price': 0.01},
+            {'id': self.phone.pk, 'quantity': 1, 'price': 0.01},
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('2000.08'))
+        self.assertEqual([item['price'] for item in response.data['products']], ['999.99', '0.10'])
+        self.assertEqual((self.stock(self.laptop), self.stock(self.phone)), (3, 0))
+        self.assertEqual(
+            sorted(OrderItem.objects.values_list('product_id', 'quantity', 'unit_price')),
+            [(self.laptop.pk, 2, Decimal('999.99')), (self.phone.pk, 1, Decimal('0.10'))],
+        )
+
+    def test_missing_stock_cancels_whole_order(self):
+        response = self.order([{'id': self.laptop.pk, 'quantity': 1}, {'id': self.phone.pk, 'quantity': 2}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((self.stock(self.laptop), self.stock(self.phone)), (5, 1))
+        self.assertFalse(Order.objects.exists())
+
+    def test_expired_reservation_is_released_once(self):
+        order_id = self.order([{'id': self.phone.pk, 'quantity': 1}]).data['id']
+        Order.objects.filter(pk=order_id).update(reserved_until=timezone.now() - timedelta(minutes=1))
+
+        # Le stock retenu par la réservation expirée sert le nouvel acheteur
+        self.assertEqual(self.order([{'id': self.phone.pk, 'quantity': 1}]).status_code, 201)
+        self.assertEqual(Order.objects.get(pk=order_id).status, Order.CANCELLED)
+        self.assertEqual(release_expired(), 0)
+        self.assertEqual(self.stock(self.phone), 0)
+
+        # Paiement tardif : plus de stock, paiement enregistré mais commande annulée
+        self.assertFalse(confirm_payment(Order.objects.get(pk=order_id), 'pi_late'))
+        self.assertEqual(self.stock(self.phone), 0)
+        self.assertTrue(Order.objects.get(pk=order_id).refund_required)
+
+    def test_release_filters_products_before_the_batch(self):
+        laptop_id = self.order([{'id': self.laptop.pk, 'quantity': 1}]).data['id']
+        phone_id = self.order([{'id': self.phone.pk, 'quantity': 1}]).data['id']
+        now = timezone.now()
+        Order.objects.filter(pk=laptop_id).update(reserved_until=now - timedelta(minutes=2))
+        Order.objects.filter(pk=phone_id).update(reserved_until=now - timedelta(minutes=1))
+
+        # La commande du laptop, plus ancienne, n'occupe pas l'unique place du lot
+        self.assertEqual(release_expired(product_ids=[self.phone.pk], limit=1), 1)
+        self.assertEqual(Order.objects.get(pk=phone_id).status, Order.CANCELLED)
+        self.assertEqual(Order.objects.get(pk=laptop_id).status, Order.PENDING)
+
+    def test_late_ipaymoney_payment_is_flagged_for_refund(self):
+        order_id = self.order([{'id': self.phone.pk, 'quantity': 1}]).data['id']
+        Order.objects.filter(pk=order_id).update(reserved_until=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.order([{'id': self.phone.pk, 'quantity': 1}]).status_code, 201)
+
+        with self.assertLogs('api.views', level='ERROR'), contextlib.redirect_stdout(io.StringIO()):
+            response = self.client.post('/api/ipaymoney/callback/', {
+                'external_reference': f'TECHSHOP-{order_id}-1', 'status': 'succeeded', 'reference': 'ipay-late',
+            }, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(response.json()['success'])
+        order = Order.objects.get(pk=order_id)
+        self.assertEqual((order.status, order.payment_completed, order.refund_required), (Order.CANCELLED, True, True))
+
+    def test_status_changes_only_through_checkout(self):
+        order_id = self.order([{'id': self.phone.pk, 'quantity': 1}]).data['id']
+        url = f'/api/orders/{order_id}/'
+        for status in (Order.COMPLETED, 'SHIPPED'):
+            self.assertEqual(self.client.patch(url, {'status': status}, format='json').status_code, 400)
+        self.client.patch(url, {'payment_completed': True}, format='json')
+        self.assertEqual(Order.objects.get(pk=order_id).status, Order.PENDING)
+        self.assertFalse(Order.objects.get(pk=order_id).payment_completed)
+
+        # Annulation demandée par le client : le stock réservé est rendu
+        self.assertEqual(self.client.patch(url, {'status': Order.CANCELLED}, format='json').status_code, 200)
+        self.assertEqual(self.stock(self.phone), 1)
+
+        # Une commande annulée ne redevient pas PENDING : le stock reste à l'autre acheteur
+        other_id = self.order([{'id': self.phone.pk, 'quantity': 1}]).data['id']
+        self.assertEqual(self.client.patch(url, {'status': Order.PENDING}, format='json').status_code, 400)
+        self.assertFalse(confirm_payment(Order.objects.get(pk=order_id), 'pi_replay'))
+        self.assertEqual(self.stock(self.phone), 0)
+        self.assertEqual(Order.objects.get(pk=other_id).status, Order.PENDING)
+
+    def test_backfill_order_items(self):
+        def legacy_order(products):
+            # Commande antérieure à `OrderItem` : lignes uniquement en JSON
+            return Order.objects.create(
+                user=self.user, address='1 rue', city='Niamey', country='Niger', total_price=1, products=products,
+            )
+
+        legacy = [
+            legacy_order([
+                {'id': self.laptop.pk, 'quantity': 1, 'price': 899.5},
+                {'id': self.laptop.pk, 'quantity': 2, 'price': 899.5},
+                {'id': 424242, 'quantity': 1, 'price': '10'},  # Produit supprimé depuis
+                {'name': 'sans ID', 'quantity': 1},
+            ]),
+            legacy_order([{'product_id': self.phone.pk, 'quantity': 4, 'price': 'n/a'}]),
+        ]
+        for _ in range(2):  # Rejouable
+            call_command('backfill_order_items', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(
+            sorted(OrderItem.objects.values_list('order_id', 'product_id', 'quantity', 'unit_price')),
+            [(legacy[0].pk, self.laptop.pk, 3, Decimal('899.50')), (legacy[0].pk, 424242, 1, Decimal('10.00')),
+             (legacy[1].pk, self.phone.pk, 4, Decimal('0.00'))],
+        )
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class CopurchaseTests(TestCase):
+    """Table des co-achats construite à partir des commandes payées"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='password')
+        cls.a, cls.b, cls.c, cls.d = [
+            Product.objects.create(name=name, description='Produit', price='10.00', quantity=100)
+            for name in ('Laptop', 'Souris', 'Sacoche', 'Tapis')
+        ]
+
+    def setUp(self):
+        store = tempfile.TemporaryDirectory()
+        self.addCleanup(store.cleanup)
+        patcher = mock.patch.object(recs_copurchase, 'STORE_DIR', Path(store.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def orders(self, products, count, status=Order.COMPLETED):
+        for _ in range(count):
+            order = Order.objects.create(
+                user=self.user, address='1 rue', city='Niamey', country='Niger', status=status, total_price=1,
+            )
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product=product, quantity=1, unit_price='10.00') for product in products
+            )
+
+    def test_bought_together(self):
+        self.orders([self.a, self.b], 3)
+        self.orders([self.a, self.c], 2)
+        self.orders([self.a, self.d], 1)  # Sous le support minimal
+        self.orders([self.a, self.d], 5, status=Order.PENDING)  # Non payées : ignorées
+        self.orders([self.b, self.c], 2)
+        recs_copurchase.build_table(measure='cosine', topk=5, min_support=2, chunk_orders=4)
+
+        # A : 6 commandes, B : 5, C : 4 ; cos(A, B) = 3/√30 > cos(A, C) = 2/√24
+        data = APIClient().get(f'/api/products/{self.a.pk}/recommendations_copurchase/').json()
+        self.assertEqual([product['id'] for product in data['recommendations']], [self.b.pk, self.c.pk])
+        self.assertEqual(data['source'], 'copurchase')
+        self.assertEqual(recs_copurchase.query_copurchase(self.d.pk), [])
+
+    @override_settings(RECS_HYBRID_BUDGET_MS=50)
+    def test_hybrid_skips_slow_source(self):
+        self.orders([self.a, self.b], 3)
+        self.orders([self.a, self.c], 2)
+        recs_copurchase.build_table(measure='cosine', topk=5, min_support=2)
+
+        def slow_tfidf(product_id, k):
+            time.sleep(0.5)
+            return [(self.d.pk, 1.0)]
+
+        with mock.patch.dict(recs_hybrid._INDEXED_SOURCES, {'tfidf': slow_tfidf}):
+            response = APIClient().get(f'/api/products/{self.a.pk}/recommendations_hybrid/?k=2')
+        data = response.json()
+        self.assertEqual([product['id'] for product in data['recommendations']], [self.b.pk, self.c.pk])
+        self.assertEqual(data['sources']['tfidf'], 'timeout')
+        self.assertEqual(data['sources']['copurchase'], 'ok')
+        self.assertTrue(data['degraded'])
+        self.assertEqual(response['Cache-Control'], 'no-store')
+
+    def test_hybrid_skips_saturated_source(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        calls = []
+
+        def stuck_tfidf(product_id, k):
+            calls.append(product_id)
+            release.wait(5)
+            return []
+
+        with mock.patch.dict(recs_hybrid._INDEXED_SOURCES, {'tfidf': stuck_tfidf}):
+            self.assertIsNone(recs_hybrid.hybrid_recommendations(0, budget_ms=10))  # Rien n'est soumis
+            states = [
+                recs_hybrid.hybrid_recommendations(self.a.pk, budget_ms=10)[1]['tfidf']
+                for _ in range(recs_hybrid.MAX_IN_FLIGHT_PER_SOURCE + 1)
+            ]
+        self.assertEqual(states, ['timeout'] * recs_hybrid.MAX_IN_FLIGHT_PER_SOURCE + ['busy'])
+        self.assertNotIn(0, calls)
+
+        # Les requêtes bloquées terminées, la source est de nouveau interrogée
+        release.set()
+        deadline = time.monotonic() + 5
+        with mock.patch.dict(recs_hybrid._INDEXED_SOURCES, {'tfidf': stuck_tfidf}):
+            while recs_hybrid.hybrid_recommendations(self.a.pk, budget_ms=100)[1]['tfidf'] != 'empty':
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+
+
+class PersonalRecommendationsTests(TestCase):
+    """Recommandations personnalisées précalculées et repli sur les produits populaires"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = User.objects.create_user('buyer', password='password')
+        cls.newcomer = User.objects.create_user('newcomer', password='password')
+        cls.products = [
+            Product.objects.create(name=name, description=name, price='10.00', quantity=100)
+            for name in ('Laptop gamer', 'Souris gamer', 'Clavier gamer', 'Robe en soie', 'Jupe en soie')
+        ]
+        order = Order.objects.create(
+            user=cls.buyer, address='1 rue', city='Niamey', country='Niger', status=Order.COMPLETED, total_price=1,
+        )
+        OrderItem.objects.create(order=order, product=cls.products[0], quantity=1, unit_price='10.00')
+
+    def setUp(self):
+        store = tempfile.TemporaryDirectory()
+        self.addCleanup(store.cleanup)
+        vectorizer = TfidfVectorizer()
+        matrix = vectorizer.fit_transform(product.name for product in self.products)
+        index = TfidfIndex(vectorizer, matrix, [product.pk for product in self.products], signature=None)
+        for patcher in (
+            mock.patch.object(recs_personal, 'STORE_DIR', Path(store.name)),
+            mock.patch.object(recs_personal, 'get_index', return_value=index),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def recommendations(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get('/api/me/recommendations/?k=3').json()
+
+    def test_profile_and_popular_fallback(self):
+        stats = recs_personal.build_table(topn=3, workers=1)
+        self.assertEqual(stats['users'], 1)
+        laptop, mouse, keyboard = self.products[:3]
+
+        data = self.recommendations(self.buyer)
+        self.assertEqual(data['source'], 'personal')
+        ids = [product['id'] for product in data['recommendations']]
+        self.assertEqual(set(ids[:2]), {mouse.pk, keyboard.pk})  # Produit acheté exclu
+        self.assertNotIn(laptop.pk, ids)
+
+        data = self.recommendations(self.newcomer)
+        self.assertEqual(data['source'], 'popular')
+        self.assertEqual(data['recommendations'][0]['id'], laptop.pk)  # Le plus vendu
+
+    def test_guest_orders_are_ignored(self):
+        guest_order = Order.objects.create(
+            user=None, address='1 rue', city='Niamey', country='Niger', status=Order.COMPLETED, total_price=1,
+        )
+        OrderItem.objects.create(order=guest_order, product=self.products[3], quantity=1, unit_price='10.00')
+        stats = recs_personal.build_table(topn=3, workers=1)
+        self.assertEqual(stats['users'], 1)
+        self.assertEqual(self.recommendations(self.buyer)['source'], 'personal')
+
+    def test_neutral_review_is_excluded(self):
+        reviewer = User.objects.create_user('reviewer', password='password')
+        laptop, mouse, keyboard = self.products[:3]
+        Review.objects.create(product=mouse, user=reviewer, rating=5)
+        Review.objects.create(product=keyboard, user=reviewer, rating=3)  # Poids nul, mais déjà noté
+        recs_personal.build_table(topn=3, workers=1)
+
+        ids = [product['id'] for product in self.recommendations(reviewer)['recommendations']]
+        self.assertEqual(ids[0], laptop.pk)
+        self.assertNotIn(keyboard.pk, ids)
+        self.assertNotIn(mouse.pk, ids)
+
+    def test_scores_by_bounded_blocks(self):
+        reviewer = User.objects.create_user('reviewer', password='password')
+        Review.objects.create(product=self.products[3], user=reviewer, rating=5)
+        recs_personal.build_table(topn=3, workers=1)
+        expected = [self.recommendations(user) for user in (self.buyer, reviewer)]
+
+        # Budget minimal : un utilisateur par bloc, même résultat
+        with mock.patch.object(recs_personal_build, 'SCORE_BLOCK_BYTES', 1):
+            recs_personal.build_table(topn=3, workers=1)
+        self.assertEqual([self.recommendations(user) for user in (self.buyer, reviewer)], expected)
@@ -6,12 +6,23 @@ Description (FR):
 - Endpoints principaux fournis ici :
     - Gestion des utilisateurs (inscription, détail, dashboard)
     - CRUD produits (vues admin et liste publique)
-    - Panier (CartView) : récupération et mise à jour du panier d'un utilisateur (JSON)
+    - Recherche de produits classée par pertinence TF-IDF (`ProductSearchView`) et
+      autocomplétion servie depuis un index de préfixes en mémoire (`ProductSuggestView`)
+    - Panier (CartView) : récupération du panier d'un utilisateur (JSON) et mise à
+      jour par opérations (PATCH) avec concurrence optimiste sur sa version
     - Commandes (Order) : création et listing des commandes
     - Avis (Review) : création et consultation des avis sur les produits
-    - Recommandations : heuristiques simples (`ProductRecommendations`) et TF-IDF (`TFIDFRecommendations`)
+    - Recommandations : heuristiques simples (`ProductRecommendations`) et TF-IDF (`TFIDFRecommendations`,
+      `TFIDFBatchRecommendations` pour un ensemble de produits comme un panier),
+      co-achats issus de l'historique des commandes (`CopurchaseRecommendations`),
+      et leur mélange pondéré sous budget de latence (`HybridRecommendations`),
+      recommandations personnalisées précalculées chaque nuit (`MyRecommendations`)
     - Endpoints de paiement Stripe (create_payment_intent, mark_order_paid)
     - Endpoints de paiement IpayMoney (ipaymoney_callback, verify_ipaymoney_payment)
+- Les endpoints publics du catalogue et des recommandations répondent `304 Not
+    Modified` tant que le catalogue n'a pas changé (voir `api/conditional.py`).
+- Les listes de produits et de commandes renvoient une représentation compacte ;
+    `?fields=a,b` restreint les champs renvoyés et les colonnes lues en base.
 
 Comment ces fichiers se connectent :
 - Utilise les serializers définis dans `api/serialzers.py` pour valider et renvoyer les données.
@@ -25,9 +36,11 @@ Comment ces fichiers se connectent :
 # =============================================================================
 from django.shortcuts import redirect
 from django.db.models import Q
+from django.db.models.functions import Left
 from django.contrib.auth.models import User
 from rest_framework import generics, viewsets, status
 from .serialzers import UserSerializer, ProductSerializer, CartSerializer, OrderSerializer, ReviewSerializer
+from .serialzers import ProductListSerializer, OrderListSerializer, requested_fields, restrict_columns
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from allauth.socialaccount.models import SocialToken, SocialAccount
 from django.contrib.auth.decorators import login_required
@@ -38,17 +51,30 @@ from django.http import JsonResponse
 from rest_framework.response import Response
 from django.views.decorators.csrf import csrf_exempt
 import json
+import logging
 import stripe
 import requests
 from django.conf import settings
 
 from rest_framework.decorators import action
 from rest_framework.views import APIView
+from rest_framework.utils.urls import replace_query_param
 from django.forms import ValidationError
 
 from .models import Product, Cart, Order, Review
-from .recs_tfidf import query_similar
-
+from .recs_tfidf import query_similar, query_similar_many, search_products, index_ready, MERGE_MODES
+from .suggest import suggest
+from .pagination import OptInCursorPagination, EstimatedCountPagination
+from .conditional import catalog_conditional, copurchase_conditional, recommendations_conditional
+from .checkout import cancel_order, confirm_payment
+from .cart import CartConflict, CartOpError, hydrate_items, item_product_id, patch_cart, replace_cart, validate_ops
+from .response_cache import cached_response, catalog_version, index_version, product_generation
+from .recs_heuristic import heuristic_recommendations
+from .recs_copurchase import query_copurchase, table_state as copurchase_table_state
+from .recs_hybrid import hybrid_recommendations
+from .recs_personal import personal_recommendations
+
+logger = logging.getLogger(__name__)
 
 # =============================================================================
 # CONFIGURATION STRIPE
@@ -93,61 +119,160 @@ class UserDashboardView(generics.GenericAPIView):
         
         return Response(user_data)
 
+# =============================================================================
+# CHAMPS PARTIELS (?fields=)
+# =============================================================================
+class SparseFieldsetViewMixin:
+    """Ne lit en base que les colonnes des champs renvoyés (voir `?fields=`)"""
+
+    def get_queryset(self):
+        return restrict_columns(super().get_queryset(), self.get_serializer_class(), self.request)
+
 # =============================================================================
 # VUES PRODUITS
 # =============================================================================
-class AdminProductView(generics.ListCreateAPIView):
+SUMMARY_LENGTH = 120  # Caractères de description renvoyés dans la grille du catalogue
+
+class AdminProductView(SparseFieldsetViewMixin, generics.ListCreateAPIView):
     """Endpoint réservé aux admins pour gérer le catalogue produits"""
     permission_classes = [IsAdminUser]  # Uniquement pour les administrateurs
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
 
-class AdminEditProductView(generics.RetrieveUpdateDestroyAPIView):
+class AdminEditProductView(SparseFieldsetViewMixin, generics.RetrieveUpdateDestroyAPIView):
     """Endpoint admin pour modifier ou supprimer un produit spécifique"""
     permission_classes = [IsAdminUser]
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
 
-class ProductView(generics.ListAPIView):
-    """Endpoint public pour afficher tous les produits"""
+    @catalog_conditional
+    def get(self, request, *args, **kwargs):
+        """Détail d'un produit (304 si le catalogue n'a pas changé)"""
+        return super().get(request, *args, **kwargs)
+
+class ProductView(SparseFieldsetViewMixin, generics.ListAPIView):
+    """Endpoint public pour afficher tous les produits (représentation compacte)"""
     # Tri par ID décroissant pour afficher les produits récents en premier
     queryset = Product.objects.all().order_by('-id')
-    serializer_class = ProductSerializer
+    serializer_class = ProductListSerializer
     permission_classes = [AllowAny]  # Accessible sans connexion
+    pagination_class = OptInCursorPagination  # ?page=N ou ?cursor= (keyset sur l'ID)
+    cursor_ordering = ('-id',)
+
+    def get_queryset(self):
+        """Seul le début de la description est lu (`summary`), et seulement s'il est renvoyé"""
+        queryset = super().get_queryset()
+        fields = requested_fields(self.request)
+        if fields is None or 'summary' in fields:
+            queryset = queryset.annotate(summary=Left('description', SUMMARY_LENGTH))
+        return queryset
+
+    @catalog_conditional
+    def get(self, request, *args, **kwargs):
+        """Page de produits (304 si le catalogue n'a pas changé, sinon servie depuis le cache)"""
+        compute = super().get
+        return cached_response(
+            request, 'products', (catalog_version(request),), lambda: compute(request, *args, **kwargs)
+        )
 
 # =============================================================================
 # RECHERCHE DE PRODUITS
 # ============================================================================
 
 class ProductSearchView(APIView):
-    """Endpoint pour la recherche de produits"""
+    """
+    Endpoint pour la recherche de produits, classée par pertinence et paginée
+
+    GET /api/products/search/?q=laptop&page=1&page_size=8
+
+    - Moteur 'tfidf' (`settings.PRODUCT_SEARCH_ENGINE`, par défaut) : la requête
+      est vectorisée avec le vectoriseur TF-IDF des recommandations et comparée
+      aux produits via l'index inversé ; chaque résultat porte son `score`.
+    - Moteur 'orm' : `icontains` sur le nom et la description, triés par
+      nouveauté (`score` nul) ; utilisé aussi tant que l'index n'est pas construit
+      et quand aucun terme de la requête n'est connu de l'index.
+    """
     permission_classes = [AllowAny]
-    
+    max_page_size = 50  # Borne le coût d'une page
+
     def get(self, request):
+        query = request.GET.get('q', '').strip()
+        try:
+            page = int(request.GET.get('page', 1))
+            page_size = int(request.GET.get('page_size', settings.REST_FRAMEWORK['PAGE_SIZE']))
+        except ValueError:
+            return Response({'detail': 'page and page_size must be integers.'}, status=400)
+        page = max(page, 1)
+        page_size = min(max(page_size, 1), self.max_page_size)
+        offset = (page - 1) * page_size
+
         try:
-            query = request.GET.get('q', '').strip()
-            print(f"🔍 Recherche: '{query}'")  # Debug
-            
             if not query or len(query) < 2:
-                return Response([])
-            
-            # Recherche dans les noms et descriptions
-            products = Product.objects.filter(
-                Q(name__icontains=query) | 
-                Q(description__icontains=query) |
-                Q(category__icontains=query)
-            )[:10]
-            
-            print(f"✅ {products.count()} produits trouvés")  # Debug
-            serializer = ProductSerializer(products, many=True)
-            return Response(serializer.data)
-            
+                return self._page(request, 'none', 0, [], [], page, page_size)
+
+            found = None
+            if getattr(settings, 'PRODUCT_SEARCH_ENGINE', 'tfidf') == 'tfidf':
+                found = search_products(query, offset=offset, limit=page_size)
+            if found is not None:
+                total, hits = found
+                products = _products_in_order([pid for pid, _ in hits])
+                scores = [score for _, score in hits]
+                return self._page(request, 'tfidf', total, products, scores, page, page_size)
+
+            # Recherche dans les noms et descriptions (sans classement)
+            matches = Product.objects.filter(
+                Q(name__icontains=query) |
+                Q(description__icontains=query)
+            ).order_by('-id')
+            total = matches.count()
+            products = list(matches[offset:offset + page_size])
+            return self._page(request, 'orm', total, products, [None] * len(products), page, page_size)
+
         except Exception as e:
             print(f"❌ Erreur dans ProductSearchView: {str(e)}")
             import traceback
             print(f"📋 Stack trace: {traceback.format_exc()}")
             return Response({"error": str(e)}, status=500)
 
+    def _page(self, request, engine, total, products, scores, page, page_size):
+        """Réponse paginée au format de `PageNumberPagination`, avec les scores"""
+        url = request.build_absolute_uri()
+        results = ProductSerializer(products, many=True).data
+        for item, score in zip(results, scores):
+            item['score'] = score
+        return Response({
+            'count': total,
+            'next': replace_query_param(url, 'page', page + 1) if page * page_size < total else None,
+            'previous': replace_query_param(url, 'page', page - 1) if page > 1 else None,
+            'engine': engine,
+            'results': results,
+        })
+
+class ProductSuggestView(APIView):
+    """
+    Autocomplétion de la barre de recherche
+
+    GET /api/products/suggest/?q=lap&limit=8
+
+    Servie depuis l'index de préfixes en mémoire (`api/suggest.py`), sans
+    requête en base : suggestions classées par popularité (notes des avis).
+    Liste vide le temps que le processus construise son index (démarrage).
+    """
+    permission_classes = [AllowAny]
+    max_limit = 20
+
+    def get(self, request):
+        query = request.GET.get('q', '').strip()
+        try:
+            limit = min(max(int(request.GET.get('limit', 8)), 1), self.max_limit)
+        except ValueError:
+            return Response({'detail': 'limit must be an integer.'}, status=400)
+        hits = suggest(query, limit=limit) if query else []
+        return Response({
+            'query': query,
+            'suggestions': [{'id': product_id, 'name': name} for product_id, name in hits],
+        })
+
 # =============================================================================
 # VUE PANIER
 # =============================================================================
@@ -161,23 +286,85 @@ class CartView(generics.RetrieveUpdateAPIView):
         cart, created = Cart.objects.get_or_create(user=self.request.user)
         return cart
     
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Contenu du panier ; l'ETag porte sa version (à renvoyer dans `If-Match`)
+
+        Avec `?expand=products`, ajoute les lignes résolues (produit, prix
+        courant, total de ligne, statut de stock) et le total du panier.
+        """
+        response = super().retrieve(request, *args, **kwargs)
+        if request.query_params.get('expand') == 'products':
+            response.data.update(hydrate_items(response.data['items'], request))
+        response['ETag'] = f'"{response.data["version"]}"'
+        return response
+
+    def _expected_version(self, request):
+        """
+        Version imposée par le client : en-tête `If-Match` (412 si périmée) ou
+        champ `version` du corps (409 si périmée) ; None si aucune
+        """
+        if_match = (request.headers.get('If-Match') or '').strip()
+        if if_match and if_match != '*':
+            return int(if_match.removeprefix('W/').strip('"')), status.HTTP_412_PRECONDITION_FAILED
+        version = request.data.get('version') if isinstance(request.data, dict) else None
+        if version is not None:
+            return int(version), status.HTTP_409_CONFLICT
+        return None, None
+
+    def _cart_response(self, cart, status_code=status.HTTP_200_OK, **extra):
+        response = Response({'success': status_code == status.HTTP_200_OK, 'items': cart.items,
+                             'version': cart.version, **extra}, status=status_code)
+        response['ETag'] = f'"{cart.version}"'
+        return response
+
     def put(self, request, *args, **kwargs):
-        """Met à jour le contenu du panier"""
-        cart = self.get_object()
-        cart.items = request.data.get('items', [])  # Format JSON des articles
-        cart.save()
-        return Response({'success': True, 'items': cart.items})
+        """Remplace le contenu du panier (préférer PATCH pour les modifications)"""
+        items = request.data.get('items', [])  # Format JSON des articles
+        if not isinstance(items, list):
+            return Response({'detail': 'items must be a list.'}, status=400)
+        try:
+            expected, conflict_status = self._expected_version(request)
+        except (TypeError, ValueError):
+            return Response({'detail': 'version must be an integer.'}, status=400)
+        try:
+            cart = replace_cart(request.user, items, expected)
+        except CartConflict as exc:
+            return self._cart_response(exc.cart, conflict_status, detail='Cart was modified concurrently.')
+        return self._cart_response(cart)
+
+    def patch(self, request, *args, **kwargs):
+        """
+        Applique des opérations au panier, en une écriture atomique
+
+        Corps : {"ops": [{"op": "add" | "set" | "remove" | "clear", "product_id": 1,
+        "quantity": 2}, ...], "version": 7 (optionnel)} ; voir `api/cart.py`.
+        """
+        try:
+            ops = validate_ops(request.data.get('ops') if isinstance(request.data, dict) else None)
+            expected, conflict_status = self._expected_version(request)
+        except CartOpError as exc:
+            return Response({'detail': str(exc)}, status=400)
+        except (TypeError, ValueError):
+            return Response({'detail': 'version must be an integer.'}, status=400)
+        try:
+            cart = patch_cart(request.user, ops, expected)
+        except CartConflict as exc:
+            return self._cart_response(exc.cart, conflict_status, detail='Cart was modified concurrently.')
+        return self._cart_response(cart)
 
 # =============================================================================
 # VUES COMMANDES
 # =============================================================================
-class AdminOrderView(generics.ListAPIView):
-    """Endpoint admin pour voir toutes les commandes"""
+class AdminOrderView(SparseFieldsetViewMixin, generics.ListAPIView):
+    """Endpoint admin pour voir toutes les commandes (représentation compacte)"""
     permission_classes = [IsAdminUser]
-    queryset = Order.objects.all().order_by('-created_at')  # Plus récentes d'abord
-    serializer_class = OrderSerializer
+    queryset = Order.objects.select_related('user').order_by('-created_at', '-id')  # Plus récentes d'abord
+    serializer_class = OrderListSerializer
+    pagination_class = EstimatedCountPagination  # ?cursor= et ?count=estimated possibles
+    cursor_ordering = ('-created_at', '-id')
 
-class UserOrderView(generics.RetrieveUpdateDestroyAPIView):
+class UserOrderView(SparseFieldsetViewMixin, generics.RetrieveUpdateDestroyAPIView):
     """Endpoint pour voir/modifier/supprimer une commande utilisateur"""
     permission_classes = [IsAuthenticated]
     serializer_class = OrderSerializer
@@ -185,7 +372,12 @@ class UserOrderView(generics.RetrieveUpdateDestroyAPIView):
     
     def get_queryset(self):
         """Filtre pour n'afficher que les commandes de l'utilisateur connecté"""
-        return Order.objects.filter(user=self.request.user)
+        return Order.objects.filter(user=self.request.user).select_related('user')
+
+    def perform_destroy(self, instance):
+        """Une commande impayée supprimée rend son stock réservé"""
+        cancel_order(instance)
+        instance.delete()
 
 class UserOrderCreateView(generics.CreateAPIView):
     """Endpoint pour créer une nouvelle commande"""
@@ -196,32 +388,38 @@ class UserOrderCreateView(generics.CreateAPIView):
         """Associe automatiquement l'utilisateur connecté à la commande"""
         serializer.save(user=self.request.user)
 
-class UserOrderListView(generics.ListAPIView):
-    """Endpoint pour lister les commandes de l'utilisateur"""
-    serializer_class = OrderSerializer
+class UserOrderListView(SparseFieldsetViewMixin, generics.ListAPIView):
+    """Endpoint pour lister les commandes de l'utilisateur (représentation compacte)"""
+    serializer_class = OrderListSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OptInCursorPagination  # ?page=N ou ?cursor= (keyset sur la date)
+    cursor_ordering = ('-created_at', '-id')
     
     def get_queryset(self):
         """Les admins voient toutes les commandes, les users seulement les leurs"""
+        orders = Order.objects.select_related('user').order_by('-created_at', '-id')
         if self.request.user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(user=self.request.user)
+            return orders
+        return orders.filter(user=self.request.user)
 
 # =============================================================================
 # VUES AVIS (REVIEWS)
 # =============================================================================
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(SparseFieldsetViewMixin, viewsets.ModelViewSet):
     """ViewSet complet pour la gestion des avis (CRUD)"""
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OptInCursorPagination  # ?page=N ou ?cursor= (keyset sur la date)
+    cursor_ordering = ('-created_at', '-id')
     
     def get_queryset(self):
         """Filtre les avis par produit si l'ID est spécifié"""
+        reviews = Review.objects.select_related('user').order_by('-created_at', '-id')
         product_id = self.request.query_params.get('product_id')
         if product_id:
-            return Review.objects.filter(product_id=product_id)
-        return Review.objects.all()
+            return reviews.filter(product_id=product_id)
+        return reviews
     
     def perform_create(self, serializer):
         """Associe automatiquement l'utilisateur connecté à l'avis"""
@@ -234,15 +432,22 @@ class ReviewViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def my_review(self, request):
         """Action personnalisée pour récupérer les avis de l'utilisateur connecté"""
-        reviews = Review.objects.filter(user=request.user)
+        reviews = Review.objects.filter(user=request.user).select_related('user')
         serializer = self.get_serializer(reviews, many=True)
         return Response(serializer.data)
 
 class ProductReviewList(APIView):
     """Endpoint pour lister tous les avis d'un produit spécifique"""
+    @catalog_conditional
     def get(self, request, product_id):
-        reviews = Review.objects.filter(product_id=product_id).order_by('-created_at')
-        serializer = ReviewSerializer(reviews, many=True)
+        """Avis du produit, en cache jusqu'à la prochaine modification de ses avis"""
+        versions = (product_id, product_generation(product_id))
+        return cached_response(request, 'reviews', versions, lambda: self._list(request, product_id))
+
+    def _list(self, request, product_id):
+        reviews = Review.objects.filter(product_id=product_id).select_related('user').order_by('-created_at')
+        reviews = restrict_columns(reviews, ReviewSerializer, request)
+        serializer = ReviewSerializer(reviews, many=True, context={'request': request})
         return Response(serializer.data)
 
 # =============================================================================
@@ -252,69 +457,27 @@ class ProductRecommendations(APIView):
     """
     Retourne une liste de produits recommandés basée sur des heuristiques simples
     
-    Heuristiques utilisées :
-    - Produits partageant des mots communs dans le nom (overlap de tokens)
+    Heuristiques utilisées (voir `api/recs_heuristic.py`) :
+    - Produits partageant des mots communs dans le nom
     - Produits dans une fourchette de prix de +/-30%
-    - Fallback vers les produits les mieux notés
+    - Fallback vers les produits les mieux notés (agrégats stockés)
+    Calculées sur l'instantané en mémoire du catalogue (`api/catalog.py`).
     """
     permission_classes = [AllowAny]  # Accessible sans authentification
 
+    @catalog_conditional
     def get(self, request, product_id):
+        """Recommandations, en cache pour la version courante du catalogue"""
+        versions = (product_id, catalog_version(request))
+        return cached_response(request, 'recs-heuristic', versions, lambda: self._recommend(product_id))
+
+    def _recommend(self, product_id):
         try:
             base = Product.objects.get(id=product_id)  # Produit de référence
         except Product.DoesNotExist:
             return Response({'detail': 'Product not found.'}, status=404)
 
-        # Extraction des tokens du nom du produit
-        tokens = set([t.lower() for t in base.name.split() if len(t) > 2])
-
-        # Calcul de la fourchette de prix
-        try:
-            price = float(base.price)
-        except Exception:
-            price = None
-
-        similar = []  # Liste des produits similaires avec score
-
-        # 1) Correspondance par tokens dans le nom
-        if tokens:
-            qs = Product.objects.exclude(id=base.id)
-            for p in qs:
-                name_tokens = set([t.lower() for t in p.name.split() if len(t) > 2])
-                if tokens & name_tokens:  # Intersection de tokens
-                    similar.append((p, 2))  # Poids 2 pour correspondance token
-
-        # 2) Proximité de prix
-        if price is not None:
-            low = price * 0.7
-            high = price * 1.3
-            price_qs = Product.objects.exclude(id=base.id).filter(price__gte=low, price__lte=high)
-            for p in price_qs:
-                # Augmente le poids si déjà présent
-                found = next((i for i, (obj, w) in enumerate(similar) if obj.id == p.id), None)
-                if found is not None:
-                    similar[found] = (similar[found][0], similar[found][1] + 1)
-                else:
-                    similar.append((p, 1))
-
-        # 3) Fallback: produits les mieux notés
-        if len(similar) < 6:
-            rated = []
-            for p in Product.objects.exclude(id=base.id):
-                avg = p.average_rating() or 0
-                rated.append((p, avg))
-            rated.sort(key=lambda x: x[1], reverse=True)  # Tri par note décroissante
-            for p, _ in rated:
-                if not any(obj.id == p.id for obj, _ in similar):
-                    similar.append((p, 0))
-                if len(similar) >= 6:
-                    break
-
-        # Tri par poids décroissant puis par ID récent
-        similar.sort(key=lambda x: (x[1], x[0].id), reverse=True)
-
-        # Sélection des 6 premiers produits
-        recommended = [p for p, _ in similar[:6]]
+        recommended = heuristic_recommendations(base)
 
         serializer = ProductSerializer(recommended, many=True)
         return Response(serializer.data)
@@ -323,25 +486,211 @@ class TFIDFRecommendations(APIView):
     """Recommandations basées sur l'algorithme TF-IDF (similarité textuelle)"""
     permission_classes = [AllowAny]
 
+    @recommendations_conditional
     def get(self, request, product_id):
+        """Recommandations, en cache pour la version du catalogue et de l'index"""
+        versions = (product_id, catalog_version(request), index_version())
+        return cached_response(request, 'recs-tfidf', versions, lambda: self._recommend(request, product_id))
+
+    def _recommend(self, request, product_id):
         try:
             base = Product.objects.get(id=product_id)
         except Product.DoesNotExist:
             return Response({'detail': 'Product not found.'}, status=404)
 
-        k = int(request.query_params.get('k', 6))  # Nombre de recommandations
+        try:
+            k = max(1, min(int(request.query_params.get('k', 6)), 50))  # Nombre de recommandations
+        except ValueError:
+            return Response({'detail': 'k must be an integer.'}, status=400)
         hits = query_similar(product_id, k=k)  # Appel au système TF-IDF
+        if not hits and not index_ready():
+            # Index en cours de construction : repli sur les heuristiques
+            serializer = ProductSerializer(heuristic_recommendations(base, limit=k), many=True)
+            return Response({
+                'recommendations': serializer.data,
+                'count': len(serializer.data),
+                'source': 'heuristic'
+            })
         ids = [pid for pid, score in hits]  # Extraction des IDs
-        products = list(Product.objects.filter(id__in=ids))
-        # Préservation de l'ordre de similarité
-        products_sorted = sorted(products, key=lambda p: ids.index(p.id))
-        serializer = ProductSerializer(products_sorted, many=True)
+        serializer = ProductSerializer(_products_in_order(ids), many=True)
         return Response({
             'recommendations': serializer.data, 
             'count': len(serializer.data), 
             'source': 'tfidf'
         })
 
+class TFIDFBatchRecommendations(APIView):
+    """
+    Recommandations TF-IDF pour un ensemble de produits (panier, commande, liste)
+
+    - GET  /api/products/recommendations_tfidf/?ids=1,2,3&k=6&merge=max
+    - POST /api/products/recommendations_tfidf/ avec {"product_ids": [...]} ou
+      {"items": [{"product_id": 1, "quantity": 2}, ...]} (format de `Cart.items`,
+      articles du frontend identifiés par `id` acceptés)
+
+    Une seule requête HTTP et une seule opération matricielle remplacent un
+    appel par produit ; les produits d'entrée sont exclus du résultat.
+    """
+    permission_classes = [AllowAny]
+    max_inputs = 50  # Borne le coût d'une requête
+
+    @recommendations_conditional
+    def get(self, request):
+        raw = request.query_params.get('ids', '')
+        try:
+            product_ids = [int(pid) for pid in raw.split(',') if pid.strip()]
+        except ValueError:
+            return Response({'detail': 'ids must be a comma-separated list of integers.'}, status=400)
+        return self._recommend(request, product_ids)
+
+    def post(self, request):
+        data = request.data if isinstance(request.data, dict) else {}
+        if 'items' in data:
+            raw = [item_product_id(item) for item in data.get('items') or []]
+        else:
+            raw = data.get('product_ids') or []
+        try:
+            product_ids = [int(pid) for pid in raw if pid is not None]
+        except (TypeError, ValueError):
+            return Response({'detail': 'product_ids must be a list of integers.'}, status=400)
+        return self._recommend(request, product_ids)
+
+    def _recommend(self, request, product_ids):
+        """Calcule et sérialise les recommandations pour la liste d'IDs"""
+        if not product_ids:
+            return Response({'detail': 'At least one product id is required.'}, status=400)
+        if len(product_ids) > self.max_inputs:
+            return Response({'detail': f'At most {self.max_inputs} product ids are allowed.'}, status=400)
+
+        try:
+            k = max(1, min(int(request.query_params.get('k', 6)), 50))  # Nombre de recommandations
+        except ValueError:
+            return Response({'detail': 'k must be an integer.'}, status=400)
+        merge = request.query_params.get('merge', 'max')  # 'max' ou 'centroid'
+        if merge not in MERGE_MODES:
+            return Response({'detail': f"merge must be one of {', '.join(MERGE_MODES)}."}, status=400)
+
+        hits = query_similar_many(product_ids, k=k, merge=merge)
+        if not hits and not index_ready():
+            # Index en cours de construction : heuristiques du premier produit connu
+            inputs = set(product_ids)
+            known = _products_in_order(product_ids)
+            recommended = heuristic_recommendations(known[0], limit=k + len(inputs)) if known else []
+            recommended = [p for p in recommended if p.id not in inputs][:k]
+            serializer = ProductSerializer(recommended, many=True)
+            return Response({
+                'recommendations': serializer.data,
+                'count': len(serializer.data),
+                'source': 'heuristic'
+            })
+        ids = [pid for pid, score in hits]
+        serializer = ProductSerializer(_products_in_order(ids), many=True)
+        return Response({
+            'recommendations': serializer.data,
+            'count': len(serializer.data),
+            'source': 'tfidf'
+        })
+
+
+class CopurchaseRecommendations(APIView):
+    """
+    Produits souvent achetés avec un produit (« achetés ensemble »)
+
+    Servis depuis la table de co-achats construite hors ligne à partir des
+    commandes payées (`manage.py build_copurchase_recs`, `api/recs_copurchase.py`).
+    """
+    permission_classes = [AllowAny]
+
+    @copurchase_conditional
+    def get(self, request, product_id):
+        """Recommandations, en cache pour la version du catalogue et de la table"""
+        versions = (product_id, catalog_version(request), copurchase_table_state())
+        return cached_response(request, 'recs-copurchase', versions, lambda: self._recommend(request, product_id))
+
+    def _recommend(self, request, product_id):
+        if not Product.objects.filter(id=product_id).exists():
+            return Response({'detail': 'Product not found.'}, status=404)
+        try:
+            k = max(1, min(int(request.query_params.get('k', 6)), 50))  # Nombre de recommandations
+        except ValueError:
+            return Response({'detail': 'k must be an integer.'}, status=400)
+        hits = query_copurchase(product_id, k=k)
+        serializer = ProductSerializer(_products_in_order([pid for pid, score in hits]), many=True)
+        return Response({
+            'recommendations': serializer.data,
+            'count': len(serializer.data),
+            'source': 'copurchase'
+        })
+
+
+class HybridRecommendations(APIView):
+    """
+    Recommandations hybrides : voisins TF-IDF, co-achats, gamme de prix et
+    meilleures notes, classés par un score pondéré (`RECS_HYBRID_WEIGHTS`)
+
+    Les index TF-IDF et co-achats disposent de `RECS_HYBRID_BUDGET_MS` ; une
+    source en retard, saturée ou en échec est ignorée (`degraded`), et la réponse
+    partielle n'est pas mise en cache.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request, product_id):
+        """Recommandations, en cache pour la version du catalogue et des deux index"""
+        versions = (product_id, catalog_version(request), index_version(), copurchase_table_state())
+        return cached_response(request, 'recs-hybrid', versions, lambda: self._recommend(request, product_id))
+
+    def _recommend(self, request, product_id):
+        try:
+            k = max(1, min(int(request.query_params.get('k', 6)), 50))  # Nombre de recommandations
+        except ValueError:
+            return Response({'detail': 'k must be an integer.'}, status=400)
+        result = hybrid_recommendations(product_id, k=k)
+        if result is None:
+            return Response({'detail': 'Product not found.'}, status=404)
+        ids, sources = result
+        degraded = any(state in ('timeout', 'busy', 'error') for state in sources.values())
+        serializer = ProductSerializer(_products_in_order(ids), many=True)
+        response = Response({
+            'recommendations': serializer.data,
+            'count': len(serializer.data),
+            'source': 'hybrid',
+            'sources': sources,  # État de chaque source : ok, empty, timeout, busy, error, disabled
+            'degraded': degraded,
+        })
+        if degraded:
+            response['Cache-Control'] = 'no-store'
+        return response
+
+
+class MyRecommendations(APIView):
+    """
+    Recommandations personnalisées de l'utilisateur connecté
+
+    Lues dans la table précalculée chaque nuit (`manage.py build_personal_recs`,
+    `api/recs_personal.py`) ; un utilisateur sans historique reçoit les
+    produits populaires.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            k = max(1, min(int(request.query_params.get('k', 12)), 50))  # Nombre de recommandations
+        except ValueError:
+            return Response({'detail': 'k must be an integer.'}, status=400)
+        ids, source = personal_recommendations(request.user.id, k=k)
+        serializer = ProductSerializer(_products_in_order(ids), many=True)
+        return Response({
+            'recommendations': serializer.data,
+            'count': len(serializer.data),
+            'source': source
+        })
+
+def _products_in_order(ids):
+    """Récupère des produits en une requête en conservant l'ordre des IDs donnés"""
+    position = {pid: i for i, pid in enumerate(ids)}
+    products = Product.objects.filter(id__in=ids)
+    return sorted(products, key=lambda p: position[p.id])
+
 # =============================================================================
 # PAIEMENTS STRIPE
 # =============================================================================
@@ -375,11 +724,12 @@ def mark_order_paid(request, order_id):
     if not payment_id:
         return JsonResponse({'error': 'Payment ID is missing'}, status=400)
     
-    # Marquage de la commande comme payée
-    order.status = 'COMPLETED'
-    order.payment_completed = True
-    order.payement_id = payment_id
-    order.save()
+    # Marquage de la commande comme payée (le stock réservé est vendu)
+    if not confirm_payment(order, payment_id):
+        return JsonResponse({
+            'error': 'Reservation expired and stock is no longer available; payment recorded for refund',
+            'payment_id': payment_id,
+        }, status=409)
     
     return JsonResponse({
         'message': 'Order marked as paid successfully', 
@@ -538,18 +888,21 @@ def ipaymoney_callback(request):
         if status_lower in ['succeeded', 'success', 'completed', 'paid', 'validated']:
             print(f"✅ PAIEMENT RÉUSSI - Mise à jour de la commande {order.id}")
             
-            # Mettre à jour la commande
-            order.status = 'COMPLETED'
-            order.payment_completed = True
-            order.payement_id = reference or external_reference
-            order.payment_method = 'ipaymoney'
-            
-            # Si vous avez un champ paid_at
-            if hasattr(order, 'paid_at'):
-                from django.utils import timezone
-                order.paid_at = timezone.now()
-            
-            order.save()
+            # Mettre à jour la commande (idempotent : le webhook peut être rejoué)
+            if not confirm_payment(order, reference or external_reference):
+                # Paiement enregistré, commande annulée et marquée à rembourser
+                logger.error(
+                    'Paiement IpayMoney %s reçu pour la commande %s non validée (%s) : remboursement requis',
+                    order.payement_id, order.id, order.status,
+                )
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Réservation expirée, stock épuisé : paiement enregistré pour remboursement',
+                    'order_id': order.id,
+                    'order_status': order.status,
+                    'payment_reference': order.payement_id,
+                    'refund_required': order.refund_required,
+                }, status=409)
             
             print(f"🎉 Commande {order.id} marquée comme COMPLETED")
             print(f"💰 Référence paiement: {order.payement_id}")
@@ -565,9 +918,7 @@ def ipaymoney_callback(request):
         elif status_lower in ['failed', 'cancelled', 'error', 'rejected']:
             print(f"❌ PAIEMENT ÉCHOUÉ - Commande {order.id}")
             
-            order.status = 'CANCELLED'
-            order.payment_completed = False
-            order.save()
+            cancel_order(order)  # Rend le stock réservé
             
             return JsonResponse({
                 'success': True, 
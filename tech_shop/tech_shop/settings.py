@@ -158,6 +158,12 @@ REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": 'rest_framework.pagination.PageNumberPagination',
     "PAGE_SIZE": 8  # 8 éléments par page
 }
+# Total de la liste admin des commandes : 'exact' (COUNT(*)) ou 'estimated'
+# (statistiques du planificateur PostgreSQL) ; surchargeable par ?count=
+ADMIN_ORDERS_COUNT_MODE = config("ADMIN_ORDERS_COUNT_MODE", default="exact")
+# Durée de réservation du stock d'une commande impayée (voir `api/checkout.py`) ;
+# les réservations expirées sont libérées par `manage.py release_expired_reservations`
+CHECKOUT_RESERVATION_MINUTES = config("CHECKOUT_RESERVATION_MINUTES", default=15, cast=int)
 
 # =============================================================================
 # CONFIGURATION CORS (CROSS-ORIGIN RESOURCE SHARING)
@@ -238,6 +244,113 @@ SOCIALACCOUNT_STORE_TOKENS = True  # Stockage des tokens OAuth
 # Clé secrète Stripe récupérée depuis les variables d'environnement
 STRIPE_SECRET_KEY = config("STRIPE_SECRET_KEY")
 
+# =============================================================================
+# CACHES (api/response_cache.py)
+# =============================================================================
+# L1 : mémoire du processus ; L2 ('shared') : partagé entre workers, Redis si
+# CACHE_REDIS_URL est défini (paquet `redis` requis), sinon fichiers sur disque
+CACHE_REDIS_URL = config("CACHE_REDIS_URL", default="")
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tech-shop-l1',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_REDIS_URL,
+    } if CACHE_REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': config("CACHE_FILE_LOCATION", default=str(BASE_DIR / 'response_cache')),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+# Cache des réponses publiques (produits, avis, recommandations)
+RESPONSE_CACHE_ENABLED = config("RESPONSE_CACHE_ENABLED", default=True, cast=bool)
+RESPONSE_CACHE_TIMEOUT = config("RESPONSE_CACHE_TIMEOUT", default=300, cast=int)  # L2, secondes
+RESPONSE_CACHE_L1_TIMEOUT = config("RESPONSE_CACHE_L1_TIMEOUT", default=60, cast=int)  # L1, secondes
+# Attente maximale du calcul d'une réponse par un autre processus (single-flight)
+RESPONSE_CACHE_LOCK_WAIT = config("RESPONSE_CACHE_LOCK_WAIT", default=5.0, cast=float)
+
+# =============================================================================
+# CONFIGURATION DES RECOMMANDATIONS (TF-IDF)
+# =============================================================================
+# Format de stockage de l'index : 'joblib' (historique) ou 'npy' (tableaux
+# bruts ouverts en mmap, partagés entre les workers via le cache disque)
+RECS_TFIDF_STORAGE = config("RECS_TFIDF_STORAGE", default="joblib")
+# Quantification des poids de la matrice (format npy uniquement) : '' ou 'int8'
+RECS_TFIDF_QUANTIZE = config("RECS_TFIDF_QUANTIZE", default="")
+# Maintenance incrémentale sur création/modification/suppression de produit
+RECS_TFIDF_INCREMENTAL = config("RECS_TFIDF_INCREMENTAL", default=True, cast=bool)
+# Compaction du delta quand (ajouts + suppressions) / taille de l'index dépasse ce seuil
+RECS_TFIDF_COMPACT_THRESHOLD = config("RECS_TFIDF_COMPACT_THRESHOLD", default=0.2, cast=float)
+# Ré-apprentissage complet des poids IDF au plus tard toutes les N secondes
+RECS_TFIDF_REFIT_INTERVAL = config("RECS_TFIDF_REFIT_INTERVAL", default=24 * 3600, cast=int)
+# Processus de tokenisation lors d'une construction complète (1 = sans pool)
+RECS_TFIDF_BUILD_WORKERS = config("RECS_TFIDF_BUILD_WORKERS", default=1, cast=int)
+# Nombre de produits par lot lu en flux et tokenisé par un processus
+RECS_TFIDF_SHARD_SIZE = config("RECS_TFIDF_SHARD_SIZE", default=5000, cast=int)
+# Construction de l'index en arrière-plan quand une requête le trouve absent
+# (False : l'index n'est construit que par `manage.py build_recs_index`)
+RECS_TFIDF_AUTO_BUILD = config("RECS_TFIDF_AUTO_BUILD", default=True, cast=bool)
+# Moteur de /api/products/search/ : 'tfidf' (classement par pertinence via
+# l'index des recommandations) ou 'orm' (icontains, sans classement)
+PRODUCT_SEARCH_ENGINE = config("PRODUCT_SEARCH_ENGINE", default="tfidf")
+# Moteur de recherche des voisins : 'exact' (cosinus sur tout le catalogue) ou
+# 'ann' (index LSH approximatif, à construire avec build_recs_index --engine ann)
+RECS_TFIDF_ENGINE = config("RECS_TFIDF_ENGINE", default="exact")
+# Compartiments voisins visités par table LSH (plus = meilleur rappel, plus lent)
+RECS_ANN_PROBES = config("RECS_ANN_PROBES", default=4, cast=int)
+
+# =============================================================================
+# RECOMMANDATIONS « ACHETÉS ENSEMBLE » (api/recs_copurchase.py)
+# =============================================================================
+# Normalisation des co-occurrences : 'cosine' ou 'lift'
+RECS_COPURCHASE_MEASURE = config("RECS_COPURCHASE_MEASURE", default="cosine")
+# Voisins conservés par produit
+RECS_COPURCHASE_TOPK = config("RECS_COPURCHASE_TOPK", default=20, cast=int)
+# Nombre minimal de commandes communes pour retenir une paire de produits
+RECS_COPURCHASE_MIN_SUPPORT = config("RECS_COPURCHASE_MIN_SUPPORT", default=2, cast=int)
+
+# =============================================================================
+# RECOMMANDATIONS HYBRIDES (api/recs_hybrid.py)
+# =============================================================================
+# Poids des signaux dans le score (0 = source non interrogée)
+RECS_HYBRID_WEIGHTS = {
+    'tfidf': config("RECS_HYBRID_WEIGHT_TFIDF", default=0.45, cast=float),
+    'copurchase': config("RECS_HYBRID_WEIGHT_COPURCHASE", default=0.35, cast=float),
+    'price': config("RECS_HYBRID_WEIGHT_PRICE", default=0.1, cast=float),
+    'rating': config("RECS_HYBRID_WEIGHT_RATING", default=0.1, cast=float),
+}
+# Temps (ms) accordé aux index TF-IDF et co-achats ; une source en retard est ignorée
+RECS_HYBRID_BUDGET_MS = config("RECS_HYBRID_BUDGET_MS", default=150, cast=float)
+
+# =============================================================================
+# RECOMMANDATIONS PERSONNALISÉES (api/recs_personal.py)
+# =============================================================================
+# Produits précalculés par utilisateur
+RECS_PERSONAL_TOPN = config("RECS_PERSONAL_TOPN", default=50, cast=int)
+# Processus de calcul du build nocturne (1 = sans pool)
+RECS_PERSONAL_WORKERS = config("RECS_PERSONAL_WORKERS", default=2, cast=int)
+# Demi-vie (jours) du poids d'un achat ou d'un avis dans le profil
+RECS_PERSONAL_HALF_LIFE_DAYS = config("RECS_PERSONAL_HALF_LIFE_DAYS", default=90, cast=float)
+# Fenêtre (jours) des ventes de la liste populaire (démarrage à froid)
+RECS_PERSONAL_POPULAR_DAYS = config("RECS_PERSONAL_POPULAR_DAYS", default=30, cast=int)
+
+# =============================================================================
+# INSTANTANÉ DU CATALOGUE EN MÉMOIRE (api/catalog.py)
+# =============================================================================
+# Intervalle maximal (secondes) entre deux vérifications de la version du catalogue
+CATALOG_SNAPSHOT_MAX_AGE = config("CATALOG_SNAPSHOT_MAX_AGE", default=1.0, cast=float)
+# Rechargement complet au plus tard toutes les N secondes
+CATALOG_SNAPSHOT_FULL_REFRESH = config("CATALOG_SNAPSHOT_FULL_REFRESH", default=300, cast=int)
+
+# =============================================================================
+# AUTOCOMPLÉTION (api/suggest.py)
+# =============================================================================
+# Intervalle minimal (secondes) entre deux rejeux du journal des modifications
+SUGGEST_SYNC_INTERVAL = config("SUGGEST_SYNC_INTERVAL", default=1.0, cast=float)
+
 
 
 GDAL_LIBRARY_PATH = 'C:/Program Files/GDAL/gdal.dll'
@@ -59,6 +59,7 @@ urlpatterns = [
     path('api/products/', AdminProductView.as_view(), name='admin_product'),  # Gestion produits admin (CREATE)
     path('api/products/<int:pk>/', AdminEditProductView.as_view(), name='admin_product_detail'),  # Édition produit admin (UPDATE/DELETE)
     path('api/products/search/', ProductSearchView.as_view(), name='product-search'),  # RECHERCHE DE PRODUITS
+    path('api/products/suggest/', ProductSuggestView.as_view(), name='product-suggest'),  # AUTOCOMPLÉTION
     
     # -------------------------------------------------------------------------
     # PANIER D'ACHAT
@@ -94,6 +95,14 @@ urlpatterns = [
     path('api/products/<int:product_id>/recommendations/', ProductRecommendations.as_view(), name='product_recommendations'),
     # Système de recommandation utilisant TF-IDF
     path('api/products/<int:product_id>/recommendations_tfidf/', TFIDFRecommendations.as_view(), name='product_recommendations_tfidf'),
+    # Recommandations TF-IDF pour plusieurs produits à la fois (panier, commande)
+    path('api/products/recommendations_tfidf/', TFIDFBatchRecommendations.as_view(), name='products_recommendations_tfidf_batch'),
+    # Recommandations « achetés ensemble » (historique des commandes payées)
+    path('api/products/<int:product_id>/recommendations_copurchase/', CopurchaseRecommendations.as_view(), name='product_recommendations_copurchase'),
+    # Recommandations hybrides (texte, co-achats, prix et notes)
+    path('api/products/<int:product_id>/recommendations_hybrid/', HybridRecommendations.as_view(), name='product_recommendations_hybrid'),
+    # Recommandations personnalisées de l'utilisateur connecté (précalculées)
+    path('api/me/recommendations/', MyRecommendations.as_view(), name='my_recommendations'),
     
     # -------------------------------------------------------------------------
     # INCLUSION DES URLS DU ROUTER (VIEWSETS)